@@ -1,7 +1,9 @@
 ﻿using System;
+using System.IO;
 using System.Net.Http;
 using System.Net.Http.Headers;
 using System.Text;
+using System.Threading;
 using System.Threading.Tasks;
 using Newtonsoft.Json;
 
@@ -11,6 +13,10 @@ public class MpesaClient
     private string _token;
     private string _userName;
     private decimal _currentBalance;
+    // Set while the balance stream is connected and keeping _currentBalance up to date
+    private volatile bool _streaming;
+    private readonly HttpClient _streamClient;
+    private CancellationTokenSource _streamCancel;
 
     public MpesaClient()
     {
@@ -19,6 +25,13 @@ public class MpesaClient
         _client.DefaultRequestHeaders.Accept.Add(
             new MediaTypeWithQualityHeaderValue("application/json")
         );
+
+        // The stream stays open, so it must not time out
+        _streamClient = new HttpClient { Timeout = Timeout.InfiniteTimeSpan };
+        _streamClient.BaseAddress = _client.BaseAddress;
+        _streamClient.DefaultRequestHeaders.Accept.Add(
+            new MediaTypeWithQualityHeaderValue("text/event-stream")
+        );
     }
 
     public async Task<bool> Login(string phoneNumber, string pin)
@@ -48,9 +61,12 @@ public class MpesaClient
 
             _client.DefaultRequestHeaders.Authorization =
                 new AuthenticationHeaderValue("Token", _token);
+            _streamClient.DefaultRequestHeaders.Authorization =
+                new AuthenticationHeaderValue("Token", _token);
 
             // Get initial balance
             await GetBalance();
+            StartBalanceStream();
 
             return true;
         }
@@ -63,6 +79,12 @@ public class MpesaClient
 
     public async Task<decimal> GetBalance()
     {
+        if (_streaming)
+        {
+            // Pushed by the server, no request needed
+            return _currentBalance;
+        }
+
         try
         {
             var response = await _client.GetAsync("transactions/balance/");
@@ -263,6 +285,100 @@ public class MpesaClient
         }
     }
 
+    // Follows transactions/stream/ so the balance stays current without
+    // polling. Only ASGI servers serve it; elsewhere GetBalance keeps asking.
+    public void StartBalanceStream()
+    {
+        // A new login replaces the previous account's stream
+        StopBalanceStream();
+        _streamCancel = new CancellationTokenSource();
+        _ = Task.Run(() => FollowBalanceStream(_streamCancel.Token));
+    }
+
+    public void StopBalanceStream()
+    {
+        _streamCancel?.Cancel();
+        _streaming = false;
+    }
+
+    private async Task FollowBalanceStream(CancellationToken cancel)
+    {
+        var delay = TimeSpan.FromSeconds(5);
+        while (!cancel.IsCancellationRequested)
+        {
+            try
+            {
+                using var response = await _streamClient.GetAsync(
+                    "transactions/stream/", HttpCompletionOption.ResponseHeadersRead, cancel);
+                int status = (int)response.StatusCode;
+                if (!response.IsSuccessStatusCode && status != 429 && status < 500)
+                {
+                    // Not served here (WSGI) or no longer logged in; the next
+                    // login starts a new stream
+                    return;
+                }
+                if (!response.IsSuccessStatusCode)
+                {
+                    // Throttled or the server is in trouble: back off and retry
+                    var retryAfter = response.Headers.RetryAfter?.Delta;
+                    if (retryAfter > delay)
+                    {
+                        delay = retryAfter.Value;
+                    }
+                    throw new HttpRequestException($"Balance stream answered {status}");
+                }
+
+                using var reader = new StreamReader(await response.Content.ReadAsStreamAsync(cancel));
+                delay = TimeSpan.FromSeconds(5);
+                string line;
+                while ((line = await reader.ReadLineAsync(cancel)) != null)
+                {
+                    if (!line.StartsWith("data: "))
+                    {
+                        continue;
+                    }
+                    var data = JsonConvert.DeserializeObject<dynamic>(line.Substring(6));
+                    if (data.balance == null)
+                    {
+                        // Nothing changed for a queued transfer that failed;
+                        // a payment into balance buckets has no balance yet,
+                        // so ask for it until the stream sends one again
+                        if (data.status == "COMPLETED")
+                        {
+                            _streaming = false;
+                        }
+                        continue;
+                    }
+                    decimal balance;
+                    if (decimal.TryParse(Convert.ToString(data.balance), out balance))
+                    {
+                        _currentBalance = balance;
+                        _streaming = true;
+                    }
+                }
+            }
+            catch (OperationCanceledException) when (cancel.IsCancellationRequested)
+            {
+                return;
+            }
+            catch (Exception)
+            {
+                // Dropped or refused; reconnect below
+            }
+
+            _streaming = false;
+            try
+            {
+                await Task.Delay(delay, cancel);
+            }
+            catch (OperationCanceledException)
+            {
+                return;
+            }
+            delay = TimeSpan.FromSeconds(Math.Min(delay.TotalSeconds * 2, 60));
+        }
+    }
+
     public string GetUserName() => _userName;
     public decimal GetCurrentBalance() => _currentBalance;
 }
@@ -355,6 +471,7 @@ class Program
                     Console.ReadKey();
                     break;
                 case "6":
+                    client.StopBalanceStream();
                     running = false;
                     break;
                 default:
@@ -11,6 +11,7 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mpesa_system.settings')
+# The ASGI profile serves the read-heavy endpoints from async-native views
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mpesa_system.settings_asgi')
 
 application = get_asgi_application()
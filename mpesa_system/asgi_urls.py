@@ -0,0 +1,16 @@
+# ========================================
+# ASGI profile urls.py
+# ========================================
+# Serves the read-heavy transaction endpoints from async-native views
+# (my_app/async_views.py) in front of the regular API, plus the push stream
+# (my_app/push.py), which needs ASGI. Used by mpesa_system.settings_asgi.
+from django.urls import path
+from my_app import async_views
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/transactions/balance/', async_views.balance),
+    path('api/transactions/history/', async_views.history),
+    path('api/transactions/stream/', async_views.stream),
+    path('api/transactions/<uuid:pk>/', async_views.transaction_detail),
+] + sync_urlpatterns
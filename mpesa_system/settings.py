@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'my_app.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -81,6 +83,8 @@ WSGI_APPLICATION = 'mpesa_system.wsgi.application'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 # Database
+# Development settings: a new connection per request. Production uses the
+# pooled profile in settings_production.py
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -92,6 +96,87 @@ DATABASES = {
     }
 }
 
+# Read replicas: aliases in DATABASES that read-only views and admin
+# changelists read from (see my_app/routers.py). Users who just moved money
+# read from the primary for REPLICA_PIN_SECONDS. To try it locally, add e.g.
+#   'replica': {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+# and list 'replica' here.
+DATABASE_ROUTERS = ['my_app.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_PIN_CACHE_ALIAS = 'default'
+REPLICA_PIN_SECONDS = 10
+
+# Cache
+# Local memory is per process; point this at a shared backend (e.g. Redis)
+# when running several workers so they see each other's entries
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'mpesa-default',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    }
+}
+
+# Token -> user lookups cached by CachingTokenAuthentication. Saving a user
+# drops its entries, but QuerySet.update() sends no signal: a user deactivated
+# that way keeps authenticating for up to the TTL unless the caller also runs
+# authentication.forget_user_tokens()
+AUTH_TOKEN_CACHE_ALIAS = 'default'
+AUTH_TOKEN_CACHE_TTL = 300  # seconds
+
+# Rate limit counters (see my_app/throttling.py); budgets are per process
+# unless this cache is shared (Redis, Memcached)
+THROTTLE_CACHE_ALIAS = 'default'
+
+# Idempotency-Key handling for money-moving endpoints
+IDEMPOTENCY_CACHE_ALIAS = 'default'
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24  # seconds
+
+# Phone number -> receiver cache used by transfers, per process (see
+# my_app/receivers.py)
+RECEIVER_CACHE_SIZE = 10000
+RECEIVER_CACHE_TTL = 300  # seconds
+
+# Queue send_money transfers as PENDING transactions for the
+# process_transfers workers instead of applying them within the request
+# (see my_app/transfer_queue.py)
+QUEUED_TRANSFERS = False
+
+# Transaction callbacks delivered by the dispatch_callbacks command (see
+# my_app/callbacks.py)
+CALLBACKS_ENABLED = True
+CALLBACK_BATCH_SIZE = 100  # events per request
+CALLBACK_TIMEOUT = 10  # seconds
+CALLBACK_MAX_ATTEMPTS = 10
+CALLBACK_RETRY_SECONDS = 10  # first retry; doubles up to the maximum
+CALLBACK_MAX_RETRY_SECONDS = 3600
+# Callback URLs must resolve to public addresses unless this is set
+CALLBACK_ALLOW_PRIVATE_NETWORKS = False
+
+# Broker that pushes ledger events to /api/transactions/stream/ clients (see
+# my_app/push.py); None turns pushing off. The local broker only reaches
+# clients of the process that made the transaction
+PUSH_BROKER = 'my_app.push.LocalBroker'
+
+# Node id (0-1023) embedded in transaction codes; must differ between
+# concurrently running processes. Left unset, each process leases one from
+# TRANSACTION_CODE_CACHE_ALIAS, which must then be a cache shared by every
+# process (`check --deploy` warns about the local-memory one). Can also be
+# set per process with the TRANSACTION_CODE_NODE_ID environment variable.
+# See my_app/codes.py.
+TRANSACTION_CODE_NODE_ID = None
+TRANSACTION_CODE_CACHE_ALIAS = 'default'
+TRANSACTION_CODE_NODE_LEASE_SECONDS = 60
+
+# Per-request metrics served at /metrics (see my_app/metrics.py). Only the
+# addresses in METRICS_ALLOWED_IPS may scrape; every other client gets 403.
+# Loopback only by default: add the Prometheus server's address to scrape
+# from another host.
+METRICS_ENABLED = True
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
 # Custom User Model
 AUTH_USER_MODEL = 'my_app.User'
 
@@ -114,6 +199,38 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# PIN hashing (see my_app/hashers.py). The first hasher is used for new and
+# rehashed PINs; the others verify existing hashes, which are upgraded to the
+# first one on the next successful login.
+PASSWORD_HASHERS = [
+    'my_app.hashers.PinScryptHasher',
+    'my_app.hashers.PinArgon2Hasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# A quarter of Django's scrypt cost: about 16 ms and 4 MiB per verify on one
+# core (`benchmark pin_hashing`), against about 65 ms and 16 MiB at 2 ** 14
+PIN_SCRYPT_PARAMS = {
+    'work_factor': 2 ** 12,
+    'block_size': 8,
+    'parallelism': 1,
+}
+
+# Only used if PinArgon2Hasher is moved first (requires argon2-cffi)
+PIN_ARGON2_PARAMS = {
+    'time_cost': 2,
+    'memory_cost': 19 * 1024,  # KiB
+    'parallelism': 1,
+}
+
+# Per-account PIN attempt limit, enforced before any hashing
+LOGIN_MAX_FAILED_ATTEMPTS = 5
+LOGIN_LOCKOUT_SECONDS = 15 * 60
+
 # Internationalization
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'Africa/Nairobi'
@@ -129,7 +246,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'my_app.authentication.CachingTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -142,6 +259,18 @@ REST_FRAMEWORK = {
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
     ],
+    # Budgets per view throttle_scope (see my_app/throttling.py). Anonymous
+    # budgets are per address, which many mobile users can share behind
+    # carrier NAT; LOGIN_MAX_FAILED_ATTEMPTS is the strict per-account limit
+    'DEFAULT_THROTTLE_CLASSES': [
+        'my_app.throttling.SlidingWindowThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '60/min',
+        'register': '60/hour',
+        'money': '60/min',
+        'reads': '600/min',
+    },
 }
 
 # CORS settings - for development
@@ -175,4 +304,5 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'idempotency-key',
 ]
\ No newline at end of file
@@ -0,0 +1,21 @@
+"""
+ASGI deployment profile for mpesa_system.
+
+Used by asgi.py, e.g.:
+
+    uvicorn mpesa_system.asgi:application --workers 4
+
+Everything comes from settings.py except what differs under an event loop.
+"""
+from .settings import *  # noqa: F401,F403
+
+# Async-native balance, history and transaction detail endpoints, and the
+# push stream; with more than one worker process, PUSH_BROKER must be a
+# broker shared between them
+ROOT_URLCONF = 'mpesa_system.asgi_urls'
+
+# Async ORM calls run in a per-request thread, so persistent connections
+# would pile up one per thread; open one per request instead and put a
+# pooler (pgbouncer) in front of Postgres for high connection counts
+for database in DATABASES.values():  # noqa: F405
+    database['CONN_MAX_AGE'] = 0
@@ -0,0 +1,74 @@
+"""
+Production database profile for mpesa_system.
+
+    DJANGO_SETTINGS_MODULE=mpesa_system.settings_production gunicorn mpesa_system.wsgi
+
+Each worker process keeps a psycopg 3 connection pool (Django's native
+``pool`` option, requires ``pip install "psycopg[binary,pool]"``) instead of
+connecting to Postgres on every request. Connections are checked before
+they are handed out, so ones dropped by the server or a proxy are replaced
+rather than failing the request.
+
+Everything comes from settings.py except the database, which is read from
+the environment:
+
+    DB_NAME, DB_USER, DB_PASSWORD,
+    DB_HOST, DB_PORT        connection (defaults: settings.py)
+    DB_POOL                 0 to use persistent connections instead (default 1)
+    DB_POOL_MIN_SIZE        connections kept open per process (default 2)
+    DB_POOL_MAX_SIZE        most connections per process (default 10)
+    DB_POOL_TIMEOUT         seconds to wait for a free connection (default 10)
+    DB_POOL_MAX_IDLE        seconds before idle connections above the
+                            minimum are closed (default 300)
+    DB_POOL_MAX_LIFETIME    seconds before a connection is replaced (default 1800)
+    DB_CONN_MAX_AGE         persistent connection lifetime without a pool (default 60)
+    DB_REPLICA_HOST,
+    DB_REPLICA_PORT         read replica (see my_app/routers.py); same name,
+                            credentials and pool settings as the primary
+
+Keep worker processes x DB_POOL_MAX_SIZE below Postgres' max_connections.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+database = DATABASES['default']  # noqa: F405
+database.update({
+    'NAME': os.environ.get('DB_NAME', database['NAME']),
+    'USER': os.environ.get('DB_USER', database['USER']),
+    'PASSWORD': os.environ.get('DB_PASSWORD', database['PASSWORD']),
+    'HOST': os.environ.get('DB_HOST', database['HOST']),
+    'PORT': os.environ.get('DB_PORT', database['PORT']),
+})
+
+if env_int('DB_POOL', 1):
+    from psycopg_pool import ConnectionPool
+
+    # The pool replaces persistent connections; Django requires CONN_MAX_AGE = 0
+    database['CONN_MAX_AGE'] = 0
+    database.setdefault('OPTIONS', {})['pool'] = {
+        'min_size': env_int('DB_POOL_MIN_SIZE', 2),
+        'max_size': env_int('DB_POOL_MAX_SIZE', 10),
+        'timeout': env_int('DB_POOL_TIMEOUT', 10),
+        'max_idle': env_int('DB_POOL_MAX_IDLE', 300),
+        'max_lifetime': env_int('DB_POOL_MAX_LIFETIME', 1800),
+        'check': ConnectionPool.check_connection,
+    }
+else:
+    database['CONN_MAX_AGE'] = env_int('DB_CONN_MAX_AGE', 60)
+    database['CONN_HEALTH_CHECKS'] = True
+
+if os.environ.get('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {  # noqa: F405
+        **database,
+        'HOST': os.environ['DB_REPLICA_HOST'],
+        'PORT': os.environ.get('DB_REPLICA_PORT', database['PORT']),
+        'OPTIONS': dict(database.get('OPTIONS', {})),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS = ['replica']
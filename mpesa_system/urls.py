@@ -4,8 +4,10 @@
 # ========================================
 from django.contrib import admin
 from django.urls import path, include
+from my_app.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('my_app.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
\ No newline at end of file
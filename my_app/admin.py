@@ -6,8 +6,11 @@ from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
 import locale
-from django.db.models import Sum
-from .models import User, Transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from .models import User, Transaction, UserStats, DailyUserStats
+from .ledger import total_balance
+from .routers import replica_reads
 
 # Set locale for currency formatting
 try:
@@ -15,7 +18,19 @@ try:
 except:
     pass
 
-class UserAdmin(BaseUserAdmin):
+class ReplicaChangelistMixin:
+    """Run changelist reads (counts, filters, annotations) on a read replica"""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with replica_reads():
+            response = super().changelist_view(request, extra_context)
+            # The result list is only queried while the template renders
+            return response.render() if hasattr(response, 'render') else response
+
+
+class UserAdmin(ReplicaChangelistMixin, BaseUserAdmin):
     # Display options for list view
     list_display = ('phone_number', 'full_name', 'formatted_balance', 'is_active', 
                     'is_staff', 'created_at', 'recent_transactions')
@@ -35,7 +50,7 @@ class UserAdmin(BaseUserAdmin):
             'fields': ('full_name',)
         }),
         ('Account Information', {
-            'fields': ('balance', 'user_stats', 'is_active')
+            'fields': ('balance', 'balance_buckets', 'user_stats', 'is_active')
         }),
         ('Permissions', {
             'fields': ('is_staff', 'is_superuser', 'groups', 'user_permissions')
@@ -54,36 +69,43 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        # Sent transactions over the last 30 days, summed from the daily
+        # stats buckets in the changelist query itself
+        recent_sent = DailyUserStats.objects.filter(
+            user=OuterRef('pk'),
+            day__gt=timezone.localdate() - timedelta(days=30)
+        ).values('user').annotate(count=Sum('sent_count')).values('count')
+        return super().get_queryset(request).annotate(
+            recent_sent_count=Coalesce(Subquery(recent_sent), 0),
+            current_balance=total_balance()
+        )
+
     # Custom methods
     def formatted_balance(self, obj):
-        """Format balance with currency symbol"""
+        """Format balance, including any balance buckets, with currency symbol"""
         try:
-            return locale.currency(float(obj.balance), grouping=True)
+            return locale.currency(float(obj.current_balance), grouping=True)
         except:
-            return f"KSh {obj.balance:,.2f}"
+            return f"KSh {obj.current_balance:,.2f}"
     formatted_balance.short_description = 'Balance'
-    formatted_balance.admin_order_field = 'balance'
+    formatted_balance.admin_order_field = 'current_balance'
     
     def recent_transactions(self, obj):
         """Show recent transaction count"""
-        count = obj.sent_transactions.filter(
-            created_at__gte=timezone.now() - timedelta(days=30)
-        ).count()
+        count = obj.recent_sent_count
         url = reverse('admin:my_app_transaction_changelist') + f'?sender__id__exact={obj.id}'
         return format_html('<a href="{}">{} transactions</a>', url, count)
     recent_transactions.short_description = 'Last 30 Days'
+    recent_transactions.admin_order_field = 'recent_sent_count'
     
     def user_stats(self, obj):
         """Display user statistics"""
-        total_sent = obj.sent_transactions.filter(status='COMPLETED').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        total_received = obj.received_transactions.filter(status='COMPLETED').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        total_transactions = obj.sent_transactions.count() + obj.received_transactions.count()
+        # Maintained by the ledger on every completed transaction
+        stats = UserStats.objects.filter(user=obj).first() or UserStats(user=obj)
+        total_sent = stats.total_sent
+        total_received = stats.total_received
+        total_transactions = stats.sent_count + stats.received_count
         
         try:
             sent_formatted = locale.currency(float(total_sent), grouping=True)
@@ -119,7 +141,7 @@ class UserAdmin(BaseUserAdmin):
     user_stats.short_description = 'Statistics'
 
 
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(ReplicaChangelistMixin, admin.ModelAdmin):
     # Display options
     list_display = ('transaction_code', 'formatted_amount', 'transaction_type', 
                     'status_badge', 'sender_link', 'receiver_link', 'created_at')
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class MyAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'my_app'
+
+    def ready(self):
+        # Connect the token and receiver cache invalidation signal handlers
+        # and the per-request query timer (before any connection is opened)
+        from . import authentication, metrics, receivers  # noqa: F401
+        from .codes import check_node_ids
+        checks.register(check_node_ids, deploy=True)
@@ -0,0 +1,155 @@
+# my_app/async_views.py
+"""
+Async-native versions of the read-heavy transaction endpoints.
+
+Under ASGI every DRF view runs in a thread-sensitive sync executor; these
+views use the async ORM instead and produce the same JSON as
+TransactionViewSet. They are only routed in the ASGI profile
+(mpesa_system/asgi_urls.py). Methods other than GET/HEAD fall back to the
+regular sync views, so the URLs behave exactly as before.
+
+``stream`` has no sync counterpart: it holds its connection open to push
+events (see push.py), which only an event loop can afford.
+"""
+import asyncio
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+from .authentication import CachingTokenAuthentication
+from .models import Transaction, User
+from .pagination import KeysetPagination
+from . import ledger, push, routers, throttling
+from .serializers import (
+    TransactionSerializer, TransactionValuesSerializer,
+    TransactionFilterSerializer, BalanceSerializer
+)
+from .views import TransactionViewSet, user_transactions, filter_transactions
+
+
+def json_response(data, status=200, headers=None):
+    return JsonResponse(data, status=status, headers=headers, safe=False, encoder=JSONEncoder)
+
+
+def sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def async_api_view(sync_view):
+    """
+    Wrap an async view with token authentication and DRF-style errors.
+
+    The view receives a DRF ``Request`` (for ``query_params``) with ``user``
+    set. Requests count against the user's ``reads`` budget, like
+    TransactionViewSet's. Like DRF views the wrapper is CSRF exempt;
+    ``sync_view`` handles every method other than GET/HEAD.
+    """
+    authentication = CachingTokenAuthentication()
+
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            try:
+                credentials = await authentication.aauthenticate(request)
+                if credentials is None:
+                    raise exceptions.NotAuthenticated()
+                api_request = Request(request)
+                api_request.user, api_request.auth = credentials
+                wait = await sync_to_async(throttling.hit)(
+                    TransactionViewSet.throttle_scope, throttling.client_ident(request, api_request.user)
+                )
+                if wait is not None:
+                    raise exceptions.Throttled(wait)
+                # Same replica routing as TransactionViewSet's read actions
+                replica = bool(routers.get_replicas()) and not await routers.ais_pinned(api_request.user.pk)
+                with routers.replica_reads(replica):
+                    return await view_func(api_request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                headers = None
+                if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                    headers = {'WWW-Authenticate': authentication.authenticate_header(request)}
+                elif getattr(exc, 'wait', None):
+                    # As DRF's exception handler
+                    headers = {'Retry-After': '%d' % exc.wait}
+                detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                return json_response(detail, status=exc.status_code, headers=headers)
+        return csrf_exempt(wrapper)
+    return decorator
+
+
+@async_api_view(TransactionViewSet.as_view({'get': 'balance'}))
+async def balance(request):
+    # The authenticated user is cached without its balance; read it fresh
+    user = await User.objects.values('phone_number', 'full_name', current=ledger.total_balance()).aget(
+        pk=request.user.pk
+    )
+    return json_response(BalanceSerializer({**user, 'balance': user['current']}).data)
+
+
+@async_api_view(TransactionViewSet.as_view({'get': 'history'}))
+async def history(request):
+    filters = TransactionFilterSerializer(data=request.query_params)
+    filters.is_valid(raise_exception=True)
+    queryset = filter_transactions(user_transactions(request.user), filters.validated_data)
+
+    paginator = KeysetPagination()
+    view = TransactionViewSet
+    if filters.validated_data['fast']:
+        rows = TransactionValuesSerializer.values(queryset, *view.keyset_fields)
+        data = TransactionValuesSerializer(await paginator.apaginate_queryset(rows, request, view)).data
+    else:
+        page = await paginator.apaginate_queryset(queryset, request, view)
+        data = TransactionSerializer(page, many=True).data
+    return json_response(data, headers=paginator.get_link_headers())
+
+
+@async_api_view(TransactionViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'
+}))
+async def transaction_detail(request, pk):
+    try:
+        txn = await user_transactions(request.user).aget(pk=pk)
+    except Transaction.DoesNotExist:
+        raise exceptions.NotFound('No Transaction matches the given query.')
+    return json_response(TransactionSerializer(txn).data)
+
+
+@async_api_view(TransactionViewSet.as_view({'get': 'balance'}))
+async def stream(request):
+    """
+    Server-sent events for the authenticated account: a ``balance`` event,
+    then a ``transaction`` event per ledger entry as it commits
+    """
+    broker = push.get_broker()
+    if broker is None:
+        raise exceptions.NotFound('Push notifications are disabled.')
+    user_id = request.user.pk
+
+    async def events():
+        async with broker.subscribe(user_id) as subscription:
+            # Read after subscribing, so no transaction falls in between
+            balance = await sync_to_async(ledger.current_balance)(user_id)
+            # Streams are long-lived; do not hold a database connection for one
+            await sync_to_async(close_old_connections)()
+            yield sse_event('balance', {'balance': f'{balance:.2f}'})
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), push.KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield sse_event(message['event'], message['data'])
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
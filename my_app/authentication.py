@@ -0,0 +1,140 @@
+# my_app/authentication.py
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from .models import User
+
+# Never cached: balance must be read fresh and the PIN hash has no business
+# in a (possibly shared) cache. Reading either on a cached user loads it.
+UNCACHED_USER_FIELDS = ('balance', 'password')
+
+
+def get_cache():
+    return caches[getattr(settings, 'AUTH_TOKEN_CACHE_ALIAS', 'default')]
+
+
+def cache_key(token_key):
+    return f'auth-token:{token_key}'
+
+
+class CachingTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that caches the token -> user lookup.
+
+    The user is cached with ``balance`` deferred, so identity checks cost no
+    queries while ``request.user.balance`` still reads the current value from
+    the database. Entries are dropped when the token is deleted (logout) or
+    the user is saved (e.g. deactivated in the admin), and otherwise expire
+    after ``AUTH_TOKEN_CACHE_TTL`` seconds.
+
+    ``QuerySet.update()`` and bulk deletes send no signals: a user
+    deactivated that way keeps authenticating until the entry expires unless
+    the caller also runs ``forget_user_tokens``.
+    """
+
+    def get_token_queryset(self):
+        return Token.objects.select_related('user').defer(
+            *[f'user__{field}' for field in UNCACHED_USER_FIELDS]
+        )
+
+    def authenticate_credentials(self, key):
+        cache = get_cache()
+        user = cache.get(cache_key(key))
+        if user is None:
+            try:
+                token = self.get_token_queryset().get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            user = token.user
+            cache.set(cache_key(key), user, getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 300))
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return (user, key)
+
+    async def aauthenticate(self, request):
+        """``authenticate`` for plain Django async views (see async_views.py)"""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed('Invalid token header. No credentials provided.')
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain spaces.')
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(
+                'Invalid token header. Token string should not contain invalid characters.'
+            )
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        cache = get_cache()
+        user = await cache.aget(cache_key(key))
+        if user is None:
+            try:
+                token = await self.get_token_queryset().aget(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            user = token.user
+            await cache.aset(cache_key(key), user, getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 300))
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return (user, key)
+
+
+def failed_logins_key(phone_number):
+    return f'login-failures:{phone_number}'
+
+
+def ensure_login_allowed(phone_number):
+    """
+    Refuse to check a PIN once an account has too many recent failures.
+
+    Checked before ``authenticate`` so a locked account costs no hashing.
+    """
+    limit = getattr(settings, 'LOGIN_MAX_FAILED_ATTEMPTS', 5)
+    if (get_cache().get(failed_logins_key(phone_number)) or 0) >= limit:
+        raise exceptions.Throttled(detail='Too many failed PIN attempts. Try again later.')
+
+
+def record_failed_login(phone_number):
+    cache = get_cache()
+    key = failed_logins_key(phone_number)
+    # The window starts at the first failure and is not extended by later ones
+    cache.add(key, 0, getattr(settings, 'LOGIN_LOCKOUT_SECONDS', 15 * 60))
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.add(key, 1, getattr(settings, 'LOGIN_LOCKOUT_SECONDS', 15 * 60))
+
+
+def reset_failed_logins(phone_number):
+    get_cache().delete(failed_logins_key(phone_number))
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    get_cache().delete(cache_key(instance.key))
+
+
+def forget_user_tokens(user_ids):
+    """Drop cached lookups for these users' tokens, e.g. after a bulk update"""
+    keys = Token.objects.filter(user_id__in=user_ids).values_list('key', flat=True)
+    get_cache().delete_many([cache_key(key) for key in keys])
+
+
+@receiver(post_save, sender=User)
+def forget_tokens_of_saved_user(sender, instance, created, **kwargs):
+    if created:
+        return
+    forget_user_tokens([instance.pk])
@@ -0,0 +1,838 @@
+# my_app/benchmarks.py
+"""
+Benchmark scenarios run by ``python manage.py benchmark``.
+
+Each scenario is registered with ``@scenario`` and receives the command
+options; it returns a dict of metrics which the command prints.
+"""
+import asyncio
+import functools
+import http.server
+import itertools
+import json
+import pickle
+import random
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client, override_settings
+from django.test.testcases import LiveServerThread
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.throttling import ScopedRateThrottle
+
+from . import callbacks, ledger, push, receivers, throttling, transfer_queue
+from .authentication import CachingTokenAuthentication
+from .codes import TransactionCodeGenerator
+from .models import User, Transaction, CallbackEndpoint, TransactionEvent
+from .serializers import BulkSendSerializer, TransactionSerializer, TransactionValuesSerializer
+from .views import TransactionViewSet
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+# Numbers phone numbers across scenarios, which share one database per run
+_user_serials = itertools.count()
+
+
+def make_users(count, balance=Decimal('0.00'), prefix='+2547'):
+    """Bulk insert ``count`` users sharing one precomputed PIN hash"""
+    password = make_password('0000')
+    users = []
+    for _ in range(count):
+        i = next(_user_serials)
+        users.append(User(
+            phone_number=f'{prefix}{i:08d}',
+            full_name=f'Benchmark User {i}',
+            password=password,
+            balance=balance
+        ))
+    User.objects.bulk_create(users, batch_size=1000)
+    return users
+
+
+def client_for(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def rate(count, elapsed):
+    return round(count / elapsed, 1) if elapsed else None
+
+
+class QueryCounter:
+    """execute_wrapper that counts queries without keeping their SQL; thread safe"""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(func, repeat=5):
+    """Best wall time in milliseconds and query count of ``func()``"""
+    best = None
+    for _ in range(repeat):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 2), counter.count
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def status_of(response):
+    return getattr(response, 'status_code', response)
+
+
+def load_profile(samples, elapsed, errors=0):
+    """Throughput and p50/p95/p99 latency in ms of one run"""
+    return {
+        'requests': len(samples),
+        'requests_per_sec': rate(len(samples), elapsed),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'errors': errors,
+    }
+
+
+def latency_profile(func, count):
+    """Run ``func()`` ``count`` times in this thread; load_profile plus queries/call"""
+    samples = []
+    errors = 0
+    counter = QueryCounter()
+    started = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        for _ in range(count):
+            start = time.perf_counter()
+            response = func()
+            samples.append(time.perf_counter() - start)
+            errors += status_of(response) is not None and status_of(response) >= 400
+    profile = load_profile(samples, time.perf_counter() - started, errors)
+    profile['queries_per_request'] = round(counter.count / count, 2)
+    return profile
+
+
+def threaded_load(connect, size, concurrency):
+    """
+    Send ``size`` requests from ``concurrency`` threads. Each thread calls
+    ``connect(slot)`` once for a function sending one request, then sends
+    its share of the requests in turn. Returns load_profile().
+    """
+    def connection_loop(slot, count):
+        send = connect(slot)
+        samples = []
+        errors = 0
+        for _ in range(count):
+            start = time.perf_counter()
+            status = status_of(send())
+            samples.append(time.perf_counter() - start)
+            errors += status >= 400
+        connections.close_all()
+        return samples, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        runs = list(pool.map(connection_loop, range(concurrency), _shares(size, concurrency)))
+    return load_profile(
+        [sample for samples, _ in runs for sample in samples],
+        time.perf_counter() - start,
+        sum(errors for _, errors in runs)
+    )
+
+
+@scenario('bulk_send')
+def bulk_send(size, **options):
+    """Single-item send_money requests vs one bulk_send request"""
+    sender, *receivers = make_users(size + 1, balance=Decimal('1000000.00'))
+    client = client_for(sender)
+
+    start = time.perf_counter()
+    for receiver in receivers:
+        client.post('/api/transactions/send_money/', {
+            'receiver_phone': receiver.phone_number,
+            'amount': '10.00',
+        }, format='json')
+    single_elapsed = time.perf_counter() - start
+
+    payload = {'transfers': [
+        {'receiver_phone': receiver.phone_number, 'amount': '10.00', 'description': 'Salary'}
+        for receiver in receivers
+    ]}
+    start = time.perf_counter()
+    client.post('/api/transactions/bulk_send/', payload, format='json')
+    bulk_elapsed = time.perf_counter() - start
+
+    return {
+        'transfers': size,
+        'single_transfers_per_sec': rate(size, single_elapsed),
+        'bulk_transfers_per_sec': rate(size, bulk_elapsed),
+        'speedup': round(single_elapsed / bulk_elapsed, 1) if bulk_elapsed else None,
+    }
+
+
+@scenario('serializers')
+def serializers(**options):
+    """Per-page cost of TransactionSerializer vs TransactionValuesSerializer"""
+    user, *others = make_users(11, balance=Decimal('1000000.00'))
+    items = [
+        {'receiver_phone': others[i % len(others)].phone_number, 'amount': Decimal('10.00')}
+        for i in range(1000)
+    ]
+    ledger.bulk_transfer(user, items)
+
+    # The queryset TransactionViewSet used before ledger entries/select_related
+    plain = Transaction.objects.filter(sender=user) | Transaction.objects.filter(receiver=user)
+    related = plain.select_related('sender', 'receiver')
+
+    result = {}
+    for rows in (20, 100, 1000):
+        result[f'{rows}_rows'] = {
+            'model_serializer': measure(
+                lambda: TransactionSerializer(plain[:rows], many=True).data),
+            'model_serializer_select_related': measure(
+                lambda: TransactionSerializer(related[:rows], many=True).data),
+            'values_serializer': measure(
+                lambda: TransactionValuesSerializer(TransactionValuesSerializer.values(plain)[:rows]).data),
+        }
+    result['format'] = '(milliseconds, queries)'
+    return result
+
+
+def _generate_codes(node_id, count):
+    generator = TransactionCodeGenerator(node_id=node_id)
+    start = time.perf_counter()
+    codes = [generator.next_code() for _ in range(count)]
+    return codes, time.perf_counter() - start
+
+
+@scenario('transaction_codes')
+def transaction_codes(size, workers, **options):
+    """Generate ``size`` codes in each of ``workers`` processes and check for collisions"""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        runs = list(pool.map(_generate_codes, range(workers), [size] * workers))
+
+    unique = set()
+    for codes, _ in runs:
+        unique.update(codes)
+    total = size * workers
+    return {
+        'codes': total,
+        'collisions': total - len(unique),
+        'codes_per_sec_per_process': rate(size, max(elapsed for _, elapsed in runs)),
+        'monotonic': all(codes == sorted(codes) for codes, _ in runs),
+    }
+
+
+@scenario('token_auth')
+def token_auth(size, **options):
+    """balance/ and history/ with TokenAuthentication vs CachingTokenAuthentication"""
+    user, = make_users(1)
+    token = Token.objects.create(user=user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    result = {}
+    for endpoint in ('balance', 'history'):
+        url = f'/api/transactions/{endpoint}/'
+        request = lambda: client.get(url)
+        for name, authentication in (('token', TokenAuthentication),
+                                     ('caching_token', CachingTokenAuthentication)):
+            cache.clear()
+            with mock.patch.object(TransactionViewSet, 'authentication_classes', [authentication]):
+                request()  # warm up
+                result[f'{endpoint}_{name}'] = latency_profile(request, size)
+    # balance/ reads the balance fresh on every request by design, so both
+    # strategies cost one query there; other endpoints lose the auth query
+    return result
+
+
+def _verifies_per_sec(hasher, seconds=1.0):
+    encoded = hasher.encode('1234', hasher.salt())
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        hasher.verify('1234', encoded)
+        count += 1
+    return rate(count, time.perf_counter() - start)
+
+
+@scenario('pin_hashing')
+def pin_hashing(size, **options):
+    """PIN verifies/sec on one core and login/ throughput per hasher"""
+    result = {}
+    for algorithm in ('pbkdf2_sha256', 'pin_scrypt', 'pin_argon2'):
+        hasher = get_hasher(algorithm)
+        try:
+            if hasher.library:
+                hasher._load_library()
+        except ValueError:
+            result[algorithm] = 'not installed'
+            continue
+        # make_password/check_password look hashers up by PASSWORD_HASHERS order
+        hashers = [f'{type(hasher).__module__}.{type(hasher).__name__}']
+        with override_settings(PASSWORD_HASHERS=hashers):
+            user, = make_users(1, prefix=f'+2541{len(result)}')
+            client = APIClient()
+            logins = min(size, 50)
+            start = time.perf_counter()
+            for _ in range(logins):
+                client.post('/api/auth/login/', {
+                    'phone_number': user.phone_number, 'pin': '0000'
+                }, format='json')
+            result[algorithm] = {
+                'verifies_per_sec_per_core': _verifies_per_sec(hasher),
+                'logins_per_sec': rate(logins, time.perf_counter() - start),
+            }
+    return result
+
+
+def _shares(total, parts):
+    """Split ``total`` requests over ``parts`` connections"""
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def wsgi_load(url, headers, size, concurrency):
+    """``concurrency`` threads, each sending its share of ``size`` GETs in turn"""
+    return threaded_load(
+        lambda slot: functools.partial(Client().get, url, headers=headers), size, concurrency
+    )
+
+
+def asgi_load(url, headers, size, concurrency):
+    """``concurrency`` coroutines on one event loop, each sending its share of GETs"""
+    client = AsyncClient()
+    samples = []
+    errors = 0
+
+    async def connection_loop(count):
+        nonlocal errors
+        for _ in range(count):
+            start = time.perf_counter()
+            response = await client.get(url, headers=headers)
+            samples.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+
+    async def run():
+        await asyncio.gather(*(connection_loop(count) for count in _shares(size, concurrency)))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    return load_profile(samples, time.perf_counter() - start, errors)
+
+
+@scenario('asgi_reads')
+def asgi_reads(size, workers, **options):
+    """balance/ and history/ under WSGI, ASGI with sync views and ASGI with async views
+
+    ``--workers`` is the number of concurrent connections, e.g. --workers 1000.
+    Requests go through Django's in-process handlers, so this compares the
+    request paths rather than a particular server.
+    """
+    user, *others = make_users(11, balance=Decimal('1000000.00'))
+    ledger.bulk_transfer(user, [
+        {'receiver_phone': others[i % len(others)].phone_number, 'amount': Decimal('10.00')}
+        for i in range(100)
+    ])
+    token = Token.objects.create(user=user)
+    headers = {'Authorization': f'Token {token.key}'}
+
+    result = {'concurrency': workers, 'requests': size}
+    for endpoint in ('balance', 'history'):
+        url = f'/api/transactions/{endpoint}/'
+        result[f'{endpoint}_wsgi'] = wsgi_load(url, headers, size, workers)
+        result[f'{endpoint}_asgi_sync_views'] = asgi_load(url, headers, size, workers)
+        with override_settings(ROOT_URLCONF='mpesa_system.asgi_urls'):
+            result[f'{endpoint}_asgi_async_views'] = asgi_load(url, headers, size, workers)
+    return result
+
+
+def _consume(response):
+    size = 0
+    for block in response.streaming_content:
+        size += len(block)
+    return size
+
+
+@scenario('statement_export')
+def statement_export(size, **options):
+    """Stream a ``size``-row statement as CSV and JSON Lines, e.g. --size 1000000"""
+    user, *others = make_users(101)
+    ledger.deposit(user, Decimal('100000000.00'))
+    batch = BulkSendSerializer.MAX_TRANSFERS
+    for start in range(0, size - 1, batch):
+        ledger.bulk_transfer(user, [
+            {'receiver_phone': others[i % len(others)].phone_number, 'amount': Decimal('1.00')}
+            for i in range(start, min(start + batch, size - 1))
+        ])
+    client = client_for(user)
+
+    result = {'rows': size}
+    for output in ('csv', 'jsonl'):
+        start = time.perf_counter()
+        response = client.get(f'/api/transactions/statement/?output={output}')
+        megabytes = _consume(response) / 1024 / 1024
+        elapsed = time.perf_counter() - start
+        result[output] = {
+            'rows_per_sec': rate(size, elapsed),
+            'megabytes': round(megabytes, 1),
+            'seconds': round(elapsed, 2),
+        }
+
+    # Separate run: tracing allocations slows the export down
+    tracemalloc.start()
+    _consume(client.get('/api/transactions/statement/'))
+    result['csv_peak_python_memory_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+    tracemalloc.stop()
+    return result
+
+
+class ApiWorkload:
+    """
+    Users, tokens and requests for the public API endpoints.
+
+    Each concurrent connection (slot) has its own funded sender, so
+    concurrent money transfers contend on the database rather than on one
+    hot account row.
+    """
+    ENDPOINTS = ('login', 'register', 'send_money', 'deposit', 'withdraw', 'balance', 'history')
+    # Endpoints that hash a PIN send at most this many requests
+    HASHING_ENDPOINTS = ('login', 'register')
+    MAX_HASHING_REQUESTS = 100
+
+    def __init__(self, slots):
+        *self.users, self.receiver = make_users(slots + 1, balance=Decimal('100000000.00'))
+        self.tokens = [Token.objects.create(user=user).key for user in self.users]
+        for user in self.users:
+            # A full first page of history
+            ledger.bulk_transfer(user, [
+                {'receiver_phone': self.receiver.phone_number, 'amount': Decimal('1.00')}
+            ] * 20)
+        self.registrations = itertools.count()
+
+    def requests_for(self, endpoint, size):
+        if endpoint in self.HASHING_ENDPOINTS:
+            return min(size, self.MAX_HASHING_REQUESTS)
+        return size
+
+    def request(self, endpoint, slot):
+        """(method, path, JSON body or None, headers) of one request"""
+        user = self.users[slot]
+        headers = {'Authorization': f'Token {self.tokens[slot]}'}
+        if endpoint == 'login':
+            return 'POST', '/api/auth/login/', {'phone_number': user.phone_number, 'pin': '0000'}, {}
+        if endpoint == 'register':
+            return 'POST', '/api/auth/register/', {
+                'phone_number': f'+2541{next(self.registrations):08d}',
+                'full_name': 'Benchmark Signup',
+                'pin': '0000',
+                'confirm_pin': '0000',
+            }, {}
+        if endpoint == 'send_money':
+            return 'POST', '/api/transactions/send_money/', {
+                'receiver_phone': self.receiver.phone_number, 'amount': '1.00'
+            }, headers
+        if endpoint in ('deposit', 'withdraw'):
+            return 'POST', f'/api/transactions/{endpoint}/', {'amount': '1.00'}, headers
+        return 'GET', f'/api/transactions/{endpoint}/', None, headers
+
+    def client_sender(self, endpoint, slot):
+        """Function sending one request through the Django test client"""
+        client = Client()
+
+        def send():
+            method, path, body, headers = self.request(endpoint, slot)
+            data = json.dumps(body) if body is not None else ''
+            return client.generic(method, path, data, content_type='application/json', headers=headers)
+        return send
+
+    def http_sender(self, base_url, endpoint, slot):
+        """Function sending one request over HTTP; returns the status code"""
+        def send():
+            method, path, body, headers = self.request(endpoint, slot)
+            request = urllib.request.Request(
+                base_url + path,
+                data=json.dumps(body).encode() if body is not None else None,
+                method=method,
+                headers={'Content-Type': 'application/json', **headers}
+            )
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    return response.status
+            except urllib.error.HTTPError as error:
+                error.read()
+                return error.code
+        return send
+
+
+@scenario('api')
+def api(size, **options):
+    """Every public endpoint through the in-process test client, one at a time"""
+    workload = ApiWorkload(1)
+    result = {}
+    for endpoint in ApiWorkload.ENDPOINTS:
+        send = workload.client_sender(endpoint, 0)
+        send()  # warm up
+        result[endpoint] = latency_profile(send, workload.requests_for(endpoint, size))
+    return result
+
+
+def pool_available():
+    if connection.vendor != 'postgresql':
+        return False
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    try:
+        import psycopg_pool  # noqa: F401
+    except ImportError:
+        return False
+    return is_psycopg3
+
+
+@contextmanager
+def connection_mode(mode, pool_size):
+    """Open a connection per request ('connect'), keep one per thread ('persistent') or pool them ('pooled')"""
+    settings_dict = connection.settings_dict
+    saved = settings_dict['CONN_MAX_AGE'], settings_dict['OPTIONS'].get('pool')
+    connections.close_all()
+    settings_dict['CONN_MAX_AGE'] = None if mode == 'persistent' else 0
+    settings_dict['OPTIONS'].pop('pool', None)
+    if mode == 'pooled':
+        settings_dict['OPTIONS']['pool'] = {'min_size': pool_size, 'max_size': pool_size}
+    try:
+        yield
+    finally:
+        connections.close_all()
+        if mode == 'pooled':
+            connection.close_pool()
+        settings_dict['CONN_MAX_AGE'], pool = saved
+        settings_dict['OPTIONS'].pop('pool', None)
+        if pool is not None:
+            settings_dict['OPTIONS']['pool'] = pool
+
+
+def closing_connections(send):
+    """
+    Close or recycle connections after each request like the request
+    handler does; the test client disconnects close_old_connections
+    """
+    def send_and_close():
+        response = send()
+        close_old_connections()
+        return response
+    return send_and_close
+
+
+@scenario('db_connections')
+def db_connections(size, workers, **options):
+    """balance/ throughput with a connection per request vs persistent vs pooled (PostgreSQL + psycopg 3) connections"""
+    workload = ApiWorkload(workers)
+    result = {'concurrency': workers}
+    opened = itertools.count()
+
+    def count_connections(sender, connection, **kwargs):
+        next(opened)
+
+    connection_created.connect(count_connections)
+    try:
+        for mode in ('connect', 'persistent', 'pooled'):
+            if mode == 'pooled' and not pool_available():
+                result[mode] = 'requires PostgreSQL with psycopg[pool]'
+                continue
+            with connection_mode(mode, workers):
+                start = next(opened)
+                result[mode] = threaded_load(
+                    lambda slot: closing_connections(workload.client_sender('balance', slot)), size, workers
+                )
+                if mode != 'pooled':
+                    # Pooled connections signal on every checkout
+                    result[mode]['connections_opened'] = next(opened) - start - 1
+    finally:
+        connection_created.disconnect(count_connections)
+    return result
+
+
+@contextmanager
+def live_server(counter):
+    """Serve the project over HTTP on a free port, counting queries in ``counter``"""
+    def count_queries(sender, connection, **kwargs):
+        connection.execute_wrappers.append(counter)
+
+    # Request threads open their own connections; count queries on all of them
+    connection_created.connect(count_queries)
+    server = LiveServerThread('localhost', lambda handler: handler)
+    server.daemon = True
+    server.start()
+    server.is_ready.wait()
+    try:
+        if server.error:
+            raise server.error
+        yield f'http://localhost:{server.port}'
+    finally:
+        connection_created.disconnect(count_queries)
+        server.terminate()
+        server.join()
+
+
+@scenario('api_live')
+def api_live(size, workers, **options):
+    """Every public endpoint over HTTP against a live threaded server, ``--workers`` connections at a time"""
+    workload = ApiWorkload(workers)
+    result = {'concurrency': workers}
+    counter = QueryCounter()
+    with live_server(counter) as base_url:
+        for endpoint in ApiWorkload.ENDPOINTS:
+            count = workload.requests_for(endpoint, size)
+            counter.count = 0
+            result[endpoint] = threaded_load(
+                lambda slot: workload.http_sender(base_url, endpoint, slot), count, workers
+            )
+            result[endpoint]['queries_per_request'] = round(counter.count / count, 2)
+    return result
+
+
+@scenario('queued_transfers')
+def queued_transfers(size, **options):
+    """send_money applied in the request vs queued, and queue throughput with 1, 4 and 16 worker processes"""
+    workload = ApiWorkload(1)
+    send = workload.client_sender('send_money', 0)
+    result = {'send_money': latency_profile(send, size)}
+    with override_settings(QUEUED_TRANSFERS=True):
+        result['send_money_queued'] = latency_profile(send, size)
+    transfer_queue.run_workers(1, poll_interval=0, until_empty=True)
+
+    # Enough accounts that concurrent batches rarely wait on each other's locks
+    accounts = make_users(1000, balance=Decimal('1000000.00'))
+    rng = random.Random(0)
+    for workers in (1, 4, 16):
+        for _ in range(size):
+            sender, receiver = rng.sample(accounts, 2)
+            ledger.enqueue_transfer(sender, receiver, Decimal('1.00'))
+        start = time.perf_counter()
+        completed, failed = transfer_queue.run_workers(workers, poll_interval=0, until_empty=True)
+        elapsed = time.perf_counter() - start
+        result[f'{workers}_workers'] = {
+            'transfers': completed + failed,
+            'failed': failed,
+            'transfers_per_sec': rate(completed + failed, elapsed),
+        }
+    return result
+
+
+@scenario('hot_account')
+def hot_account(size, workers, **options):
+    """send_money from ``--workers`` concurrent payers to one merchant, without and with balance buckets"""
+    payers = make_users(workers, balance=Decimal('100000000.00'))
+    merchant, = make_users(1)
+    result = {'concurrency': workers}
+    for buckets in (0, 4, 16):
+        User.objects.filter(pk=merchant.pk).update(balance_buckets=buckets)
+        ledger.compact_buckets()
+        receivers.cache.clear()
+
+        def connect(slot):
+            client = client_for(payers[slot])
+            return closing_connections(lambda: client.post('/api/transactions/send_money/', {
+                'receiver_phone': merchant.phone_number, 'amount': '1.00'
+            }, format='json'))
+        result[f'{buckets}_buckets'] = threaded_load(connect, size, workers)
+    ledger.compact_buckets()
+    result['merchant_balance'] = ledger.current_balance(merchant.pk)
+    return result
+
+
+@contextmanager
+def callback_sink():
+    """Local keep-alive HTTP server accepting callbacks; yields its URL and a request counter"""
+    requests = itertools.count()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            next(requests)
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}', requests
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@scenario('callbacks')
+def callback_dispatch(size, workers, **options):
+    """Deliver ``size`` payments' callbacks to a local endpoint, one event per request vs batched"""
+    payers = make_users(workers, balance=Decimal('100000000.00'))
+    merchant, = make_users(1)
+    txns = [ledger.transfer(payers[i % workers], merchant, Decimal('1.00')) for i in range(size)]
+    result = {'events': size}
+    with callback_sink() as (url, requests):
+        for user in [merchant, *payers]:
+            CallbackEndpoint.objects.create(
+                user=user, confirmation_url=f'{url}/confirm', result_url=f'{url}/result',
+                secret=callbacks.generate_secret()
+            )
+        for batch_size in (1, 100):
+            TransactionEvent.objects.all().delete()
+            TransactionEvent.objects.bulk_create(
+                [TransactionEvent(transaction_id=txn.pk, status='COMPLETED') for txn in txns]
+            )
+            first = next(requests)
+            start = time.perf_counter()
+            # The sink is on the loopback address
+            with override_settings(CALLBACK_BATCH_SIZE=batch_size, CALLBACK_ALLOW_PRIVATE_NETWORKS=True):
+                handled, failed = asyncio.run(callbacks.dispatch(until_empty=True))
+            elapsed = time.perf_counter() - start
+            result[f'batch_{batch_size}'] = {
+                'events_per_sec': rate(handled, elapsed),
+                'requests': next(requests) - first - 1,
+                'failed': failed,
+            }
+    return result
+
+
+class TimedBroker(push.LocalBroker):
+    """LocalBroker that stamps each message with the time it was published"""
+
+    def publish(self, user_id, message):
+        message = {**message, 'data': {**message['data'], 'published': time.perf_counter()}}
+        super().publish(user_id, message)
+
+
+@scenario('push')
+def push_stream(size, workers, **options):
+    """Push ``size`` deposits to ``--workers`` open streams vs each client polling balance/ once"""
+    users = make_users(workers)
+    headers = [{'Authorization': f'Token {Token.objects.create(user=user).key}'} for user in users]
+    shares = _shares(size, workers)
+    client = AsyncClient()
+    samples = []
+
+    def deposit():
+        for i in range(size):
+            ledger.deposit(users[i % workers], Decimal('1.00'))
+        connections.close_all()
+
+    async def listen(header, count, connected):
+        response = await client.get('/api/transactions/stream/', headers=header)
+        events = aiter(response.streaming_content)
+        # The initial balance event
+        await anext(events)
+        connected.release()
+        for _ in range(count):
+            event = json.loads((await anext(events)).split(b'data: ')[1])
+            samples.append(time.perf_counter() - event['published'])
+
+    async def run():
+        connected = asyncio.Semaphore(0)
+        listeners = [asyncio.create_task(listen(*args, connected)) for args in zip(headers, shares)]
+        for _ in listeners:
+            await connected.acquire()
+        start = time.perf_counter()
+        await asyncio.to_thread(deposit)
+        await asyncio.gather(*listeners)
+        return time.perf_counter() - start
+
+    with override_settings(ROOT_URLCONF='mpesa_system.asgi_urls', PUSH_BROKER='my_app.benchmarks.TimedBroker'):
+        elapsed = asyncio.run(run())
+    streamed = load_profile(samples, elapsed)
+    return {
+        'streams': workers,
+        'push': {
+            'events': streamed['requests'],
+            'events_per_sec': streamed['requests_per_sec'],
+            'p50_ms': streamed['p50_ms'],
+            'p95_ms': streamed['p95_ms'],
+            'p99_ms': streamed['p99_ms'],
+        },
+        # What a single poll costs; polling clients pay it whether or not anything changed
+        'balance_poll': latency_profile(
+            functools.partial(Client().get, '/api/transactions/balance/', headers=headers[0]), size
+        ),
+    }
+
+
+def _per_call_us(func, count):
+    """Mean microseconds per call over ``count`` calls; None if there are none"""
+    if count <= 0:
+        return None
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return round((time.perf_counter() - start) / count * 1e6, 2)
+
+
+@scenario('throttle')
+def throttle(size, **options):
+    """Cost of a rate limit check: sliding-window counters vs DRF's ScopedRateThrottle, and balance/ with and without limits"""
+    user, = make_users(1)
+    rates = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'reads': f'{size * 10}/hour'}}
+    request = Request(APIRequestFactory().get('/api/transactions/balance/'))
+    request.user = user
+    view = TransactionViewSet(throttle_scope='reads')
+    result = {'checks': size}
+    with override_settings(REST_FRAMEWORK=rates):
+        cache.clear()
+        result['sliding_window_us'] = _per_call_us(lambda: throttling.hit('reads', user.pk), size)
+        drf = ScopedRateThrottle()
+        # Its per-key history holds every request of the window, so checks slow down as it fills
+        result['drf_scoped_first_us'] = _per_call_us(lambda: drf.allow_request(request, view), min(size, 100))
+        _per_call_us(lambda: drf.allow_request(request, view), max(size - 200, 0))
+        result['drf_scoped_last_us'] = _per_call_us(lambda: drf.allow_request(request, view), min(size, 100))
+
+        result['sliding_window_bytes'] = sum(
+            len(pickle.dumps(cache.get(key, 0))) for key in throttling.window_keys('reads', user.pk, 3600, time.time())[:2]
+        )
+        result['drf_scoped_bytes'] = len(pickle.dumps(cache.get(drf.key)))
+
+    token = Token.objects.create(user=user)
+    client = Client(headers={'Authorization': f'Token {token.key}'})
+    send = functools.partial(client.get, '/api/transactions/balance/')
+    latency_profile(send, 200)
+    result['balance_unthrottled'] = latency_profile(send, size)
+    with override_settings(REST_FRAMEWORK=rates):
+        result['balance_throttled'] = latency_profile(send, size)
+    return result
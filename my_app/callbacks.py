@@ -0,0 +1,428 @@
+# my_app/callbacks.py
+"""
+Transaction callbacks, so clients learn about money moving without polling
+their history.
+
+An account registers a callback endpoint (``/api/callbacks/endpoint/``).
+The ledger writes a TransactionEvent in the same database transaction as
+each completed transaction (and each queued transfer that failed), so an
+event exists exactly when its transaction committed. The
+``dispatch_callbacks`` command delivers them:
+
+* Due events are claimed in batches with ``SELECT ... FOR UPDATE SKIP
+  LOCKED`` and leased for ``LEASE_SECONDS``, so several dispatchers can run
+  side by side and a crashed one's events are picked up again.
+* The receiver of a completed transaction gets a ``confirmation`` at its
+  ``confirmation_url``. The sender, or the account that withdrew, gets a
+  ``result`` at its ``result_url``.
+* Events for the same URL are posted together, ``CALLBACK_BATCH_SIZE`` per
+  request, as ``{"events": [...]}``. Requests go over keep-alive
+  connections, at most ``per_host`` per host and ``concurrency`` in all.
+* A failed delivery is retried with exponential backoff, up to
+  ``CALLBACK_MAX_ATTEMPTS`` times. Delivery is at least once, so receivers
+  should ignore an event ``id`` they have already seen.
+
+Each request is signed: ``X-Mpesa-Signature: t=<unix time>,v1=<hex>``, where
+``v1`` is the HMAC-SHA256 of ``<t>.<body>`` keyed with the endpoint's secret.
+
+Callback URLs must resolve to public addresses, so accounts cannot make the
+dispatcher post into the internal network. This is checked when a URL is
+registered and again for every connection, against the addresses actually
+connected to (a name may resolve differently later).
+``CALLBACK_ALLOW_PRIVATE_NETWORKS`` lifts the restriction, e.g. for local
+testing.
+"""
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import random
+import secrets
+import socket
+import ssl
+import time
+from collections import namedtuple
+from datetime import timedelta
+from urllib.parse import quote, urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction as db_transaction
+from django.utils import timezone
+from .models import CallbackEndpoint, TransactionEvent
+
+logger = logging.getLogger(__name__)
+
+# Seconds a claimed event stays invisible to other dispatchers
+LEASE_SECONDS = 120
+SIGNATURE_HEADER = 'X-Mpesa-Signature'
+
+Delivery = namedtuple('Delivery', 'event account_id payload')
+
+
+def generate_secret():
+    return secrets.token_hex(32)
+
+
+def sign(secret, timestamp, body):
+    return hmac.new(secret.encode(), f'{timestamp}.'.encode() + body, hashlib.sha256).hexdigest()
+
+
+def signature_header(secret, body, timestamp=None):
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    return f't={timestamp},v1={sign(secret, timestamp, body)}'
+
+
+class BlockedAddress(Exception):
+    """A callback URL that resolves to a private, loopback or otherwise non-public address"""
+
+
+def is_public_address(address):
+    address = ipaddress.ip_address(address.split('%')[0])
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def check_addresses(host, addresses):
+    """Raise BlockedAddress unless every address ``host`` resolved to is public"""
+    if getattr(settings, 'CALLBACK_ALLOW_PRIVATE_NETWORKS', False):
+        return
+    for address in addresses:
+        if not is_public_address(address):
+            raise BlockedAddress(f'{host} resolves to non-public address {address}')
+
+
+def url_host(url):
+    """(scheme, ASCII host, port) of a callback URL; raises ValueError for unusable URLs"""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError(f'Not an http(s) URL: {url}')
+    # IDNA-encoded, as it goes on the wire and to the resolver
+    host = parts.hostname.encode('idna').decode('ascii')
+    return parts.scheme, host, parts.port or (443 if parts.scheme == 'https' else 80)
+
+
+def check_url(url):
+    """
+    Raise BlockedAddress if ``url``'s host resolves to a non-public address,
+    ValueError if it is unusable. Blocks while resolving.
+    """
+    scheme, host, port = url_host(url)
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError):
+        raise ValueError(f'{host} does not resolve') from None
+    check_addresses(host, [info[4][0] for info in infos])
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter before retry number ``attempts``"""
+    delay = min(
+        getattr(settings, 'CALLBACK_RETRY_SECONDS', 10) * 2 ** (attempts - 1),
+        getattr(settings, 'CALLBACK_MAX_RETRY_SECONDS', 3600)
+    )
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+
+def parties(event):
+    """(account id, kind) of everyone to notify about ``event``"""
+    txn = event.transaction
+    confirmation = event.status == 'COMPLETED' and txn.receiver_id is not None
+    if event.account_id is not None:
+        kind = 'confirmation' if confirmation and event.account_id == txn.receiver_id else 'result'
+        return [(event.account_id, kind)]
+    notified = []
+    if txn.sender_id is not None:
+        notified.append((txn.sender_id, 'result'))
+    if confirmation:
+        notified.append((txn.receiver_id, 'confirmation'))
+    return notified
+
+
+def event_payload(event, kind):
+    txn = event.transaction
+    return {
+        # The same for every attempt, so receivers can drop duplicates
+        'id': f'{txn.pk}:{event.status}:{kind}',
+        'type': kind,
+        'transaction': {
+            'id': str(txn.pk),
+            'transaction_code': txn.transaction_code,
+            'transaction_type': txn.transaction_type,
+            'status': event.status,
+            'amount': str(txn.amount),
+            'sender_phone': txn.sender.phone_number if txn.sender_id else None,
+            'receiver_phone': txn.receiver.phone_number if txn.receiver_id else None,
+            'description': txn.description,
+            'created_at': txn.created_at.isoformat(),
+        },
+    }
+
+
+def claim_events(limit, lease=LEASE_SECONDS):
+    """Lease up to ``limit`` due events, oldest first"""
+    now = timezone.now()
+    with db_transaction.atomic():
+        events = list(
+            TransactionEvent.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(next_attempt_at__lte=now)
+            .select_related('transaction__sender', 'transaction__receiver')
+            .order_by('next_attempt_at', 'pk')[:limit]
+        )
+        if events:
+            TransactionEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+                next_attempt_at=now + timedelta(seconds=lease)
+            )
+    return events
+
+
+def plan_deliveries(events):
+    """{(url, secret): [Delivery]} for the parties of ``events`` that have an endpoint"""
+    wanted = [(event, account_id, kind) for event in events for account_id, kind in parties(event)]
+    endpoints = CallbackEndpoint.objects.in_bulk({account_id for _, account_id, _ in wanted})
+    plan = {}
+    for event, account_id, kind in wanted:
+        endpoint = endpoints.get(account_id)
+        url = endpoint and getattr(endpoint, f'{kind}_url')
+        if url:
+            plan.setdefault((url, endpoint.secret), []).append(
+                Delivery(event, account_id, event_payload(event, kind))
+            )
+    return plan
+
+
+def finish(events, failed):
+    """
+    Remove delivered ``events`` from the outbox and schedule retries of the
+    ``failed`` deliveries, given as (event, account id) pairs. A new event
+    that failed for some parties is replaced by one event per such party.
+    """
+    failed_accounts = {}
+    for event, account_id in failed:
+        failed_accounts.setdefault(event.pk, []).append(account_id)
+    max_attempts = getattr(settings, 'CALLBACK_MAX_ATTEMPTS', 10)
+    now = timezone.now()
+    done = []
+    retries = []
+    with db_transaction.atomic():
+        for event in events:
+            accounts = failed_accounts.get(event.pk)
+            attempts = event.attempts + 1
+            if not accounts:
+                done.append(event.pk)
+            elif attempts >= max_attempts:
+                logger.error(
+                    'Giving up on %s event for transaction %s after %s attempts',
+                    event.status, event.transaction_id, attempts
+                )
+                done.append(event.pk)
+            elif event.account_id is not None:
+                TransactionEvent.objects.filter(pk=event.pk).update(
+                    attempts=attempts, next_attempt_at=now + retry_delay(attempts)
+                )
+            else:
+                done.append(event.pk)
+                retries.extend(
+                    TransactionEvent(
+                        transaction_id=event.transaction_id, status=event.status, account_id=account_id,
+                        attempts=attempts, next_attempt_at=now + retry_delay(attempts)
+                    )
+                    for account_id in accounts
+                )
+        TransactionEvent.objects.bulk_create(retries)
+        TransactionEvent.objects.filter(pk__in=done).delete()
+
+
+class HTTPError(Exception):
+    """A malformed or truncated HTTP response"""
+
+
+async def read_headers(reader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+async def read_response(reader):
+    """(status, keep alive) of an HTTP/1.x response; the body is read and discarded"""
+    while True:
+        line = await reader.readline()
+        try:
+            version, status = line.decode('latin-1').split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise HTTPError(f'Bad status line {line!r}') from None
+        headers = await read_headers(reader)
+        # Interim responses (100 Continue, 103 Early Hints) precede the real one
+        if not 100 <= status < 200 or status == 101:
+            break
+
+    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+    if status in (204, 304) or status < 200:
+        pass
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            line = await reader.readline()
+            try:
+                size = int(line.split(b';')[0], 16)
+            except ValueError:
+                raise HTTPError(f'Bad chunk size {line!r}') from None
+            if not size:
+                # Trailers, up to a blank line
+                await read_headers(reader)
+                break
+            await reader.readexactly(size + 2)
+    elif 'content-length' in headers:
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            raise HTTPError(f'Bad Content-Length {headers["content-length"]!r}') from None
+        await reader.readexactly(length)
+    else:
+        await reader.read()
+        keep_alive = False
+    return status, keep_alive
+
+
+class HTTPPool:
+    """
+    Minimal asyncio HTTP/1.1 client for posting callbacks. Connections are
+    kept alive and reused, at most ``per_host`` per (scheme, host, port).
+    """
+
+    def __init__(self, per_host=4, timeout=10):
+        self.per_host = per_host
+        self.timeout = timeout
+        self.idle = {}
+        self.limits = {}
+        self.ssl_context = ssl.create_default_context()
+
+    async def post(self, url, body, headers):
+        """POST ``body`` to ``url`` and return the response status"""
+        key = url_host(url)
+        scheme, host, port = key
+        parts = urlsplit(url)
+        # Already percent-encoded parts are kept; anything else non-ASCII is encoded
+        path = quote(parts.path or '/', safe="/%:@!$&'()*+,;=~") + (
+            '?' + quote(parts.query, safe="/%:@!$&'()*+,;=~?") if parts.query else ''
+        )
+        host_header = f'[{host}]' if ':' in host else host
+        if parts.port:
+            host_header += f':{parts.port}'
+        head = f'POST {path} HTTP/1.1\r\nHost: {host_header}\r\nContent-Length: {len(body)}\r\n'
+        head += ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+        request = (head + '\r\n').encode('ascii') + body
+
+        async with self.limits.setdefault(key, asyncio.Semaphore(self.per_host)):
+            idle = self.idle.setdefault(key, [])
+            while idle:
+                try:
+                    return await self._exchange(key, idle.pop(), request)
+                except (OSError, HTTPError, asyncio.IncompleteReadError):
+                    # Closed by the server while idle; try the next one
+                    continue
+            connection = await asyncio.wait_for(self._connect(scheme, host, port), self.timeout)
+            return await self._exchange(key, connection, request)
+
+    async def _connect(self, scheme, host, port):
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = [info[4][0] for info in infos]
+        check_addresses(host, addresses)
+        # Connect to the address checked, not to whatever the name resolves to next
+        https = scheme == 'https'
+        return await asyncio.open_connection(
+            addresses[0], port, ssl=self.ssl_context if https else None,
+            server_hostname=host if https else None
+        )
+
+    async def _exchange(self, key, connection, request):
+        reader, writer = connection
+
+        async def round_trip():
+            writer.write(request)
+            await writer.drain()
+            return await read_response(reader)
+
+        try:
+            status, keep_alive = await asyncio.wait_for(round_trip(), self.timeout)
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            self.idle[key].append(connection)
+        else:
+            writer.close()
+        return status
+
+    async def close(self):
+        for connections in self.idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self.idle.clear()
+
+
+async def deliver(pool, limit, url, secret, deliveries):
+    """Post ``deliveries`` to ``url`` in one request; True if it was accepted"""
+    body = json.dumps({'events': [delivery.payload for delivery in deliveries]}).encode()
+    headers = {'Content-Type': 'application/json', SIGNATURE_HEADER: signature_header(secret, body)}
+    async with limit:
+        try:
+            status = await pool.post(url, body, headers)
+        except (OSError, HTTPError, BlockedAddress, asyncio.IncompleteReadError, asyncio.TimeoutError) as exc:
+            logger.warning('Callback to %s failed: %r', url, exc)
+            return False
+        except Exception:
+            # One bad endpoint must not stop delivery to the others; it is
+            # retried with backoff like any failed delivery
+            logger.exception('Callback to %s failed', url)
+            return False
+    if 200 <= status < 300:
+        return True
+    logger.warning('Callback to %s answered %s', url, status)
+    return False
+
+
+async def dispatch(claim_size=500, concurrency=50, per_host=4, poll_interval=1.0, until_empty=False):
+    """
+    Deliver due events until cancelled or, with ``until_empty``, until none
+    are due. Returns (events handled, deliveries failed).
+    """
+    batch_size = getattr(settings, 'CALLBACK_BATCH_SIZE', 100)
+    pool = HTTPPool(per_host, getattr(settings, 'CALLBACK_TIMEOUT', 10))
+    limit = asyncio.Semaphore(concurrency)
+    handled = failures = 0
+    try:
+        while True:
+            await sync_to_async(close_old_connections)()
+            events = await sync_to_async(claim_events)(claim_size)
+            if not events:
+                if until_empty:
+                    break
+                await asyncio.sleep(poll_interval)
+                continue
+
+            plan = await sync_to_async(plan_deliveries)(events)
+            requests = [
+                (url, secret, deliveries[start:start + batch_size])
+                for (url, secret), deliveries in plan.items()
+                for start in range(0, len(deliveries), batch_size)
+            ]
+            accepted = await asyncio.gather(*(deliver(pool, limit, *request) for request in requests))
+            failed = [
+                (delivery.event, delivery.account_id)
+                for (url, secret, deliveries), ok in zip(requests, accepted) if not ok
+                for delivery in deliveries
+            ]
+            await sync_to_async(finish)(events, failed)
+            handled += len(events)
+            failures += len(failed)
+    finally:
+        await pool.close()
+    return handled, failures
@@ -0,0 +1,224 @@
+# my_app/codes.py
+"""
+Time-ordered transaction codes that are unique without a database round trip.
+
+A code packs a 62-bit number into 12 upper-case base36 characters (the same
+alphabet and length as the original random codes):
+
+    41 bits  milliseconds since CODE_EPOCH (good until 2093)
+    10 bits  node id (0-1023), one per generating process
+    11 bits  sequence within the millisecond (2048 codes/ms per node)
+
+Codes from one node are strictly increasing, and codes from different nodes
+cannot collide, so uniqueness holds as long as no two processes use the
+same node id at the same time. Each process leases its node id from the
+``TRANSACTION_CODE_CACHE_ALIAS`` cache for ``TRANSACTION_CODE_NODE_LEASE_SECONDS``
+and renews it while it makes codes. That cache must be shared by every
+process (Redis, Memcached or the database cache). The local-memory default
+is per process and keeps no one apart, so ``check --deploy`` reports it
+unless node ids are configured instead: set
+``TRANSACTION_CODE_NODE_ID`` (setting or environment variable) per worker
+-- with a pre-forking server, in the worker after the fork (e.g. a gunicorn
+``post_fork`` hook).
+
+Next to the lease the cache keeps, without expiry, the timestamp the node
+id may be used up to; a holder renews before its codes get there. When
+the clock stalls or goes backwards a process keeps counting from its last
+timestamp, borrowing milliseconds ahead of the clock, and whoever takes
+the node id next (a restarted process, say) starts after that bound, so it
+cannot reissue the borrowed milliseconds.
+"""
+import os
+import random
+import threading
+import time
+import uuid
+
+CODE_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+CODE_LENGTH = 12
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+NODE_BITS = 10
+SEQUENCE_BITS = 11
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+LEASE_KEY = 'transaction-code-node:%d'
+UNTIL_KEY = 'transaction-code-node:%d:until'
+
+
+def encode(number):
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, 36)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def decode(code):
+    """Split a code into (unix timestamp in ms, node id, sequence)"""
+    number = int(code, 36)
+    sequence = number & MAX_SEQUENCE
+    node_id = (number >> SEQUENCE_BITS) & MAX_NODE_ID
+    timestamp = (number >> (NODE_BITS + SEQUENCE_BITS)) + CODE_EPOCH_MS
+    return timestamp, node_id, sequence
+
+
+def configured_node_id():
+    node_id = os.environ.get('TRANSACTION_CODE_NODE_ID')
+    if node_id is None:
+        from django.conf import settings
+        node_id = getattr(settings, 'TRANSACTION_CODE_NODE_ID', None)
+    return None if node_id is None else int(node_id)
+
+
+def get_cache():
+    from django.conf import settings
+    from django.core.cache import caches
+    return caches[getattr(settings, 'TRANSACTION_CODE_CACHE_ALIAS', 'default')]
+
+
+class NodeLease:
+    """
+    A node id held in a cache shared by the generating processes, and
+    ``until``, the timestamp (ms since CODE_EPOCH) its codes must stay below.
+    With ``node_id`` the process is configured to use that one and only
+    records ``until``.
+    """
+
+    def __init__(self, cache, seconds, node_id=None):
+        self.cache = cache
+        self.seconds = seconds
+        self.configured = node_id is not None
+        self.node_id = node_id
+        self.token = uuid.uuid4().hex
+        self.until = -1
+
+    @classmethod
+    def from_settings(cls):
+        from django.conf import settings
+        seconds = getattr(settings, 'TRANSACTION_CODE_NODE_LEASE_SECONDS', 60)
+        return cls(get_cache(), seconds, configured_node_id())
+
+    @property
+    def renew_at(self):
+        return self.until - self.seconds * 500
+
+    def acquire(self, now):
+        """
+        Take a node id, at ``now`` or later. Returns the timestamp its codes
+        may start from: after everything its last holder may have used.
+        """
+        if not self.configured:
+            start = random.randrange(MAX_NODE_ID + 1)
+            for offset in range(MAX_NODE_ID + 1):
+                node_id = (start + offset) & MAX_NODE_ID
+                if self.cache.add(LEASE_KEY % node_id, self.token, self.seconds):
+                    self.node_id = node_id
+                    break
+            else:
+                raise RuntimeError('Every transaction code node id is leased')
+        start = max(now, self.cache.get(UNTIL_KEY % self.node_id, -1))
+        self.extend(start)
+        return start
+
+    def renew(self, now):
+        """Extend the lease past ``now``; False if it expired or was taken over"""
+        if not self.configured:
+            if self.cache.get(LEASE_KEY % self.node_id) != self.token:
+                return False
+            self.cache.set(LEASE_KEY % self.node_id, self.token, self.seconds)
+        self.extend(now)
+        return True
+
+    def extend(self, now):
+        self.until = now + self.seconds * 1000
+        self.cache.set(UNTIL_KEY % self.node_id, self.until, None)
+
+
+class TransactionCodeGenerator:
+    """
+    With a ``node_id`` codes use it as given; otherwise the node id is
+    taken through a NodeLease (``lease``, or one from the settings).
+    """
+
+    def __init__(self, node_id=None, clock=time.time_ns, lease=None):
+        if node_id is not None and not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f'node_id must be between 0 and {MAX_NODE_ID}')
+        self.node_id = node_id
+        self.clock = clock
+        self.lease = lease
+        self.lock = threading.Lock()
+        self.last_timestamp = -1
+        self.sequence = 0
+
+    def next_code(self):
+        with self.lock:
+            timestamp = self.clock() // 1_000_000 - CODE_EPOCH_MS
+            if self.node_id is None or self.lease is not None:
+                self.hold(max(timestamp, self.last_timestamp + 1))
+            if timestamp > self.last_timestamp:
+                self.last_timestamp = timestamp
+                self.sequence = 0
+            else:
+                # Same millisecond or the clock went backwards: keep counting
+                # from the last timestamp, borrowing the next millisecond when
+                # the sequence runs out, so codes never repeat or go backwards
+                self.sequence += 1
+                if self.sequence > MAX_SEQUENCE:
+                    self.last_timestamp += 1
+                    self.sequence = 0
+            number = (
+                (self.last_timestamp << (NODE_BITS + SEQUENCE_BITS))
+                | (self.node_id << SEQUENCE_BITS)
+                | self.sequence
+            )
+        return encode(number)
+
+    def hold(self, now):
+        # ``now`` is the latest timestamp the next code can have. Renew the
+        # lease before codes reach its bound; if it was lost (or never held),
+        # take a node id again and start after its last holder's bound
+        if self.lease is None:
+            self.lease = NodeLease.from_settings()
+        if self.node_id is not None and (now < self.lease.renew_at or self.lease.renew(now)):
+            return
+        start = self.lease.acquire(now)
+        self.node_id = self.lease.node_id
+        if start > self.last_timestamp:
+            # The next code gets ``start`` at the earliest, borrowing it if need be
+            self.last_timestamp = start - 1
+            self.sequence = MAX_SEQUENCE
+
+    def reset(self):
+        """Forget per-process state; called in forked children"""
+        self.lock = threading.Lock()
+        self.node_id = None
+        self.lease = None
+        self.last_timestamp = -1
+        self.sequence = 0
+
+
+def check_node_ids(app_configs, **kwargs):
+    """Deploy check: node ids must be configured or leased from a shared cache"""
+    from django.core import checks
+    from django.core.cache.backends.locmem import LocMemCache
+    if configured_node_id() is not None or not isinstance(get_cache(), LocMemCache):
+        return []
+    return [checks.Warning(
+        'Transaction code node ids are leased from a local-memory cache, so '
+        'processes can pick the same one and generate the same codes.',
+        hint='Point TRANSACTION_CODE_CACHE_ALIAS at a cache shared by every '
+             'process, or set TRANSACTION_CODE_NODE_ID per process.',
+        id='my_app.W001',
+    )]
+
+
+_generator = TransactionCodeGenerator()
+if hasattr(os, 'register_at_fork'):
+    # A child of a pre-forking server must not reuse its parent's node id
+    os.register_at_fork(after_in_child=_generator.reset)
+
+
+def generate_transaction_code():
+    return _generator.next_code()
@@ -0,0 +1,317 @@
+# my_app/datagen.py
+"""
+Synthetic users and transactions for load testing (see ``generate_data``).
+
+Users are split into partitions that only transact among themselves, so
+each partition can be generated by its own process: it replays its
+transactions in time order, keeps running balances in memory (a send or
+withdrawal the account cannot afford becomes a deposit instead), and
+writes transactions and ledger entries with ``balance_after`` exactly as
+``ledger`` would. Final balances are applied at the end and the per-user
+statistics are rebuilt from the ledger, so ``reconcile_balances`` passes
+on the result.
+
+Rows are written with COPY on PostgreSQL and ``bulk_create`` elsewhere.
+"""
+import csv
+import io
+import math
+import random
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction as db_transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from . import ledger
+from .codes import TransactionCodeGenerator, MAX_NODE_ID
+from .models import User, Transaction, LedgerEntry, UserStats, DailyUserStats
+from .reconciliation import in_range
+
+BATCH_SIZE = 10000
+
+# Columns written per row, by attribute name
+USER_FIELDS = (
+    'id', 'password', 'last_login', 'is_superuser', 'phone_number', 'full_name',
+    'balance', 'balance_buckets', 'is_active', 'is_staff', 'created_at', 'updated_at',
+)
+TRANSACTION_FIELDS = (
+    'id', 'transaction_code', 'sender_id', 'receiver_id', 'amount',
+    'transaction_type', 'status', 'description', 'created_at', 'updated_at',
+)
+ENTRY_FIELDS = ('account_id', 'transaction_id', 'direction', 'amount', 'balance_after', 'created_at')
+
+# Mobile prefixes after +254 with rough market shares; each holds 10^7 numbers
+PHONE_PREFIXES = (
+    ('70', 14), ('71', 14), ('72', 14), ('74', 8), ('79', 10), ('11', 8),
+    ('73', 6), ('75', 6), ('78', 8), ('10', 4), ('76', 4), ('77', 4),
+)
+# Multiplier coprime to 10^7: spreads each prefix's numbers over its range
+PHONE_STRIDE = 7919
+
+FIRST_NAMES = (
+    'James', 'Mary', 'Peter', 'Grace', 'David', 'Faith', 'John', 'Sarah', 'Michael', 'Lucy',
+    'Daniel', 'Anne', 'Robert', 'Catherine', 'Brian', 'Esther', 'Joseph', 'Ruth', 'Patrick',
+    'Jane', 'Kevin', 'Mercy', 'Dennis', 'Joyce', 'Samuel', 'Winnie', 'George', 'Caroline',
+)
+LAST_NAMES = (
+    'Kamau', 'Wanjiku', 'Ochieng', 'Akinyi', 'Kipchoge', 'Njeri', 'Mwangi', 'Chebet', 'Otieno',
+    'Wambui', 'Kimani', 'Moraa', 'Mutua', 'Wairimu', 'Koech', 'Nyambura', 'Omondi', 'Nduta',
+    'Kipruto', 'Wangari', 'Odhiambo', 'Achieng', 'Kariuki', 'Njoroge', 'Cheruiyot', 'Wafula',
+)
+
+# transaction type -> (share of transactions, median KSh, log-normal sigma)
+TRANSACTION_MIX = {
+    'SEND': (70, 400, 1.1),
+    'DEPOSIT': (18, 1500, 1.0),
+    'WITHDRAW': (12, 1000, 0.9),
+}
+MIN_AMOUNT = 10
+MAX_AMOUNT = 150000
+
+# Relative activity per hour of the day
+HOURLY_WEIGHTS = (
+    1, 1, 1, 1, 1, 2, 4, 7, 9, 9, 9, 9,
+    10, 10, 9, 9, 9, 10, 10, 9, 7, 5, 3, 2,
+)
+
+DESCRIPTIONS = {
+    'SEND': ('', 'Rent', 'School fees', 'Lunch', 'Fare', 'Shopping', 'Family support', 'Loan repayment'),
+    'DEPOSIT': ('Deposit', 'Agent deposit', 'Bank transfer'),
+    'WITHDRAW': ('Withdrawal', 'Agent withdrawal'),
+}
+
+
+def share(total, parts, index):
+    return total // parts + (1 if index < total % parts else 0)
+
+
+def phone_number(prefix, serial):
+    return f'+254{prefix}{serial * PHONE_STRIDE % 10 ** 7:07d}'
+
+
+@contextmanager
+def historical_timestamps():
+    """Let bulk_create keep the given created_at/updated_at values"""
+    fields = [
+        model._meta.get_field(name)
+        for model in (User, Transaction) for name in ('created_at', 'updated_at')
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def copy_rows(model, fields, rows):
+    """COPY rows (tuples in ``fields`` order) into ``model``'s table on PostgreSQL"""
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+    sql = f"COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if value is None else value for value in row])
+
+    with connection.cursor() as cursor:
+        if is_psycopg3:
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+        else:
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+
+
+def insert_rows(model, fields, rows):
+    if connection.vendor == 'postgresql':
+        copy_rows(model, fields, rows)
+    else:
+        model.objects.bulk_create([model(**dict(zip(fields, row))) for row in rows], batch_size=1000)
+
+
+def make_users(rng, partition, partitions, users, password, created_at, taken):
+    """This partition's share of ``users`` as (id, phone_number) pairs, inserted into the database"""
+    prefixes = [prefix for prefix, _ in PHONE_PREFIXES]
+    weights = [weight for _, weight in PHONE_PREFIXES]
+    # Every partition numbers each prefix from its own offset so phone numbers never clash
+    serials = {prefix: partition for prefix in prefixes}
+
+    accounts = []
+    rows = []
+    for _ in range(share(users, partitions, partition)):
+        prefix = rng.choices(prefixes, weights)[0]
+        phone = phone_number(prefix, serials[prefix])
+        serials[prefix] += partitions
+        while phone in taken:
+            phone = phone_number(prefix, serials[prefix])
+            serials[prefix] += partitions
+        account_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+        joined = created_at - timedelta(seconds=rng.randrange(30 * 24 * 3600))
+        accounts.append((account_id, phone))
+        rows.append((
+            account_id, password, None, False, phone,
+            f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            Decimal('0.00'), 0, True, False, joined, joined,
+        ))
+        if len(rows) == BATCH_SIZE:
+            insert_rows(User, USER_FIELDS, rows)
+            rows = []
+    if rows:
+        insert_rows(User, USER_FIELDS, rows)
+    return accounts
+
+
+def timestamps(rng, start, days, count):
+    """``count`` times spread evenly over ``days`` days from ``start``, in order, busiest at midday"""
+    hours = list(range(24))
+    for day in range(days):
+        day_start = start + timedelta(days=day)
+        times = sorted(
+            day_start + timedelta(hours=hour, seconds=rng.random() * 3600)
+            for hour in rng.choices(hours, HOURLY_WEIGHTS, k=share(count, days, day))
+        )
+        yield from times
+
+
+def cents(value):
+    return Decimal(value).scaleb(-2)
+
+
+def generate_partition(partition, partitions, users, transactions, days, seed, password, taken=frozenset()):
+    """
+    Create one partition's users and transactions and set their balances.
+    Returns ``{'users', 'transactions'}`` counts.
+    """
+    rng = random.Random(f'{seed}:{partition}')
+    now = timezone.now()
+    start = timezone.make_aware(datetime.combine(timezone.localdate(now) - timedelta(days=days - 1), time.min))
+
+    with historical_timestamps():
+        accounts = make_users(rng, partition, partitions, users, password, start, taken)
+        if len(accounts) < 2:
+            return {'users': len(accounts), 'transactions': 0}
+
+        # A few accounts (merchants, agents) see most of the traffic
+        cumulative = list(_cumulative(rng.paretovariate(1.2) for _ in accounts))
+        indexes = range(len(accounts))
+        balances = [0] * len(accounts)  # cents
+        types = list(TRANSACTION_MIX)
+        type_weights = [mix[0] for mix in TRANSACTION_MIX.values()]
+        clock = [0]
+        codes = TransactionCodeGenerator(node_id=partition % (MAX_NODE_ID + 1), clock=lambda: clock[0])
+
+        rows = []
+        entries = []
+        count = 0
+        for created_at in timestamps(rng, start, days, share(transactions, partitions, partition)):
+            if created_at > now:
+                created_at = now
+            txn_type = rng.choices(types, type_weights)[0]
+            _, median, sigma = TRANSACTION_MIX[txn_type]
+            amount = 100 * min(MAX_AMOUNT, max(MIN_AMOUNT, round(rng.lognormvariate(math.log(median), sigma))))
+            party = rng.choices(indexes, cum_weights=cumulative)[0]
+
+            if txn_type != 'DEPOSIT' and balances[party] < amount:
+                txn_type = 'DEPOSIT'
+            sender = receiver = None
+            if txn_type == 'SEND':
+                sender = party
+                receiver = rng.choices(indexes, cum_weights=cumulative)[0]
+                if receiver == sender:
+                    receiver = (sender + 1) % len(accounts)
+            elif txn_type == 'DEPOSIT':
+                receiver = party
+            else:
+                sender = party
+
+            clock[0] = int(created_at.timestamp() * 1_000_000) * 1000
+            txn_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+            rows.append((
+                txn_id, codes.next_code(),
+                accounts[sender][0] if sender is not None else None,
+                accounts[receiver][0] if receiver is not None else None,
+                cents(amount), txn_type, 'COMPLETED', rng.choice(DESCRIPTIONS[txn_type]),
+                created_at, created_at,
+            ))
+            if sender is not None:
+                balances[sender] -= amount
+                entries.append((accounts[sender][0], txn_id, 'DEBIT', cents(amount), cents(balances[sender]), created_at))
+            if receiver is not None:
+                balances[receiver] += amount
+                entries.append((accounts[receiver][0], txn_id, 'CREDIT', cents(amount), cents(balances[receiver]), created_at))
+
+            count += 1
+            if len(rows) == BATCH_SIZE:
+                _flush(rows, entries)
+                rows, entries = [], []
+        if rows:
+            _flush(rows, entries)
+
+    # Balances start at zero, so crediting the final balance sets it
+    ledger._credit_many({
+        accounts[index][0]: cents(balance) for index, balance in enumerate(balances) if balance
+    })
+    return {'users': len(accounts), 'transactions': count}
+
+
+def _cumulative(weights):
+    total = 0
+    for weight in weights:
+        total += weight
+        yield total
+
+
+def _flush(rows, entries):
+    with db_transaction.atomic():
+        insert_rows(Transaction, TRANSACTION_FIELDS, rows)
+        insert_rows(LedgerEntry, ENTRY_FIELDS, entries)
+
+
+def rebuild_stats(start, end):
+    """
+    Recompute UserStats and DailyUserStats for accounts with ids in
+    [start, end) from the ledger entries of COMPLETED transactions.
+    """
+    with db_transaction.atomic():
+        in_range(DailyUserStats.objects.all(), 'user_id', start, end).delete()
+        in_range(UserStats.objects.all(), 'user_id', start, end).delete()
+
+        rows = (
+            in_range(LedgerEntry.objects.filter(balance_after__isnull=False), 'account_id', start, end)
+            .annotate(day=TruncDate('created_at'))
+            .values('account_id', 'day', 'direction')
+            .annotate(total=Sum('amount'), count=Count('id'))
+            .order_by('account_id', 'day')
+        )
+        daily = []
+        totals = {}
+        for row in rows.iterator(chunk_size=BATCH_SIZE):
+            key = row['account_id'], row['day']
+            if not daily or (daily[-1].user_id, daily[-1].day) != key:
+                if len(daily) >= BATCH_SIZE:
+                    DailyUserStats.objects.bulk_create(daily)
+                    daily = []
+                daily.append(DailyUserStats(user_id=row['account_id'], day=row['day']))
+            if row['direction'] == 'DEBIT':
+                fields = ('total_sent', 'sent_count')
+            else:
+                fields = ('total_received', 'received_count')
+            bucket = daily[-1]
+            stats = totals.setdefault(row['account_id'], dict.fromkeys(ledger.STATS_FIELDS, 0))
+            for field, value in zip(fields, (row['total'], row['count'])):
+                setattr(bucket, field, value)
+                stats[field] += value
+        DailyUserStats.objects.bulk_create(daily)
+        UserStats.objects.bulk_create(
+            [UserStats(user_id=user_id, **stats) for user_id, stats in totals.items()],
+            batch_size=BATCH_SIZE
+        )
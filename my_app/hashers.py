@@ -0,0 +1,39 @@
+# my_app/hashers.py
+"""
+Password hashers tuned for 4-6 digit PINs.
+
+A PIN has at most a million values, so no hash cost makes a stolen hash
+safe on its own; what protects PINs online is the per-account attempt
+limit in LoginSerializer. The hash cost only has to make offline guessing
+expensive without pinning a core per login, so these hashers take their
+parameters from settings and stay well below Django's password defaults:
+scrypt at a quarter of its work factor, Argon2 at a fifth of its memory.
+
+Existing hashes keep verifying through the hashers listed after these in
+PASSWORD_HASHERS and are rehashed with the first one on the next
+successful login. Changing the parameters triggers the same rehash.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, ScryptPasswordHasher
+
+
+class PinScryptHasher(ScryptPasswordHasher):
+    """Scrypt with ``PIN_SCRYPT_PARAMS`` (work_factor, block_size, parallelism)"""
+    algorithm = 'pin_scrypt'
+
+    def __init__(self):
+        params = getattr(settings, 'PIN_SCRYPT_PARAMS', {})
+        self.work_factor = params.get('work_factor', 2 ** 12)
+        self.block_size = params.get('block_size', 8)
+        self.parallelism = params.get('parallelism', 1)
+
+
+class PinArgon2Hasher(Argon2PasswordHasher):
+    """Argon2id with ``PIN_ARGON2_PARAMS``; requires the argon2-cffi package"""
+    algorithm = 'pin_argon2'
+
+    def __init__(self):
+        params = getattr(settings, 'PIN_ARGON2_PARAMS', {})
+        self.time_cost = params.get('time_cost', 2)
+        self.memory_cost = params.get('memory_cost', 19 * 1024)
+        self.parallelism = params.get('parallelism', 1)
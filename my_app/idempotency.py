@@ -0,0 +1,93 @@
+# my_app/idempotency.py
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction as db_transaction
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def get_cache():
+    return caches[getattr(settings, 'IDEMPOTENCY_CACHE_ALIAS', 'default')]
+
+
+def get_ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24)
+
+
+def fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def replay(stored, request_hash):
+    stored_hash, response_status, response_body = stored
+    if stored_hash != request_hash:
+        return Response({
+            'error': 'Idempotency-Key was already used for a different request'
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    return Response(response_body, status=response_status, headers={REPLAYED_HEADER: 'true'})
+
+
+def idempotent(view_func):
+    """
+    Honour an ``Idempotency-Key`` header on a money-moving view action.
+
+    The first request with a given key runs the view and stores its response;
+    retries get that response back from the cache (or the table, after
+    eviction) without touching the ledger. The key row is inserted in the
+    same database transaction as the view's ledger writes, so a concurrent
+    duplicate blocks on the unique index until the first request commits and
+    then replays its response. Server errors roll back and are not stored.
+    """
+    @functools.wraps(view_func)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_func(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({
+                'error': 'Idempotency-Key must be at most 255 characters'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        cache = get_cache()
+        cache_key = f'idempotency:{request.user.pk}:{key}'
+        request_hash = fingerprint(request)
+        stored = cache.get(cache_key)
+        if stored:
+            return replay(stored, request_hash)
+
+        with db_transaction.atomic():
+            try:
+                with db_transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=request.user, key=key, request_hash=request_hash
+                    )
+            except IntegrityError:
+                record = IdempotencyKey.objects.get(user=request.user, key=key)
+                stored = (record.request_hash, record.response_status, record.response_body)
+                cache.set(cache_key, stored, get_ttl())
+                return replay(stored, request_hash)
+
+            response = view_func(self, request, *args, **kwargs)
+            if response.status_code >= 500:
+                db_transaction.set_rollback(True)
+                return response
+
+            # Store exactly what the renderer would emit (e.g. Decimal -> float)
+            record.response_status = response.status_code
+            record.response_body = json.loads(json.dumps(response.data, cls=JSONEncoder))
+            record.save(update_fields=['response_status', 'response_body'])
+
+        cache.set(cache_key, (request_hash, record.response_status, record.response_body), get_ttl())
+        return response
+
+    return wrapper
@@ -0,0 +1,603 @@
+# my_app/ledger.py
+import random
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import (
+    Case, DecimalField, Exists, ExpressionWrapper, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import (
+    User, Transaction, LedgerEntry, UserStats, DailyUserStats, PendingTransfer, BalanceBucket, TransactionEvent
+)
+from .codes import generate_transaction_code
+from . import metrics, push, receivers
+
+# Rows per CASE/WHEN balance update and per INSERT in bulk transfers
+BULK_BATCH_SIZE = 500
+
+# UserStats/DailyUserStats counters, in the order used by stats deltas
+STATS_FIELDS = ('total_sent', 'sent_count', 'total_received', 'received_count')
+
+
+class LedgerError(Exception):
+    """Base class for errors raised while applying balance changes"""
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+class AccountNotFound(LedgerError):
+    pass
+
+
+class _NoBucket(Exception):
+    """The receiver has no such bucket (anymore) or is no longer active"""
+
+
+def lock_accounts(*user_ids, receivers=()):
+    """
+    Lock the given account rows and return their current balances.
+
+    Rows are always locked in primary key order so that two transfers
+    touching the same pair of accounts in opposite directions cannot deadlock.
+    ``receivers`` are locked too but only returned while active: they were
+    resolved earlier (see receivers.py) and may have been deactivated or
+    deleted since, which callers report as "not found".
+
+    Accounts with credited balance buckets have them folded into
+    ``User.balance`` first, so the balances returned are complete. That
+    includes accounts whose buckets have been turned off since.
+    """
+    receivers = set(receivers)
+    rows = (
+        User.objects.select_for_update()
+        .filter(pk__in=set(user_ids) | receivers)
+        .order_by('pk')
+        .annotate(credited=Exists(BalanceBucket.objects.filter(user=OuterRef('pk'), received_count__gt=0)))
+        .values_list('pk', 'balance', 'is_active', 'credited')
+    )
+    with metrics.track('lock_wait'):
+        rows = [row for row in rows if row[2] or row[0] not in receivers]
+    balances = {pk: balance for pk, balance, is_active, credited in rows}
+    for user_id in user_ids:
+        if user_id not in balances:
+            raise AccountNotFound(user_id)
+    sharded = {pk: balance for pk, balance, is_active, credited in rows if credited}
+    if sharded:
+        for user_id, amount in _fold_buckets(sharded).items():
+            balances[user_id] += amount
+    return balances
+
+
+def total_balance():
+    """``User.balance`` plus the account's buckets, for annotating User querysets"""
+    buckets = BalanceBucket.objects.filter(user=OuterRef('pk')).values('user').order_by().annotate(
+        total=Sum('balance')
+    ).values('total')
+    return ExpressionWrapper(
+        F('balance') + Coalesce(Subquery(buckets), Value(Decimal('0.00'))),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+
+
+def current_balance(user_id):
+    """An account's balance including its buckets, without locking anything"""
+    return User.objects.filter(pk=user_id).values_list(total_balance(), flat=True).get()
+
+
+def _fold_buckets(balances):
+    """
+    Move the buckets of the given accounts ({user_id: ``User.balance``}),
+    whose rows the caller has locked, into ``User.balance``. The credits
+    they hold get their ``balance_after``, a running balance in the order
+    they were made, and reach the stats on the day they were made.
+    Returns {user_id: amount}.
+    """
+    # Every bucket row is locked, credited or not: a payment committing into
+    # an unlocked one while folding would count among the credits below
+    buckets = [
+        row for row in BalanceBucket.objects.select_for_update()
+        .filter(user_id__in=balances)
+        .order_by('user', 'bucket')
+        .values_list('pk', 'user_id', 'balance', 'received_count')
+        if row[3]
+    ]
+    if not buckets:
+        return {}
+    folded = {}
+    counts = {}
+    for pk, user_id, balance, count in buckets:
+        folded[user_id] = folded.get(user_id, 0) + balance
+        counts[user_id] = counts.get(user_id, 0) + count
+    BalanceBucket.objects.filter(pk__in=[row[0] for row in buckets]).update(
+        balance=0, total_received=0, received_count=0
+    )
+    _credit_many(folded)
+
+    entries = []
+    for user_id, count in counts.items():
+        # Bucketed credits are the only COMPLETED entries written without a
+        # balance, and with the buckets locked all of them are in the ones
+        # being folded; the newest, so a backwards scan of the account index
+        credits = list(
+            LedgerEntry.objects.filter(
+                account_id=user_id, direction='CREDIT', balance_after__isnull=True,
+                transaction__status='COMPLETED'
+            ).order_by('-created_at', '-transaction_id')[:count]
+        )
+        balance = balances[user_id]
+        for entry in reversed(credits):
+            balance += entry.amount
+            entry.balance_after = balance
+        entries.extend(credits)
+    LedgerEntry.objects.bulk_update(entries, ['balance_after'], batch_size=BULK_BATCH_SIZE)
+    _record_stats(entries)
+    return folded
+
+
+def _credit_bucket(receiver, amount):
+    """
+    Credit a random bucket of ``receiver`` without locking its account row.
+    The receiver must still be active, checked in the same statement.
+    """
+    updated = BalanceBucket.objects.filter(
+        user_id=receiver.pk, bucket=random.randrange(receiver.balance_buckets), user__is_active=True
+    ).update(
+        balance=F('balance') + amount,
+        total_received=F('total_received') + amount,
+        received_count=F('received_count') + 1
+    )
+    if not updated:
+        raise _NoBucket()
+
+
+def _debit(user_id, amount):
+    # Conditional update so the balance can never go negative, even on
+    # backends where select_for_update is a no-op
+    updated = User.objects.filter(pk=user_id, balance__gte=amount).update(
+        balance=F('balance') - amount
+    )
+    if not updated:
+        raise InsufficientFunds(user_id)
+
+
+def _credit(user_id, amount):
+    User.objects.filter(pk=user_id).update(balance=F('balance') + amount)
+
+
+def _credit_many(credits):
+    """Apply aggregated credits ({user_id: amount}) in batched CASE updates"""
+    user_ids = list(credits)
+    for start in range(0, len(user_ids), BULK_BATCH_SIZE):
+        batch = user_ids[start:start + BULK_BATCH_SIZE]
+        increment = Case(
+            *[When(pk=user_id, then=Value(credits[user_id])) for user_id in batch],
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        )
+        User.objects.filter(pk__in=batch).update(balance=F('balance') + increment)
+
+
+def _debit_many(debits):
+    """Apply aggregated debits ({user_id: amount}) in batched conditional CASE updates"""
+    user_ids = list(debits)
+    for start in range(0, len(user_ids), BULK_BATCH_SIZE):
+        batch = user_ids[start:start + BULK_BATCH_SIZE]
+        decrement = Case(
+            *[When(pk=user_id, then=Value(debits[user_id])) for user_id in batch],
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        )
+        updated = User.objects.filter(pk__in=batch, balance__gte=decrement).update(
+            balance=F('balance') - decrement
+        )
+        if updated < len(batch):
+            raise InsufficientFunds(batch)
+
+
+def _stats_deltas(entries):
+    """Sum ledger entries into ({user_id: delta}, {day: {user_id: delta}})"""
+    totals = {}
+    daily = {}
+    for entry in entries:
+        if entry.direction == 'DEBIT':
+            delta = (entry.amount, 1, 0, 0)
+        else:
+            delta = (0, 0, entry.amount, 1)
+        day = timezone.localdate(entry.created_at)
+        for bucket in (totals, daily.setdefault(day, {})):
+            current = bucket.get(entry.account_id, (0, 0, 0, 0))
+            bucket[entry.account_id] = tuple(a + b for a, b in zip(current, delta))
+    return totals, daily
+
+
+def _add_stats(model, deltas, **lookup):
+    """
+    Add deltas ({user_id: values in STATS_FIELDS order}) to ``model`` rows,
+    creating missing rows. Callers hold the account locks, so no other
+    writer can create the same row between the update and the insert.
+    """
+    user_ids = list(deltas)
+    for start in range(0, len(user_ids), BULK_BATCH_SIZE):
+        batch = user_ids[start:start + BULK_BATCH_SIZE]
+        increments = {}
+        for index, field in enumerate(STATS_FIELDS):
+            output_field = IntegerField() if field.endswith('_count') else DecimalField(max_digits=14, decimal_places=2)
+            increments[field] = F(field) + Case(
+                *[When(user_id=user_id, then=Value(deltas[user_id][index])) for user_id in batch],
+                default=Value(0),
+                output_field=output_field
+            )
+        updated = model.objects.filter(user_id__in=batch, **lookup).update(**increments)
+        if updated < len(batch):
+            existing = set(
+                model.objects.filter(user_id__in=batch, **lookup).values_list('user_id', flat=True)
+            )
+            model.objects.bulk_create([
+                model(user_id=user_id, **lookup, **dict(zip(STATS_FIELDS, deltas[user_id])))
+                for user_id in batch if user_id not in existing
+            ])
+
+
+def _record_stats(entries):
+    """Add COMPLETED ledger entries to UserStats and DailyUserStats"""
+    totals, daily = _stats_deltas(entries)
+    _add_stats(UserStats, totals)
+    for day, deltas in daily.items():
+        _add_stats(DailyUserStats, deltas, day=day)
+
+
+def _record_events(txn_ids, status='COMPLETED'):
+    """Add transactions to the callback outbox (see callbacks.py)"""
+    if getattr(settings, 'CALLBACKS_ENABLED', True):
+        TransactionEvent.objects.bulk_create(
+            [TransactionEvent(transaction_id=txn_id, status=status) for txn_id in txn_ids],
+            batch_size=BULK_BATCH_SIZE
+        )
+
+
+def _notify(entries=(), failed=()):
+    """
+    Push COMPLETED ledger ``entries`` and FAILED queued transfers to the
+    accounts' subscribers once the transaction commits (see push.py)
+    """
+    broker = push.get_broker()
+    if broker is None:
+        return
+    messages = [(entry.account_id, push.entry_message(entry)) for entry in entries]
+    for txn in failed:
+        messages.extend(push.failed_messages(txn))
+    if not messages:
+        return
+
+    def publish():
+        for user_id, message in messages:
+            broker.publish(user_id, message)
+    db_transaction.on_commit(publish, robust=True)
+
+
+def _entry(txn, account_id, direction, balance_after):
+    return LedgerEntry(
+        account_id=account_id,
+        transaction=txn,
+        direction=direction,
+        amount=txn.amount,
+        balance_after=balance_after,
+        created_at=txn.created_at
+    )
+
+
+def transfer(sender, receiver, amount, description=''):
+    """Move money between two accounts and record a SEND transaction"""
+    if receiver.balance_buckets:
+        try:
+            with db_transaction.atomic():
+                return _transfer_to_bucket(sender, receiver, amount, description)
+        except _NoBucket:
+            # Buckets not created yet or removed since the receiver was
+            # resolved; the locked path below also reports a deactivated one
+            pass
+
+    with db_transaction.atomic():
+        balances = lock_accounts(sender.pk, receivers=[receiver.pk])
+        if receiver.pk not in balances:
+            raise AccountNotFound(receiver.pk)
+        _debit(sender.pk, amount)
+        _credit(receiver.pk, amount)
+        sender_balance = balances[sender.pk] - amount
+        receiver_balance = balances[receiver.pk] + amount
+
+        txn = Transaction.objects.create(
+            sender=sender,
+            receiver=receiver,
+            amount=amount,
+            transaction_type='SEND',
+            status='COMPLETED',
+            description=description
+        )
+        entries = LedgerEntry.objects.bulk_create([
+            _entry(txn, sender.pk, 'DEBIT', sender_balance),
+            _entry(txn, receiver.pk, 'CREDIT', receiver_balance),
+        ])
+        _record_stats(entries)
+        _record_events([txn.pk])
+        _notify(entries)
+
+    sender.balance = sender_balance
+    receiver.balance = receiver_balance
+    return txn
+
+
+def _transfer_to_bucket(sender, receiver, amount, description):
+    """
+    ``transfer`` to an account with balance buckets: only the sender's row
+    is locked, so concurrent payments to the receiver do not queue behind
+    each other. The receiver's entry is written without a ``balance_after``
+    and without counting in its stats; both are filled in when the bucket
+    is folded (see ``_fold_buckets``).
+    """
+    balances = lock_accounts(sender.pk)
+    _debit(sender.pk, amount)
+    _credit_bucket(receiver, amount)
+    sender_balance = balances[sender.pk] - amount
+
+    txn = Transaction.objects.create(
+        sender=sender,
+        receiver=receiver,
+        amount=amount,
+        transaction_type='SEND',
+        status='COMPLETED',
+        description=description
+    )
+    entries = LedgerEntry.objects.bulk_create([
+        _entry(txn, sender.pk, 'DEBIT', sender_balance),
+        _entry(txn, receiver.pk, 'CREDIT', None),
+    ])
+    _record_stats(entries[:1])
+    _record_events([txn.pk])
+    _notify(entries)
+
+    sender.balance = sender_balance
+    return txn
+
+
+def deposit(user, amount, description='Deposit'):
+    """Credit an account and record a DEPOSIT transaction"""
+    with db_transaction.atomic():
+        balances = lock_accounts(user.pk)
+        _credit(user.pk, amount)
+
+        txn = Transaction.objects.create(
+            receiver=user,
+            amount=amount,
+            transaction_type='DEPOSIT',
+            status='COMPLETED',
+            description=description
+        )
+        new_balance = balances[user.pk] + amount
+        entry = _entry(txn, user.pk, 'CREDIT', new_balance)
+        entry.save()
+        _record_stats([entry])
+        _record_events([txn.pk])
+        _notify([entry])
+
+    user.balance = new_balance
+    return txn
+
+
+def withdraw(user, amount, description='Withdrawal'):
+    """Debit an account and record a WITHDRAW transaction"""
+    with db_transaction.atomic():
+        balances = lock_accounts(user.pk)
+        _debit(user.pk, amount)
+
+        txn = Transaction.objects.create(
+            sender=user,
+            amount=amount,
+            transaction_type='WITHDRAW',
+            status='COMPLETED',
+            description=description
+        )
+        new_balance = balances[user.pk] - amount
+        entry = _entry(txn, user.pk, 'DEBIT', new_balance)
+        entry.save()
+        _record_stats([entry])
+        _record_events([txn.pk])
+        _notify([entry])
+
+    user.balance = new_balance
+    return txn
+
+
+def bulk_transfer(sender, items):
+    """
+    Send money from one account to many receivers in a single database
+    transaction.
+
+    ``items`` is a list of dicts with ``receiver_phone``, ``amount`` and an
+    optional ``description``. Receivers are resolved with one query, every
+    involved account is locked once, balances are updated in aggregate and
+    the transactions are written with ``bulk_create``. Items that cannot be
+    paid are reported as failed without aborting the rest of the batch.
+    Returns one result dict per item, in the order given.
+    """
+    receiver_ids = receivers.resolve_many({item['receiver_phone'] for item in items})
+
+    results = []
+    credits = {}
+    rows = []
+    entries = []
+    with db_transaction.atomic():
+        balances = lock_accounts(sender.pk, receivers=receiver_ids.values())
+        available = balances[sender.pk]
+
+        for index, item in enumerate(items):
+            amount = item['amount']
+            receiver_id = receiver_ids.get(item['receiver_phone'])
+            result = {
+                'index': index,
+                'receiver_phone': item['receiver_phone'],
+                'amount': amount,
+            }
+
+            if receiver_id not in balances:
+                error = 'Receiver not found'
+            elif receiver_id == sender.pk:
+                error = 'Cannot send money to yourself'
+            elif available < amount:
+                error = 'Insufficient balance'
+            else:
+                error = None
+
+            if error:
+                result.update(status='FAILED', error=error)
+            else:
+                available -= amount
+                credits[receiver_id] = credits.get(receiver_id, 0) + amount
+                txn = Transaction(
+                    transaction_code=generate_transaction_code(),
+                    sender=sender,
+                    receiver_id=receiver_id,
+                    amount=amount,
+                    transaction_type='SEND',
+                    status='COMPLETED',
+                    description=item.get('description', '')
+                )
+                rows.append(txn)
+                entries.append((txn, sender.pk, 'DEBIT', available))
+                entries.append((txn, receiver_id, 'CREDIT', balances[receiver_id] + credits[receiver_id]))
+                result.update(status='COMPLETED', transaction_code=txn.transaction_code)
+            results.append(result)
+
+        if rows:
+            _debit(sender.pk, balances[sender.pk] - available)
+            _credit_many(credits)
+            Transaction.objects.bulk_create(rows, batch_size=BULK_BATCH_SIZE)
+            # created_at is only populated by bulk_create, so build entries after
+            entries = LedgerEntry.objects.bulk_create(
+                [_entry(*entry) for entry in entries], batch_size=BULK_BATCH_SIZE
+            )
+            _record_stats(entries)
+            _record_events([txn.pk for txn in rows])
+            _notify(entries)
+
+    sender.balance = available
+    return results
+
+
+def enqueue_transfer(sender, receiver, amount, description=''):
+    """
+    Record a PENDING SEND transaction for ``apply_pending_transfers``.
+
+    Only inserts rows: no account is locked and no balance changes, so
+    requests do not queue behind each other on hot accounts. The ledger
+    entries are written now, with an empty ``balance_after``, so the
+    transfer shows in both parties' history while it is pending.
+    """
+    with db_transaction.atomic():
+        txn = Transaction.objects.create(
+            sender=sender,
+            receiver=receiver,
+            amount=amount,
+            transaction_type='SEND',
+            status='PENDING',
+            description=description
+        )
+        LedgerEntry.objects.bulk_create([
+            _entry(txn, sender.pk, 'DEBIT', None),
+            _entry(txn, receiver.pk, 'CREDIT', None),
+        ])
+        PendingTransfer.objects.create(transaction=txn)
+    return txn
+
+
+def apply_pending_transfers(batch_size=100):
+    """
+    Claim up to ``batch_size`` queued transfers, oldest first, and apply
+    them in a single database transaction. Returns (completed, failed).
+
+    Outbox rows are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED``, so
+    concurrent workers each take a different batch instead of waiting for
+    one another. As in ``bulk_transfer``, every account in the batch is
+    locked once, in primary key order, and balances are updated in
+    aggregate. Transfers are applied in the order they were queued; those
+    whose sender cannot cover them at that point, or whose sender or
+    receiver has been deactivated, are marked FAILED. Either way the outbox
+    row is deleted in the same transaction, so each transfer is applied
+    exactly once.
+    """
+    with db_transaction.atomic():
+        claimed = list(
+            PendingTransfer.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('transaction')
+            .order_by('pk')[:batch_size]
+        )
+        if not claimed:
+            return 0, 0
+        # Anything but PENDING was settled by hand; just drop it from the queue
+        txns = [pending.transaction for pending in claimed if pending.transaction.status == 'PENDING']
+        # Senders may have been deactivated while their transfers were queued
+        # too; every account is locked as a receiver, so such accounts are
+        # left out of the balances instead of failing the whole batch
+        balances = lock_accounts(receivers={txn.sender_id for txn in txns} | {txn.receiver_id for txn in txns})
+
+        available = dict(balances)
+        completed = {}
+        failed = []
+        for txn in txns:
+            if (txn.sender_id not in balances or txn.receiver_id not in balances
+                    or available[txn.sender_id] < txn.amount):
+                failed.append(txn)
+                continue
+            available[txn.sender_id] -= txn.amount
+            available[txn.receiver_id] += txn.amount
+            completed[txn.pk] = {
+                txn.sender_id: available[txn.sender_id],
+                txn.receiver_id: available[txn.receiver_id],
+            }
+
+        if completed:
+            changes = {user_id: available[user_id] - balances[user_id] for user_id in available}
+            _debit_many({user_id: -change for user_id, change in changes.items() if change < 0})
+            _credit_many({user_id: change for user_id, change in changes.items() if change > 0})
+            entries = list(LedgerEntry.objects.filter(transaction_id__in=completed))
+            for entry in entries:
+                entry.balance_after = completed[entry.transaction_id][entry.account_id]
+            LedgerEntry.objects.bulk_update(entries, ['balance_after'], batch_size=BULK_BATCH_SIZE)
+            _record_stats(entries)
+            _notify(entries)
+        _notify(failed=failed)
+        now = timezone.now()
+        for status, txn_ids in (('COMPLETED', list(completed)), ('FAILED', [txn.pk for txn in failed])):
+            if txn_ids:
+                Transaction.objects.filter(pk__in=txn_ids).update(status=status, updated_at=now)
+                _record_events(txn_ids, status)
+        PendingTransfer.objects.filter(pk__in=[pending.pk for pending in claimed]).delete()
+    return len(completed), len(failed)
+
+
+def compact_buckets():
+    """
+    Fold every account's balance buckets into ``User.balance`` and create
+    or remove bucket rows to match ``User.balance_buckets``. Each account is
+    handled in its own short transaction. Returns (accounts, amount folded).
+    """
+    user_ids = set(User.objects.filter(balance_buckets__gt=0).values_list('pk', flat=True))
+    user_ids.update(BalanceBucket.objects.values_list('user_id', flat=True).distinct())
+    total = 0
+    for user_id in user_ids:
+        with db_transaction.atomic():
+            row = User.objects.select_for_update().filter(pk=user_id).values_list('balance', 'balance_buckets').first()
+            if row is None:
+                continue
+            balance, wanted = row
+            total += _fold_buckets({user_id: balance}).get(user_id, 0)
+            # A bucket credited since the fold is left for the next run
+            BalanceBucket.objects.filter(user_id=user_id, bucket__gte=wanted, received_count=0).delete()
+            existing = set(BalanceBucket.objects.filter(user_id=user_id).values_list('bucket', flat=True))
+            BalanceBucket.objects.bulk_create([
+                BalanceBucket(user_id=user_id, bucket=bucket) for bucket in range(wanted) if bucket not in existing
+            ])
+    return len(user_ids), total
@@ -0,0 +1,108 @@
+# my_app/management/commands/benchmark.py
+import json
+import platform
+import subprocess
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+from my_app.benchmarks import SCENARIOS
+
+
+def flatten(results, prefix=''):
+    """{'api': {'login': {'p50_ms': 1}}} -> {'api.login.p50_ms': 1}, numbers only"""
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{name}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Runs performance benchmarks against a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Scenarios to run (default: all)')
+        parser.add_argument('--size', type=int, default=1000, help='Rows/requests per scenario')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent workers/processes')
+        parser.add_argument('--list', action='store_true', help='List available scenarios')
+        parser.add_argument('--output', help='Save results and run metadata to this JSON file')
+        parser.add_argument('--compare', help='Show the change of every metric against a saved JSON file')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, func in sorted(SCENARIOS.items()):
+                self.stdout.write(f'{name:<20} {(func.__doc__ or "").splitlines()[0]}')
+            return
+
+        names = options['scenarios'] or sorted(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenario(s): {", ".join(sorted(unknown))}')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+
+        results = {}
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        # Scenarios load the API far beyond its rate limits; see the throttle scenario for their cost
+        unthrottled = override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}})
+        try:
+            for name in names:
+                self.stdout.write(f'Running {name}...')
+                with unthrottled:
+                    result = results[name] = SCENARIOS[name](**options)
+                for key, value in result.items():
+                    self.stdout.write(f'  {key}: {value}')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'scenarios': names,
+                'size': options['size'],
+                'workers': options['workers'],
+            },
+            'results': results,
+        }
+        if baseline:
+            self.compare(baseline, report)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2, default=str)
+            self.stdout.write(f'Saved results to {options["output"]}')
+
+        self.stdout.write(self.style.SUCCESS('Benchmarks completed'))
+
+    def compare(self, baseline, report):
+        meta = baseline.get('meta', {})
+        self.stdout.write(f'Compared with {meta.get("commit") or "unknown commit"} ({meta.get("created_at")}):')
+        if (meta.get('size'), meta.get('workers')) != (report['meta']['size'], report['meta']['workers']):
+            self.stdout.write(self.style.WARNING('  Baseline used a different --size/--workers'))
+        old = flatten(baseline.get('results', {}))
+        for name, value in flatten(report['results']).items():
+            if name not in old:
+                continue
+            change = f'{(value - old[name]) / old[name]:+.1%}' if old[name] else 'n/a'
+            self.stdout.write(f'  {name}: {old[name]} -> {value} ({change})')
@@ -0,0 +1,26 @@
+# my_app/management/commands/compact_balances.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from my_app import ledger
+
+
+class Command(BaseCommand):
+    help = 'Folds balance buckets of hot accounts into their balance and creates or removes bucket rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Keep running, compacting every this many seconds (default: run once)')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        if interval is not None and interval <= 0:
+            raise CommandError('--interval must be positive')
+        while True:
+            accounts, folded = ledger.compact_buckets()
+            self.stdout.write(self.style.SUCCESS(f'Compacted {accounts} account(s), folded {folded}'))
+            if interval is None:
+                break
+            close_old_connections()
+            time.sleep(interval)
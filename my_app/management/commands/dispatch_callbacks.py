@@ -0,0 +1,35 @@
+# my_app/management/commands/dispatch_callbacks.py
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+from my_app import callbacks
+
+
+class Command(BaseCommand):
+    help = 'Delivers transaction events to the accounts\' callback endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once')
+        parser.add_argument('--per-host', type=int, default=4, help='Connections kept per callback host')
+        parser.add_argument('--claim-size', type=int, default=500, help='Events claimed per round')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when no events are due')
+        parser.add_argument('--until-empty', action='store_true', help='Exit once no events are due')
+
+    def handle(self, *args, **options):
+        for name in ('concurrency', 'per_host', 'claim_size'):
+            if options[name] < 1:
+                raise CommandError(f'--{name.replace("_", "-")} must be at least 1')
+        try:
+            handled, failed = asyncio.run(callbacks.dispatch(
+                claim_size=options['claim_size'],
+                concurrency=options['concurrency'],
+                per_host=options['per_host'],
+                poll_interval=options['poll_interval'],
+                until_empty=options['until_empty'],
+            ))
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Handled {handled} event(s); {failed} delivery(ies) failed and will be retried'
+        ))
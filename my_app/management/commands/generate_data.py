@@ -0,0 +1,68 @@
+# my_app/management/commands/generate_data.py
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from my_app import datagen, reconciliation
+from my_app.codes import CODE_EPOCH_MS
+from my_app.models import User, Transaction
+
+
+class Command(BaseCommand):
+    help = 'Generates a large, consistent synthetic dataset of users and transactions for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--transactions', type=int, default=100000)
+        parser.add_argument('--days', type=int, default=365, help='Spread transactions over this many days up to today')
+        parser.add_argument('--workers', type=int, default=4, help='Processes to generate with')
+        parser.add_argument('--pin', default='0000', help='PIN shared by every generated user')
+        parser.add_argument('--seed', default='mpesa', help='Random seed, for reproducible datasets')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        days = options['days']
+        if options['users'] < 2 * workers:
+            raise CommandError('Need at least two users per worker')
+        first_day = date.fromtimestamp(CODE_EPOCH_MS / 1000)
+        if days < 1 or (timezone.localdate() - first_day).days < days:
+            raise CommandError(f'--days must be between 1 and the number of days since {first_day}')
+        if Transaction.objects.exists():
+            raise CommandError('The database already has transactions; flush it first')
+
+        # One hash for everyone: hashing a million PINs would take hours
+        password = make_password(options['pin'])
+        taken = frozenset(User.objects.values_list('phone_number', flat=True))
+        self.stdout.write(
+            f"Generating {options['users']:,} users and {options['transactions']:,} transactions "
+            f"over {days} days with {workers} worker(s)..."
+        )
+
+        start = time.perf_counter()
+        partitions = list(range(workers))
+        args = (
+            partitions, [workers] * workers, [options['users']] * workers, [options['transactions']] * workers,
+            [days] * workers, [options['seed']] * workers, [password] * workers, [taken] * workers,
+        )
+        ranges = reconciliation.account_ranges(workers * 4)
+        if workers == 1:
+            results = list(map(datagen.generate_partition, *args))
+            list(map(datagen.rebuild_stats, *zip(*ranges)))
+        else:
+            # Forked workers must open their own connections, not share ours
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(datagen.generate_partition, *args))
+                list(pool.map(datagen.rebuild_stats, *zip(*ranges)))
+        elapsed = time.perf_counter() - start
+
+        users = sum(result['users'] for result in results)
+        transactions = sum(result['transactions'] for result in results)
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {users:,} users and {transactions:,} transactions in {elapsed:.1f}s '
+            f'({transactions / elapsed:,.0f} transactions/s)'
+        ))
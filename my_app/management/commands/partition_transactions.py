@@ -0,0 +1,45 @@
+# my_app/management/commands/partition_transactions.py
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from my_app import partitions
+
+
+class Command(BaseCommand):
+    help = 'Creates upcoming monthly partitions of the transactions table and archives old ones (PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3, help='Months after the current one to create')
+        parser.add_argument('--retain-months', type=int,
+                            help='Archive partitions older than this many months, counting the current one')
+        parser.add_argument('--archive-dir', help='Directory to write archived partitions to (.csv.gz)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning requires PostgreSQL')
+        with connection.cursor() as cursor:
+            if not partitions.is_partitioned(cursor):
+                raise CommandError(f'{partitions.TABLE} is not partitioned; run migrate first')
+
+        retain_months = options['retain_months']
+        archive_dir = options['archive_dir']
+        if retain_months is not None:
+            if retain_months < 1:
+                raise CommandError('--retain-months must be at least 1')
+            if not archive_dir or not os.path.isdir(archive_dir):
+                raise CommandError('--retain-months needs an existing --archive-dir')
+
+        done = partitions.maintain(options['ahead'], retain_months, archive_dir)
+        for action, month, *details in done:
+            name = partitions.partition_name(month)
+            if action == 'created':
+                self.stdout.write(f'Created {name} (moved {details[0]} row(s) from the default partition)')
+            elif action == 'unreconciled':
+                self.stdout.write(self.style.WARNING(
+                    f'Kept {name} and later months: no balance snapshot covers it yet (run reconcile_balances)'
+                ))
+            else:
+                path, rows = details
+                self.stdout.write(f'Archived {name} ({rows} row(s)) to {path}')
+        self.stdout.write(self.style.SUCCESS(f'Partitions up to date ({len(done)} change(s))'))
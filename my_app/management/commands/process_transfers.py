@@ -0,0 +1,32 @@
+# my_app/management/commands/process_transfers.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from my_app import transfer_queue
+
+
+class Command(BaseCommand):
+    help = 'Applies queued transfers (QUEUED_TRANSFERS) with a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Processes to apply transfers with')
+        parser.add_argument('--batch-size', type=int, default=100, help='Transfers claimed per database transaction')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds an idle worker waits before checking the queue again')
+        parser.add_argument('--until-empty', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be at least 1')
+        self.stdout.write(f'Processing queued transfers with {options["workers"]} worker(s)...')
+        started = time.perf_counter()
+        completed, failed = transfer_queue.run_workers(
+            options['workers'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+            until_empty=options['until_empty'],
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Applied {completed + failed} transfer(s) in {elapsed:.1f}s: {completed} completed, {failed} failed'
+        ))
@@ -0,0 +1,54 @@
+# my_app/management/commands/reconcile_balances.py
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from my_app import reconciliation
+
+
+class Command(BaseCommand):
+    help = 'Snapshots daily closing balances and reconciles User.balance against the ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat,
+                            help='Day to snapshot, YYYY-MM-DD (default: yesterday)')
+        parser.add_argument('--workers', type=int, default=4, help='Processes to reconcile with')
+        parser.add_argument('--ranges', type=int, help='Account id ranges to split into (default: 4 per worker)')
+        parser.add_argument('--chunk-size', type=int, default=reconciliation.CHUNK_SIZE,
+                            help='Rows fetched per round trip')
+        parser.add_argument('--show', type=int, default=20, help='Drifted accounts to list')
+
+    def handle(self, *args, **options):
+        day = options['date'] or timezone.localdate() - timedelta(days=1)
+        since = reconciliation.last_snapshot_day(day)
+        workers = max(1, options['workers'])
+        ranges = reconciliation.account_ranges(options['ranges'] or workers * 4)
+        reconciliation.settle(day)
+        self.stdout.write(
+            f'Reconciling {day} from {"snapshot of " + str(since) if since else "the start of the ledger"} '
+            f'in {len(ranges)} range(s)...'
+        )
+
+        args = ([day] * len(ranges), [since] * len(ranges), *zip(*ranges), [options['chunk_size']] * len(ranges))
+        if workers == 1:
+            results = list(map(reconciliation.reconcile_range, *args))
+        else:
+            # Forked workers must open their own connections, not share ours
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(reconciliation.reconcile_range, *args))
+
+        accounts = sum(result['accounts'] for result in results)
+        snapshots = sum(result['snapshots'] for result in results)
+        drift = [row for result in results for row in result['drift']]
+        self.stdout.write(f'Checked {accounts} account(s), wrote {snapshots} snapshot(s)')
+
+        if drift:
+            for phone_number, expected, actual in sorted(drift)[:options['show']]:
+                self.stdout.write(self.style.ERROR(
+                    f'  {phone_number}: ledger says {expected}, balance is {actual} ({actual - expected:+})'
+                ))
+            raise CommandError(f'{len(drift)} account(s) drifted from the ledger')
+        self.stdout.write(self.style.SUCCESS('All balances match the ledger'))
@@ -2,6 +2,7 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from my_app.models import User, Transaction
+from my_app import ledger
 from decimal import Decimal
 import random
 
@@ -198,22 +199,7 @@ class Command(BaseCommand):
                 
                 # Only create transaction if sender has enough balance
                 if sender.balance >= amount:
-                    # Update balances
-                    sender.balance -= amount
-                    sender.save()
-                    
-                    receiver.balance += amount
-                    receiver.save()
-                    
-                    # Create transaction
-                    Transaction.objects.create(
-                        sender=sender,
-                        receiver=receiver,
-                        amount=amount,
-                        transaction_type='SEND',
-                        status='COMPLETED',
-                        description=random.choice(transaction_descriptions)
-                    )
+                    ledger.transfer(sender, receiver, amount, random.choice(transaction_descriptions))
                     transactions_created += 1
             
             # Create DEPOSIT transactions
@@ -221,16 +207,7 @@ class Command(BaseCommand):
                 user = random.choice(created_users)
                 amount = Decimal(random.choice([1000, 2000, 5000, 10000, 15000, 20000]))
                 
-                user.balance += amount
-                user.save()
-                
-                Transaction.objects.create(
-                    receiver=user,
-                    amount=amount,
-                    transaction_type='DEPOSIT',
-                    status='COMPLETED',
-                    description='M-Pesa deposit from agent'
-                )
+                ledger.deposit(user, amount, 'M-Pesa deposit from agent')
                 transactions_created += 1
             
             # Create WITHDRAW transactions
@@ -240,16 +217,7 @@ class Command(BaseCommand):
                 
                 # Only withdraw if user has enough balance
                 if user.balance >= amount:
-                    user.balance -= amount
-                    user.save()
-                    
-                    Transaction.objects.create(
-                        sender=user,
-                        amount=amount,
-                        transaction_type='WITHDRAW',
-                        status='COMPLETED',
-                        description='ATM withdrawal'
-                    )
+                    ledger.withdraw(user, amount, 'ATM withdrawal')
                     transactions_created += 1
             
             self.stdout.write(f'Successfully created {transactions_created} transactions')
@@ -0,0 +1,207 @@
+# my_app/metrics.py
+"""
+Per-request performance metrics in the Prometheus text format.
+
+MetricsMiddleware opens a RequestStats for every request in a context
+variable. Database queries on any connection (including those run by
+async views in sync_to_async threads) are timed by an execute wrapper
+installed when the connection is created; serializers and the ledger's
+account locking add their time with ``track()``. When the response is
+ready the totals are observed into histograms labelled by view, which
+``/metrics`` renders.
+
+Metrics live in process memory: each worker process exposes its own, as
+with the local-memory cache. ``/metrics`` only answers the addresses in
+``METRICS_ALLOWED_IPS``, loopback by default.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'mpesa_'
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+DEFAULT_ALLOWED_IPS = ('127.0.0.1', '::1')
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set; callers hold the registry lock"""
+
+    def __init__(self, name, help_text, buckets, labels):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        self.series = {}
+
+    def observe(self, label_values, value):
+        series = self.series.get(label_values)
+        if series is None:
+            # Per-bucket counts (made cumulative on render), +Inf, sum
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        name = PREFIX + self.name
+        yield f'# HELP {name} {self.help_text}'
+        yield f'# TYPE {name} histogram'
+        for label_values, (counts, total) in sorted(self.series.items()):
+            labels = ','.join(f'{key}="{escape(value)}"' for key, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            yield f'{name}_sum{{{labels}}} {total}'
+            yield f'{name}_count{{{labels}}} {cumulative}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, label_values, amount=1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        name = PREFIX + self.name
+        yield f'# HELP {name} {self.help_text}'
+        yield f'# TYPE {name} counter'
+        for label_values, value in sorted(self.series.items()):
+            labels = ','.join(f'{key}="{escape(value)}"' for key, value in zip(self.labels, label_values))
+            yield f'{name}{{{labels}}} {value}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter('http_requests_total', 'Requests by view, method and status', ('view', 'method', 'status'))
+        self.duration = Histogram('http_request_duration_seconds', 'Time spent in the view and middleware',
+                                  SECONDS_BUCKETS, ('view', 'method'))
+        self.queries = Histogram('http_request_db_queries', 'Database queries per request', QUERY_BUCKETS, ('view',))
+        self.db_time = Histogram('http_request_db_seconds', 'Time spent in database queries per request',
+                                 SECONDS_BUCKETS, ('view',))
+        self.serializer_time = Histogram('http_request_serializer_seconds',
+                                         'Time spent validating and serializing per request',
+                                         SECONDS_BUCKETS, ('view',))
+        self.lock_wait = Histogram('http_request_lock_wait_seconds', 'Time spent acquiring account row locks',
+                                   SECONDS_BUCKETS, ('view',))
+
+    def record(self, view, method, status, duration, stats):
+        with self.lock:
+            self.requests.inc((view, method, str(status)))
+            self.duration.observe((view, method), duration)
+            self.queries.observe((view,), stats.queries)
+            self.db_time.observe((view,), stats.db_time)
+            if stats.serializer_time:
+                self.serializer_time.observe((view,), stats.serializer_time)
+            if stats.lock_wait is not None:
+                self.lock_wait.observe((view,), stats.lock_wait)
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in (self.requests, self.duration, self.queries, self.db_time,
+                           self.serializer_time, self.lock_wait):
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            for metric in (self.requests, self.duration, self.queries, self.db_time,
+                           self.serializer_time, self.lock_wait):
+                metric.series.clear()
+
+
+registry = Registry()
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'serializer_time', 'lock_wait')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        # None unless the request locked accounts
+        self.lock_wait = None
+
+
+current_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+def is_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def start_request():
+    """Start collecting for the current context; returns the token for ``finish_request``"""
+    return current_stats.set(RequestStats())
+
+
+def finish_request(token, request, response, start):
+    stats = current_stats.get()
+    current_stats.reset(token)
+    match = getattr(request, 'resolver_match', None)
+    # Unresolved paths share one label so scans cannot grow the series
+    view = match.view_name if match else '<unmatched>'
+    registry.record(view, request.method, response.status_code, time.perf_counter() - start, stats)
+
+
+@contextmanager
+def track(field):
+    """Add the time spent in the block to the current request's ``field``"""
+    stats = current_stats.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(stats, field, (getattr(stats, field) or 0.0) + time.perf_counter() - start)
+
+
+def time_queries(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def install_query_timer(sender, connection, **kwargs):
+    # Outermost, and first so that a surrounding ``execute_wrapper()`` block
+    # still pops its own wrapper; the list survives reconnects
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_queries)
+
+
+connection_created.connect(install_query_timer)
+
+
+def metrics_view(request):
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', DEFAULT_ALLOWED_IPS)
+    if request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
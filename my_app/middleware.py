@@ -0,0 +1,38 @@
+# my_app/middleware.py
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+from . import metrics
+
+
+class MetricsMiddleware:
+    """
+    Record per-view timing, query count, DB time, serializer time and lock
+    wait (see my_app/metrics.py). Runs natively under both WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics.is_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        token = metrics.start_request()
+        response = self.get_response(request)
+        metrics.finish_request(token, request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        token = metrics.start_request()
+        response = await self.get_response(request)
+        metrics.finish_request(token, request, response, start)
+        return response
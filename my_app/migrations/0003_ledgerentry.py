@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0002_user_groups_user_user_permissions_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direction', models.CharField(choices=[('DEBIT', 'Debit'), ('CREDIT', 'Credit')], max_length=6)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('balance_after', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('account', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+                ('transaction', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='my_app.transaction')),
+            ],
+            options={
+                'db_table': 'ledger_entries',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['account', '-created_at', '-transaction'], name='ledger_account_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('transaction', 'account'), name='ledger_entry_unique_party')],
+            },
+        ),
+    ]
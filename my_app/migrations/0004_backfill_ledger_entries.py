@@ -0,0 +1,71 @@
+from django.db import migrations, transaction
+from django.db.models import Q, Sum
+
+CHUNK_SIZE = 5000
+
+
+def backfill_ledger_entries(apps, schema_editor):
+    """
+    Create ledger entries for existing transactions, oldest first, in chunks.
+
+    Running balances are rebuilt forward from each account's opening balance
+    (current balance minus the net of its COMPLETED transactions). Chunks
+    commit separately and are keyed on the unique (transaction, account)
+    constraint, so an interrupted run can simply be repeated.
+    """
+    User = apps.get_model('my_app', 'User')
+    Transaction = apps.get_model('my_app', 'Transaction')
+    LedgerEntry = apps.get_model('my_app', 'LedgerEntry')
+
+    completed = Transaction.objects.filter(status='COMPLETED')
+    balances = dict(User.objects.values_list('pk', 'balance'))
+    for row in completed.exclude(receiver=None).values('receiver').annotate(total=Sum('amount')):
+        balances[row['receiver']] -= row['total']
+    for row in completed.exclude(sender=None).values('sender').annotate(total=Sum('amount')):
+        balances[row['sender']] += row['total']
+
+    position = None
+    while True:
+        chunk = Transaction.objects.order_by('created_at', 'id')
+        if position:
+            created_at, pk = position
+            chunk = chunk.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+        chunk = list(chunk.values(
+            'id', 'sender', 'receiver', 'amount', 'status', 'created_at'
+        )[:CHUNK_SIZE])
+        if not chunk:
+            break
+
+        entries = []
+        for txn in chunk:
+            applied = txn['status'] == 'COMPLETED'
+            for account_id, direction, sign in ((txn['sender'], 'DEBIT', -1), (txn['receiver'], 'CREDIT', 1)):
+                if account_id is None:
+                    continue
+                if applied:
+                    balances[account_id] += sign * txn['amount']
+                entries.append(LedgerEntry(
+                    account_id=account_id,
+                    transaction_id=txn['id'],
+                    direction=direction,
+                    amount=txn['amount'],
+                    balance_after=balances[account_id] if applied else None,
+                    created_at=txn['created_at']
+                ))
+
+        with transaction.atomic():
+            LedgerEntry.objects.bulk_create(entries, ignore_conflicts=True)
+        position = chunk[-1]['created_at'], chunk[-1]['id']
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('my_app', '0003_ledgerentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_ledger_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0005_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_sent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_received', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('received_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'user_stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyUserStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('total_sent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_received', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('received_count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'daily_user_stats',
+                'constraints': [models.UniqueConstraint(fields=('user', 'day'), name='daily_user_stats_unique_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+BATCH_SIZE = 5000
+FIELDS = ('total_sent', 'sent_count', 'total_received', 'received_count')
+
+
+def backfill_user_stats(apps, schema_editor):
+    """
+    Build DailyUserStats from the ledger entries of COMPLETED transactions
+    (those with a balance_after), then UserStats from the daily buckets.
+    Days are local dates in the project TIME_ZONE, as in ledger.py.
+    """
+    LedgerEntry = apps.get_model('my_app', 'LedgerEntry')
+    UserStats = apps.get_model('my_app', 'UserStats')
+    DailyUserStats = apps.get_model('my_app', 'DailyUserStats')
+
+    rows = (
+        LedgerEntry.objects.filter(balance_after__isnull=False)
+        .annotate(day=TruncDate('created_at'))
+        .values('account_id', 'day', 'direction')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by('account_id', 'day')
+    )
+
+    buckets = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        key = row['account_id'], row['day']
+        if not buckets or (buckets[-1].user_id, buckets[-1].day) != key:
+            if len(buckets) >= BATCH_SIZE:
+                DailyUserStats.objects.bulk_create(buckets)
+                buckets = []
+            buckets.append(DailyUserStats(user_id=row['account_id'], day=row['day']))
+        bucket = buckets[-1]
+        if row['direction'] == 'DEBIT':
+            bucket.total_sent, bucket.sent_count = row['total'], row['count']
+        else:
+            bucket.total_received, bucket.received_count = row['total'], row['count']
+    DailyUserStats.objects.bulk_create(buckets)
+
+    totals = DailyUserStats.objects.values('user_id').annotate(**{
+        f'sum_{field}': Sum(field) for field in FIELDS
+    })
+    UserStats.objects.bulk_create([
+        UserStats(user_id=row['user_id'], **{field: row[f'sum_{field}'] for field in FIELDS})
+        for row in totals.iterator(chunk_size=BATCH_SIZE)
+    ], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0006_userstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_user_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+from my_app import partitions
+
+TABLE = partitions.TABLE
+UNPARTITIONED = f'{TABLE}_unpartitioned'
+# Months created after the current one; partition_transactions keeps this up
+AHEAD = 3
+
+
+def user_foreign_keys(table, suffix):
+    return [
+        f'ALTER TABLE {table} ADD CONSTRAINT {TABLE}_{column}_fk_users_id{suffix} FOREIGN KEY ({column}) '
+        f'REFERENCES users (id) DEFERRABLE INITIALLY DEFERRED'
+        for column in ('sender_id', 'receiver_id')
+    ]
+
+
+def partition_transactions(apps, schema_editor):
+    """
+    Rebuild ``transactions`` as a table partitioned by month on created_at
+    (see my_app/partitions.py), with a partition for every month from the
+    oldest transaction to AHEAD months from now, and copy the rows across.
+    The copy holds an exclusive lock on the table, so run it in a
+    maintenance window on large tables.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Transaction = apps.get_model('my_app', 'Transaction')
+    oldest = Transaction.objects.aggregate(oldest=models.Min('created_at'))['oldest']
+    this_month = timezone.localdate().replace(day=1)
+    month = timezone.localtime(oldest).date().replace(day=1) if oldest else this_month
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {UNPARTITIONED}')
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {UNPARTITIONED} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)'
+        )
+        for sql in [
+            f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pk_id_created_at PRIMARY KEY (id, created_at)',
+            f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_code_created_at_uniq UNIQUE (transaction_code, created_at)',
+            f'CREATE INDEX {TABLE}_sender_id_part_idx ON {TABLE} (sender_id)',
+            f'CREATE INDEX {TABLE}_receiver_id_part_idx ON {TABLE} (receiver_id)',
+            *user_foreign_keys(TABLE, '_part'),
+            f'CREATE TABLE {partitions.DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT',
+        ]:
+            cursor.execute(sql)
+        while month <= partitions.add_months(this_month, AHEAD):
+            partitions.create_partition(cursor, month)
+            month = partitions.add_months(month, 1)
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {UNPARTITIONED}')
+        cursor.execute(f'DROP TABLE {UNPARTITIONED}')
+
+
+def unpartition_transactions(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for sql in [
+            f'CREATE TABLE {UNPARTITIONED} (LIKE {TABLE} INCLUDING DEFAULTS)',
+            f'INSERT INTO {UNPARTITIONED} SELECT * FROM {TABLE}',
+            f'DROP TABLE {TABLE}',
+            f'ALTER TABLE {UNPARTITIONED} RENAME TO {TABLE}',
+            f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id)',
+            f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_transaction_code_key UNIQUE (transaction_code)',
+            f'CREATE INDEX {TABLE}_sender_id_idx ON {TABLE} (sender_id)',
+            f'CREATE INDEX {TABLE}_receiver_id_idx ON {TABLE} (receiver_id)',
+            *user_foreign_keys(TABLE, ''),
+        ]:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0008_balancesnapshot'),
+    ]
+
+    operations = [
+        # A foreign key to a partitioned table must include the partition key
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='transaction',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='my_app.transaction'),
+        ),
+        migrations.RunPython(partition_transactions, unpartition_transactions),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0009_partition_transactions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingTransfer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('transaction', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='my_app.transaction')),
+            ],
+            options={
+                'db_table': 'pending_transfers',
+            },
+        ),
+    ]
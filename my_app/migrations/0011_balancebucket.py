@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0010_pendingtransfer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='balance_buckets',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='BalanceBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_received', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('received_count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'balance_buckets',
+                'constraints': [models.UniqueConstraint(fields=('user', 'bucket'), name='balance_bucket_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:46
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0011_balancebucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallbackEndpoint',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='callback_endpoint', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('confirmation_url', models.URLField(blank=True, max_length=500)),
+                ('result_url', models.URLField(blank=True, max_length=500)),
+                ('secret', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'callback_endpoints',
+            },
+        ),
+        migrations.CreateModel(
+            name='TransactionEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('transaction', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='my_app.transaction')),
+            ],
+            options={
+                'db_table': 'transaction_events',
+                'indexes': [models.Index(fields=['next_attempt_at', 'id'], name='transaction_event_due_idx')],
+            },
+        ),
+    ]
@@ -1,8 +1,10 @@
 # my_app/models.py
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.core.validators import RegexValidator
 import uuid
+from .codes import generate_transaction_code
 
 class UserManager(BaseUserManager):
     def create_user(self, phone_number, pin, **extra_fields):
@@ -29,6 +31,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     phone_number = models.CharField(validators=[phone_regex], max_length=17, unique=True)
     full_name = models.CharField(max_length=255)
     balance = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    # Spread incoming transfers over this many BalanceBucket rows (0: off)
+    balance_buckets = models.PositiveSmallIntegerField(default=0)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -46,6 +50,33 @@ class User(AbstractBaseUser, PermissionsMixin):
         db_table = 'users'
 
 
+class BalanceBucket(models.Model):
+    """
+    Part of a hot account's balance (see ``User.balance_buckets``).
+
+    Transfers to the account add to a random bucket instead of updating
+    its ``users`` row, so concurrent payments only contend per bucket. The
+    account's balance is ``User.balance`` plus its buckets; whenever the
+    account row is locked, and periodically by ``compact_balances``, the
+    buckets are folded into ``User.balance`` along with their received
+    totals, which reach UserStats then.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='buckets', db_index=False)
+    bucket = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_received = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    received_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Bucket {self.bucket} of {self.user_id}"
+
+    class Meta:
+        db_table = 'balance_buckets'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'bucket'], name='balance_bucket_unique'),
+        ]
+
+
 class Transaction(models.Model):
     TRANSACTION_TYPES = (
         ('SEND', 'Send Money'),
@@ -72,9 +103,7 @@ class Transaction(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.transaction_code:
-            import random
-            import string
-            self.transaction_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=12))
+            self.transaction_code = generate_transaction_code()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -82,4 +111,194 @@ class Transaction(models.Model):
 
     class Meta:
         db_table = 'transactions'
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+
+class LedgerEntry(models.Model):
+    """
+    One row per party per transaction, so an account's history is a single
+    index range scan on (account, created_at) rather than an OR across the
+    sender and receiver columns of ``transactions``.
+    """
+    DIRECTIONS = (
+        ('DEBIT', 'Debit'),
+        ('CREDIT', 'Credit'),
+    )
+
+    # Both lookups are served by the composite index/unique constraint below
+    account = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ledger_entries', db_index=False)
+    # No database constraint: transactions is partitioned (see partitions.py)
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='ledger_entries',
+                                    db_index=False, db_constraint=False)
+    direction = models.CharField(max_length=6, choices=DIRECTIONS)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    # Account balance once this transaction was applied; empty while it is
+    # not COMPLETED, and for a payment into a balance bucket until the
+    # bucket is folded
+    balance_after = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    # Copied from the transaction so the account index can serve ordering
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.account} {self.direction} {self.amount}"
+
+    class Meta:
+        db_table = 'ledger_entries'
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['transaction', 'account'], name='ledger_entry_unique_party'),
+        ]
+        indexes = [
+            models.Index(fields=['account', '-created_at', '-transaction'], name='ledger_account_created_idx'),
+        ]
+
+
+class UserStats(models.Model):
+    """
+    Lifetime totals of an account's COMPLETED transactions.
+
+    Maintained by ``ledger`` in the same database transaction as the balance
+    change, while the account row is locked, so it never drifts from the
+    ledger and reads cost a single primary key lookup.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    total_sent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_received = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    received_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Stats for {self.user_id}"
+
+    class Meta:
+        db_table = 'user_stats'
+
+
+class DailyUserStats(models.Model):
+    """Per-day buckets of UserStats, used for rolling windows (e.g. last 30 days)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats', db_index=False)
+    day = models.DateField()
+    total_sent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_received = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    received_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Stats for {self.user_id} on {self.day}"
+
+    class Meta:
+        db_table = 'daily_user_stats'
+        constraints = [
+            # Also serves "this user's last N days" as a range scan
+            models.UniqueConstraint(fields=['user', 'day'], name='daily_user_stats_unique_day'),
+        ]
+
+
+class BalanceSnapshot(models.Model):
+    """Closing balance of an account at the end of a local day (see reconciliation.py)"""
+    account = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balance_snapshots', db_index=False)
+    day = models.DateField()
+    closing_balance = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.account_id} closed {self.day} at {self.closing_balance}"
+
+    class Meta:
+        db_table = 'balance_snapshots'
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'day'], name='balance_snapshot_unique_day'),
+        ]
+        indexes = [
+            # Reconciliation reads one day's snapshots per account range
+            models.Index(fields=['day', 'account'], name='balance_snapshot_day_idx'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """Stored outcome of a money-moving request sent with an Idempotency-Key header"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys', db_index=False)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user} {self.key}"
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_unique_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
+
+
+class PendingTransfer(models.Model):
+    """
+    Outbox of queued SEND transactions. The row is written in the same
+    database transaction as the PENDING transaction and deleted by the
+    ``process_transfers`` worker that applies it (see ledger.py).
+    """
+    # No database constraint: transactions is partitioned (see partitions.py)
+    transaction = models.OneToOneField(Transaction, on_delete=models.CASCADE, related_name='+', db_constraint=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Pending {self.transaction_id}"
+
+    class Meta:
+        db_table = 'pending_transfers'
+
+
+class CallbackEndpoint(models.Model):
+    """
+    Where an account wants to be told about its transactions (see
+    callbacks.py): money received is posted to ``confirmation_url`` and the
+    outcome of money sent or withdrawn to ``result_url``.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='callback_endpoint')
+    confirmation_url = models.URLField(max_length=500, blank=True)
+    result_url = models.URLField(max_length=500, blank=True)
+    # Key for the HMAC signature of each callback
+    secret = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Callbacks for {self.user_id}"
+
+    class Meta:
+        db_table = 'callback_endpoints'
+
+
+class TransactionEvent(models.Model):
+    """
+    Outbox of transaction events to deliver as callbacks, written by the
+    ledger in the same database transaction as the transaction itself.
+    ``account`` is empty for a new event (every party with an endpoint) and
+    set on the retries of deliveries that failed.
+    """
+    # No database constraint: transactions is partitioned (see partitions.py)
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='+',
+                                    db_index=False, db_constraint=False)
+    # The transaction's status when the event was recorded
+    status = models.CharField(max_length=10, choices=Transaction.STATUS_CHOICES)
+    account = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', null=True, blank=True,
+                                db_index=False)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.status} event for {self.transaction_id}"
+
+    class Meta:
+        db_table = 'transaction_events'
+        indexes = [
+            # The dispatcher claims events that are due, oldest first
+            models.Index(fields=['next_attempt_at', 'id'], name='transaction_event_due_idx'),
+        ]
@@ -0,0 +1,120 @@
+# my_app/pagination.py
+import base64
+import uuid
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over ``(created_at, id)``, newest first.
+
+    Each page is fetched with a range condition on the last row of the
+    previous page instead of an OFFSET, and no COUNT query is issued, so deep
+    pages cost the same as the first one. Cursors are opaque base64 tokens.
+
+    Views can set ``keyset_fields`` to paginate on other (timestamp, uuid)
+    columns, e.g. annotations taken from an indexed joined table.
+    """
+    keyset_fields = ('created_at', 'id')
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.get_page(list(self.get_page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` for async views, fetching with ``async for``"""
+        return self.get_page([row async for row in self.get_page_queryset(queryset, request, view)])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """The unevaluated query for one page plus one lookahead row"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.next_position = None
+        self.keyset_fields = getattr(view, 'keyset_fields', self.keyset_fields)
+        created_field, id_field = self.keyset_fields
+
+        queryset = queryset.order_by(f'-{created_field}', f'-{id_field}')
+        position = self.decode_cursor(request)
+        if position:
+            created_at, pk = position
+            queryset = queryset.filter(
+                Q(**{f'{created_field}__lt': created_at})
+                | Q(**{created_field: created_at, f'{id_field}__lt': pk})
+            )
+        return queryset[:self.page_size + 1]
+
+    def get_page(self, rows):
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            self.next_position = self.get_position(rows[-1])
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_position(self, row):
+        if isinstance(row, dict):
+            return tuple(row[field] for field in self.keyset_fields)
+        return tuple(getattr(row, field) for field in self.keyset_fields)
+
+    def encode_cursor(self, position):
+        created_at, pk = position
+        raw = f'{created_at.isoformat()}|{pk.hex}'
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode()
+            created_at, pk = raw.split('|')
+            return datetime.fromisoformat(created_at), uuid.UUID(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_link_headers(self):
+        next_link = self.get_next_link()
+        if next_link:
+            return {'Link': f'<{next_link}>; rel="next"'}
+        return {}
+
+    def get_list_response(self, data):
+        """Plain list response with the next page advertised in a Link header"""
+        return Response(data, headers=self.get_link_headers())
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
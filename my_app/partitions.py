@@ -0,0 +1,256 @@
+# my_app/partitions.py
+"""
+Monthly range partitions of the ``transactions`` table (PostgreSQL only).
+
+Migration 0009 makes ``transactions`` a table partitioned by ``created_at``
+with one partition per local calendar month (``transactions_y2026m10``) and
+a default partition, so an insert never fails for lack of a partition. The
+``partition_transactions`` command keeps the coming months created, gives
+any month the default partition holds rows for its own partition, and
+archives old months (see ``archive_partition``). Inserts only touch the
+current month's partition and its indexes, and a lookup by id probes one
+small index per retained month, so neither slows down as history
+accumulates beyond the retention window.
+
+Archiving a month removes the rows of the tables in DEPENDENTS that belong
+to its transactions along with them, so history and statements, which join
+ledger entries to their transactions, start at the oldest retained month
+instead of silently skipping entries. A month is only archived once a
+balance snapshot covers it, so reconciliation no longer needs its ledger
+entries.
+
+Postgres requires the partition key in every unique constraint of a
+partitioned table, so the primary key is (id, created_at) and transaction
+codes are unique per partition; ids are UUIDs and codes are generated
+unique (see codes.py), so both stay unique across partitions. Ledger
+entries reference transactions without a database foreign key for the same
+reason.
+"""
+import gzip
+import os
+import re
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction as db_transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import BalanceSnapshot
+
+TABLE = 'transactions'
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_NAME = re.compile(rf'^{TABLE}_y(\d{{4}})m(\d{{2}})$')
+# Tables with a transaction_id column, archived and deleted with the month
+DEPENDENTS = ('ledger_entries', 'pending_transfers', 'transaction_events')
+# How long detaching waits for the lock on ``transactions``; queries queue
+# behind a waiting ACCESS EXCLUSIVE request, so give up early and retry on
+# the next run rather than stall them
+DETACH_LOCK_TIMEOUT_MS = 5000
+
+
+class ArchiveError(Exception):
+    """A partition changed while it was being archived; it stays attached"""
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_y{month.year}m{month.month:02d}'
+
+
+def partition_month(name):
+    """The month a partition name stands for, or None for other tables"""
+    match = PARTITION_NAME.match(name)
+    return date(int(match[1]), int(match[2]), 1) if match else None
+
+
+def month_bounds(month):
+    """(start, end) of a local calendar month as aware datetimes; end is exclusive"""
+    return tuple(
+        timezone.make_aware(datetime.combine(day, time.min))
+        for day in (month, add_months(month, 1))
+    )
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = %s AND pg_table_is_visible(c.oid))", [TABLE]
+    )
+    return cursor.fetchone()[0]
+
+
+def list_partitions(cursor):
+    """Months that have their own partition, oldest first"""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = %s AND pg_table_is_visible(p.oid)", [TABLE]
+    )
+    return sorted(filter(None, (partition_month(name) for name, in cursor.fetchall())))
+
+
+def default_partition_months(cursor):
+    """Local months the default partition holds rows for"""
+    cursor.execute(
+        f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE %s)::date FROM {DEFAULT_PARTITION}",
+        [settings.TIME_ZONE]
+    )
+    return sorted(month for month, in cursor.fetchall())
+
+
+def create_partition(cursor, month):
+    """
+    Create the partition for ``month`` and move the default partition's
+    rows for it across (attaching fails while the default holds any).
+    Returns the number of rows moved.
+    """
+    name = partition_name(month)
+    start, end = month_bounds(month)
+    cursor.execute(f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s RETURNING *) '
+        f'INSERT INTO {name} SELECT * FROM moved', [start, end]
+    )
+    moved = cursor.rowcount
+    # DDL takes no bind parameters; the bounds are our own timestamps
+    cursor.execute(
+        f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+    return moved
+
+
+def detached_partitions(cursor):
+    """Partitions detached by an archive run that did not get to drop them"""
+    cursor.execute(
+        "SELECT relname FROM pg_class WHERE relkind = 'r' AND NOT relispartition "
+        "AND relname LIKE %s AND pg_table_is_visible(oid)", [f'{TABLE}\\_y%']
+    )
+    return sorted(name for name, in cursor.fetchall() if partition_month(name))
+
+
+def copy_to_file(cursor, sql, path):
+    """Run ``COPY ... TO STDOUT`` into a gzipped file, durably"""
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+    partial = f'{path}.partial'
+    if is_psycopg3:
+        with gzip.open(partial, 'wb') as file, cursor.copy(sql) as copy:
+            for data in copy:
+                file.write(data)
+    else:
+        with gzip.open(partial, 'wt', encoding='utf-8') as file:
+            cursor.copy_expert(sql, file)
+    with open(partial, 'rb') as file:
+        os.fsync(file.fileno())
+    os.replace(partial, path)
+
+
+def archive_partition(cursor, month, directory):
+    """
+    Archive the partition for ``month`` and its transactions' rows in
+    DEPENDENTS to ``<directory>/<table>_y<year>m<month>.csv.gz`` files (with
+    a header row), then remove them all. Returns (transactions file, rows).
+
+    The files are written from one snapshot while the partition is still
+    attached, so nothing waits on the copy; the rows are counted in that
+    snapshot too, as ``rowcount`` after COPY depends on the driver. Only
+    then is the partition detached, in a short transaction that first checks
+    it still holds what was counted (else ArchiveError, and it stays attached).
+    Detaching ``CONCURRENTLY`` is not an option: Postgres refuses it while
+    there is a default partition. Finally the dependent rows are deleted and
+    the table dropped (``drop_detached``). Each step commits on its own
+    unless called in a transaction.
+    """
+    name = partition_name(month)
+    suffix = name[len(TABLE):]
+    if os.path.exists(os.path.join(directory, f'{name}.csv.gz')):
+        # Rows that arrived for an already archived month
+        suffix = f'{suffix}-{timezone.now():%Y%m%d%H%M%S}'
+    paths = [os.path.join(directory, f'{table}{suffix}.csv.gz') for table in (TABLE, *DEPENDENTS)]
+
+    outermost = not connection.in_atomic_block
+    with db_transaction.atomic():
+        if outermost:
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        # Any write to a transaction bumps updated_at, so these tell whether
+        # the partition still holds what is copied by the time it is detached
+        cursor.execute(f'SELECT count(*), max(updated_at) FROM {name}')
+        expected = tuple(cursor.fetchone())
+        copy_to_file(cursor, f'COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)', paths[0])
+        for table, path in zip(DEPENDENTS, paths[1:]):
+            copy_to_file(
+                cursor,
+                f'COPY (SELECT * FROM {table} WHERE transaction_id IN (SELECT id FROM {name})) '
+                f'TO STDOUT WITH (FORMAT csv, HEADER)',
+                path
+            )
+
+    try:
+        with db_transaction.atomic():
+            cursor.execute(f'SET LOCAL lock_timeout = {DETACH_LOCK_TIMEOUT_MS}')
+            cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+            cursor.execute(f'SELECT count(*), max(updated_at) FROM {name}')
+            if tuple(cursor.fetchone()) != expected:
+                raise ArchiveError(f'{name} changed while it was being archived')
+    except Exception:
+        for path in paths:
+            os.remove(path)
+        raise
+
+    drop_detached(cursor, name)
+    return paths[0], expected[0]
+
+
+def drop_detached(cursor, name):
+    """Delete the rows in DEPENDENTS of a detached partition's transactions, then drop it"""
+    with db_transaction.atomic():
+        for table in DEPENDENTS:
+            cursor.execute(f'DELETE FROM {table} WHERE transaction_id IN (SELECT id FROM {name})')
+        cursor.execute(f'DROP TABLE {name}')
+
+
+def last_snapshot_day():
+    return BalanceSnapshot.objects.aggregate(day=Max('day'))['day']
+
+
+def maintain(ahead=3, retain_months=None, archive_dir=None, today=None):
+    """
+    Create partitions up to ``ahead`` months after the current one and for
+    every month in the default partition; with ``retain_months``, archive
+    the partitions of months before the last ``retain_months`` (the current
+    month counts) to ``archive_dir``, once a balance snapshot covers them.
+
+    Each partition is handled in its own transactions. Returns a list of
+    ``('created', month, rows moved)``, ``('archived', month, path, rows)``
+    and ``('unreconciled', month)`` for months left for a later run.
+    """
+    this_month = (today or timezone.localdate()).replace(day=1)
+    done = []
+    with connection.cursor() as cursor:
+        existing = set(list_partitions(cursor))
+        wanted = {add_months(this_month, offset) for offset in range(ahead + 1)}
+        wanted.update(default_partition_months(cursor))
+        for month in sorted(wanted - existing):
+            with db_transaction.atomic():
+                done.append(('created', month, create_partition(cursor, month)))
+
+        # Left over by an archive run that stopped after detaching
+        for name in detached_partitions(cursor):
+            drop_detached(cursor, name)
+
+        if retain_months is not None:
+            oldest_kept = add_months(this_month, 1 - retain_months)
+            snapshot = last_snapshot_day()
+            for month in list_partitions(cursor):
+                if month >= oldest_kept:
+                    break
+                if snapshot is None or snapshot < add_months(month, 1) - timedelta(days=1):
+                    done.append(('unreconciled', month))
+                    break
+                done.append(('archived', month, *archive_partition(cursor, month, archive_dir)))
+    return done
@@ -0,0 +1,128 @@
+# my_app/push.py
+"""
+Pushing balance and transaction notifications to connected clients.
+
+Under ASGI, ``GET /api/transactions/stream/`` (async_views.stream) keeps a
+server-sent events stream open for the authenticated account. It starts
+with the account's balance and then carries one ``transaction`` event per
+ledger entry of the account, with the balance after it, so clients can
+stop polling the balance and history endpoints.
+
+The ledger publishes once a transaction has committed, through the broker
+named by ``PUSH_BROKER`` (None disables publishing). A broker has two
+methods:
+
+* ``publish(user_id, message)``, called from sync code in any thread; it
+  must not block on slow subscribers.
+* ``subscribe(user_id)``, an async context manager yielding a subscription
+  whose ``await get()`` returns the next message for ``user_id``.
+
+``LocalBroker`` fans out within one process, so a client only hears about
+transactions made by the server process it is connected to. With several
+server processes, or with ``process_transfers`` workers applying queued
+transfers, configure a broker shared between processes (one built on Redis
+or PostgreSQL LISTEN/NOTIFY, say) with the same two methods.
+"""
+import asyncio
+import functools
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Messages held for a subscriber that is not keeping up; older ones are dropped
+QUEUE_SIZE = 100
+# Seconds between comments sent on an idle stream, so proxies keep it open
+KEEPALIVE_SECONDS = 15
+
+
+class LocalBroker:
+    """In-process fan-out to per-subscriber asyncio queues"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def publish(self, user_id, message):
+        with self.lock:
+            targets = list(self.subscribers.get(user_id, ()))
+        for loop, queue in targets:
+            try:
+                loop.call_soon_threadsafe(_put, queue, message)
+            except RuntimeError:
+                # The subscriber's event loop has closed
+                pass
+
+    def subscribe(self, user_id):
+        return _LocalSubscription(self, user_id)
+
+
+class _LocalSubscription:
+    # A class rather than an @asynccontextmanager, so unsubscribing does not
+    # depend on the order generators are finalized in at loop shutdown
+
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+
+    async def __aenter__(self):
+        self.target = (asyncio.get_running_loop(), asyncio.Queue(QUEUE_SIZE))
+        with self.broker.lock:
+            self.broker.subscribers.setdefault(self.user_id, set()).add(self.target)
+        return self.target[1]
+
+    async def __aexit__(self, *exc_info):
+        with self.broker.lock:
+            targets = self.broker.subscribers.get(self.user_id)
+            targets.discard(self.target)
+            if not targets:
+                del self.broker.subscribers[self.user_id]
+
+
+def _put(queue, message):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+@functools.lru_cache
+def _load(path):
+    return import_string(path)()
+
+
+def get_broker():
+    path = getattr(settings, 'PUSH_BROKER', 'my_app.push.LocalBroker')
+    return _load(path) if path else None
+
+
+def entry_message(entry):
+    """The ``transaction`` event for a COMPLETED ledger entry"""
+    return {
+        'event': 'transaction',
+        'data': {
+            'transaction_id': str(entry.transaction_id),
+            'status': 'COMPLETED',
+            'direction': entry.direction,
+            'amount': str(entry.amount),
+            # Empty for a payment into a balance bucket, until it is folded
+            'balance': None if entry.balance_after is None else str(entry.balance_after),
+        },
+    }
+
+
+def failed_messages(txn):
+    """(account id, message) for both parties of a queued transfer that failed"""
+    return [
+        (account_id, {
+            'event': 'transaction',
+            'data': {
+                'transaction_id': str(txn.pk),
+                'status': 'FAILED',
+                'direction': direction,
+                'amount': str(txn.amount),
+                # Unchanged
+                'balance': None,
+            },
+        })
+        for account_id, direction in ((txn.sender_id, 'DEBIT'), (txn.receiver_id, 'CREDIT'))
+    ]
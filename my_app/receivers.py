@@ -0,0 +1,160 @@
+# my_app/receivers.py
+"""
+Resolving a transfer's receiver from a phone number.
+
+Kenyan numbers are accepted in their common spellings (0712 345 678,
+254712345678, +254712345678) and normalized to +254...; other numbers are
+used as given, and anything that cannot be a phone number fails without a
+query. Only active accounts resolve.
+
+Resolved receivers are kept in a bounded in-process LRU cache, so paying a
+hot receiver such as a merchant costs no query. Entries are dropped when
+the account is saved (registration, deactivation, phone number change) or
+deleted in this process, and otherwise expire after ``RECEIVER_CACHE_TTL``
+seconds, which bounds how long other processes' changes take to show. The
+ledger checks the receiver is still active while it holds the row lock (or,
+for accounts with balance buckets, in the statement that credits a bucket),
+so a stale entry can delay a "not found" but never pay a deactivated account.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import User
+
+SEPARATORS = re.compile(r'[\s\-().]')
+KENYAN_PHONE = re.compile(r'^(?:\+?254|0)?([17]\d{8})$')
+# As User.phone_regex
+PHONE = re.compile(r'^\+?1?\d{9,15}$')
+
+
+def normalize_phone(value):
+    """'0712 345 678' -> '+254712345678'; None if ``value`` cannot be a phone number"""
+    value = SEPARATORS.sub('', value)
+    match = KENYAN_PHONE.match(value)
+    if match:
+        return f'+254{match[1]}'
+    return value if PHONE.match(value) else None
+
+
+def phone_variants(phone):
+    """Spellings a normalized number may be stored under by older registrations"""
+    if phone.startswith('+254'):
+        return [phone, phone[1:], '0' + phone[4:]]
+    return [phone]
+
+
+class ReceiverCache:
+    """Thread-safe LRU of normalized phone -> (user id, stored phone number, balance buckets)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.phones_by_user = {}
+
+    def get(self, phone):
+        with self.lock:
+            entry = self.entries.get(phone)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(phone)
+                return None
+            self.entries.move_to_end(phone)
+            return entry[1]
+
+    def set(self, phone, value):
+        expires = time.monotonic() + getattr(settings, 'RECEIVER_CACHE_TTL', 300)
+        with self.lock:
+            self._remove(phone)
+            self.entries[phone] = (expires, value)
+            self.phones_by_user.setdefault(value[0], set()).add(phone)
+            while len(self.entries) > getattr(settings, 'RECEIVER_CACHE_SIZE', 10000):
+                self._remove(next(iter(self.entries)))
+
+    def forget_user(self, user_id):
+        with self.lock:
+            for phone in self.phones_by_user.pop(user_id, ()):
+                self.entries.pop(phone, None)
+
+    def forget_phone(self, phone):
+        with self.lock:
+            self._remove(phone)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.phones_by_user.clear()
+
+    def _remove(self, phone):
+        entry = self.entries.pop(phone, None)
+        if entry is not None:
+            phones = self.phones_by_user.get(entry[1][0])
+            if phones is not None:
+                phones.discard(phone)
+                if not phones:
+                    del self.phones_by_user[entry[1][0]]
+
+
+cache = ReceiverCache()
+
+
+def receiver_instance(user_id, phone_number, balance_buckets):
+    """A User with only ``id``, ``phone_number`` and ``balance_buckets`` loaded"""
+    return User.from_db(None, ['id', 'phone_number', 'balance_buckets'], [user_id, phone_number, balance_buckets])
+
+
+def lookup(phones):
+    """{normalized phone: (user id, stored phone, balance buckets)} of active accounts, in one query"""
+    variants = {variant: phone for phone in phones for variant in phone_variants(phone)}
+    found = {}
+    rows = User.objects.filter(phone_number__in=variants, is_active=True).values_list('pk', 'phone_number', 'balance_buckets')
+    for row in rows:
+        phone = variants[row[1]]
+        # Prefer the normalized spelling if a number is stored twice
+        if phone not in found or row[1] == phone:
+            found[phone] = row
+    for phone, row in found.items():
+        cache.set(phone, row)
+    return found
+
+
+def resolve(phone):
+    """The active account ``phone`` belongs to, or None"""
+    normalized = normalize_phone(phone)
+    if normalized is None:
+        return None
+    row = cache.get(normalized) or lookup([normalized]).get(normalized)
+    return receiver_instance(*row) if row else None
+
+
+def resolve_many(phones):
+    """{phone as given: user id} for the given phones that belong to active accounts"""
+    normalized = {phone: normalize_phone(phone) for phone in phones}
+    rows = {}
+    for phone in set(normalized.values()) - {None}:
+        row = cache.get(phone)
+        if row:
+            rows[phone] = row
+    missing = set(normalized.values()) - {None} - set(rows)
+    if missing:
+        rows.update(lookup(missing))
+    return {phone: rows[number][0] for phone, number in normalized.items() if number in rows}
+
+
+@receiver(post_save, sender=User)
+def forget_saved_user(sender, instance, **kwargs):
+    cache.forget_user(instance.pk)
+    normalized = normalize_phone(instance.phone_number or '')
+    if normalized:
+        # A new account may take over the number of a deleted one
+        cache.forget_phone(normalized)
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user(sender, instance, **kwargs):
+    cache.forget_user(instance.pk)
@@ -0,0 +1,134 @@
+# my_app/reconciliation.py
+"""
+Daily closing-balance snapshots and incremental balance reconciliation.
+
+An account's closing balance for a day is its closing balance from the
+previous snapshot plus the net of its COMPLETED ledger entries since then,
+so each run only reads the ledger entries written since the last snapshot
+(a range scan on the (account, created_at) index). The current
+``User.balance`` is then checked against that closing balance plus the
+entries written after the day ended.
+
+Entries count from when they get their ``balance_after``, which is when
+they reach ``User.balance``, but are dated by their transaction. Two kinds
+get it later than that date: payments into balance buckets, when the
+buckets are folded, and queued transfers, when a worker applies them.
+Either could land after the snapshot of their day was taken, and then
+count in neither that snapshot nor the entries after it. So before
+snapshotting a day, ``settle`` folds every account's buckets and applies
+the transfers queued before the day ended.
+
+Work is split into ranges of account ids which can be reconciled
+independently, e.g. one per process (see the ``reconcile_balances``
+command). Accounts whose balance was set outside the ledger report that
+amount as drift.
+"""
+import uuid
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from time import sleep
+
+from django.db.models import Case, F, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from . import ledger
+from .models import User, LedgerEntry, BalanceSnapshot, PendingTransfer
+
+CHUNK_SIZE = 2000
+ZERO = Decimal('0.00')
+
+
+def account_ranges(count):
+    """Split the UUID key space into ``count`` (start, end) ranges; end is exclusive, None is open"""
+    step = (1 << 128) // count
+    bounds = [uuid.UUID(int=index * step) for index in range(count)] + [None]
+    return list(zip(bounds, bounds[1:]))
+
+
+def in_range(queryset, field, start, end):
+    queryset = queryset.filter(**{f'{field}__gte': start})
+    if end is not None:
+        queryset = queryset.filter(**{f'{field}__lt': end})
+    return queryset
+
+
+def end_of_day(day):
+    return timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def settle(day, poll_interval=0.1):
+    """
+    Give every entry dated up to the end of ``day`` its ``balance_after``:
+    fold balance buckets and apply the transfers queued before the day
+    ended, alongside any ``process_transfers`` workers.
+    """
+    ledger.compact_buckets()
+    queued = PendingTransfer.objects.filter(transaction__created_at__lt=end_of_day(day))
+    while queued.exists():
+        if ledger.apply_pending_transfers() == (0, 0):
+            # Everything left is claimed by a worker; wait for it to commit
+            sleep(poll_interval)
+
+
+def last_snapshot_day(before):
+    """The most recent snapshot day before ``before``, or None on the first run"""
+    return BalanceSnapshot.objects.filter(day__lt=before).aggregate(day=Max('day'))['day']
+
+
+def net_change():
+    """Signed sum of ledger entry amounts: credits add, debits subtract"""
+    return Sum(Case(When(direction='DEBIT', then=-F('amount')), default=F('amount')))
+
+
+def reconcile_range(day, since, start, end, chunk_size=CHUNK_SIZE):
+    """
+    Snapshot the closing balance on ``day`` of every account in the id range
+    that has any history, starting from the snapshots taken on ``since``
+    (None to start from scratch), and check current balances.
+
+    Returns ``{'accounts', 'snapshots', 'drift'}`` where ``drift`` is a list
+    of ``(phone_number, expected, actual)``.
+    """
+    completed = LedgerEntry.objects.filter(balance_after__isnull=False)
+    closing = {}
+    if since is not None:
+        snapshots = in_range(BalanceSnapshot.objects.filter(day=since), 'account_id', start, end)
+        for account_id, balance in snapshots.values_list('account_id', 'closing_balance').iterator(chunk_size=chunk_size):
+            closing[account_id] = balance
+
+    day_end = end_of_day(day)
+    window = in_range(completed.filter(created_at__lt=day_end), 'account_id', start, end)
+    if since is not None:
+        window = window.filter(created_at__gte=end_of_day(since))
+    changes = window.values('account_id').order_by().annotate(net=net_change()).values_list('account_id', 'net')
+    for account_id, net in changes.iterator(chunk_size=chunk_size):
+        closing[account_id] = closing.get(account_id, ZERO) + net
+
+    BalanceSnapshot.objects.bulk_create(
+        [BalanceSnapshot(account_id=account_id, day=day, closing_balance=balance)
+         for account_id, balance in closing.items()],
+        batch_size=chunk_size,
+        update_conflicts=True,
+        unique_fields=['account', 'day'],
+        update_fields=['closing_balance'],
+    )
+
+    # Balance and later entries come from one statement, so they are
+    # consistent with each other even while transfers keep committing
+    later = completed.filter(account=OuterRef('pk'), created_at__gte=day_end).values('account').order_by().annotate(
+        net=net_change()
+    ).values('net')
+    accounts = in_range(User.objects.all(), 'pk', start, end).annotate(
+        later=Coalesce(Subquery(later), Value(ZERO)),
+        current=F('balance')
+    ).values_list('pk', 'phone_number', 'current', 'later')
+
+    count = 0
+    drift = []
+    for pk, phone_number, balance, later_net in accounts.iterator(chunk_size=chunk_size):
+        count += 1
+        expected = closing.get(pk, ZERO) + later_net
+        if expected != balance:
+            drift.append((phone_number, expected, balance))
+
+    return {'accounts': count, 'snapshots': len(closing), 'drift': drift}
@@ -0,0 +1,69 @@
+# my_app/routers.py
+"""
+Primary/replica database routing.
+
+Writes, and reads by default, go to the primary (``default``). Read-only
+views opt in to replica reads for a request with ``replica_reads()`` (or
+the ``use_replica`` context variable directly); reads made inside go to one
+of ``DATABASE_REPLICAS``. A user whose request just wrote is pinned to the
+primary for ``REPLICA_PIN_SECONDS`` so that they read their own writes,
+e.g. the ``new_balance`` they were just shown, despite replication lag.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    token = use_replica.set(enabled)
+    try:
+        yield
+    finally:
+        use_replica.reset(token)
+
+
+def get_cache():
+    return caches[getattr(settings, 'REPLICA_PIN_CACHE_ALIAS', 'default')]
+
+
+def pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    get_cache().set(pin_key(user_id), True, getattr(settings, 'REPLICA_PIN_SECONDS', 10))
+
+
+def is_pinned(user_id):
+    return bool(get_cache().get(pin_key(user_id)))
+
+
+async def ais_pinned(user_id):
+    return bool(await get_cache().aget(pin_key(user_id)))
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if replicas and use_replica.get():
+            return random.choice(replicas)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Also for instances that were read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
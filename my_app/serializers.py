@@ -1,9 +1,26 @@
 # accounts/serializers.py
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from .models import User, Transaction
+from django.db.models import F
+from .models import User, Transaction, CallbackEndpoint
+from .authentication import ensure_login_allowed, record_failed_login, reset_failed_logins
+from . import callbacks, metrics, receivers
 from decimal import Decimal
 
+
+class TimedSerializerMixin:
+    """Count validation and representation time in the request's metrics"""
+
+    def is_valid(self, *args, **kwargs):
+        with metrics.track('serializer_time'):
+            return super().is_valid(*args, **kwargs)
+
+    @property
+    def data(self):
+        with metrics.track('serializer_time'):
+            return super().data
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -40,16 +57,19 @@ class LoginSerializer(serializers.Serializer):
     pin = serializers.CharField(write_only=True)
 
     def validate(self, data):
+        ensure_login_allowed(data['phone_number'])
         user = authenticate(username=data['phone_number'], password=data['pin'])
         if not user:
+            record_failed_login(data['phone_number'])
             raise serializers.ValidationError("Invalid phone number or PIN")
+        reset_failed_logins(data['phone_number'])
         if not user.is_active:
             raise serializers.ValidationError("Account is inactive")
         data['user'] = user
         return data
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     sender_phone = serializers.CharField(source='sender.phone_number', read_only=True)
     receiver_phone = serializers.CharField(source='receiver.phone_number', read_only=True)
 
@@ -60,7 +80,106 @@ class TransactionSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'transaction_code', 'status', 'created_at']
 
 
-class SendMoneySerializer(serializers.Serializer):
+class TransactionValuesSerializer:
+    """
+    Read-only fast path for transaction lists.
+
+    Works on ``.values()`` rows instead of model instances and formats them
+    with a fixed set of field instances, so there is no per-row model
+    construction or ModelSerializer field introspection. Output matches
+    ``TransactionSerializer``.
+    """
+    fields = ['id', 'transaction_code', 'sender_phone', 'receiver_phone',
+              'amount', 'transaction_type', 'status', 'description', 'created_at']
+    lookups = {
+        'sender_phone': F('sender__phone_number'),
+        'receiver_phone': F('receiver__phone_number'),
+    }
+    amount_field = serializers.DecimalField(max_digits=12, decimal_places=2)
+    created_at_field = serializers.DateTimeField()
+
+    @classmethod
+    def values(cls, queryset, *extra):
+        """Turn a Transaction queryset into the rows this serializer expects"""
+        plain = [field for field in cls.fields if field not in cls.lookups]
+        return queryset.values(*plain, *extra, **cls.lookups)
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @property
+    def data(self):
+        amount = self.amount_field.to_representation
+        created_at = self.created_at_field.to_representation
+        data = []
+        for row in self.rows:
+            item = {
+                'id': str(row['id']),
+                'transaction_code': row['transaction_code'],
+                'sender_phone': row['sender_phone'],
+                'receiver_phone': row['receiver_phone'],
+                'amount': amount(row['amount']),
+                'transaction_type': row['transaction_type'],
+                'status': row['status'],
+                'description': row['description'],
+                'created_at': created_at(row['created_at']),
+            }
+            # TransactionSerializer leaves out the phone of a missing party
+            if item['sender_phone'] is None:
+                del item['sender_phone']
+            if item['receiver_phone'] is None:
+                del item['receiver_phone']
+            data.append(item)
+        return data
+
+
+class DateRangeSerializer(serializers.Serializer):
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if data.get('start_date') and data.get('end_date') and data['start_date'] > data['end_date']:
+            raise serializers.ValidationError({"end_date": "End date must not be before start date"})
+        return data
+
+
+class TransactionFilterSerializer(DateRangeSerializer):
+    transaction_type = serializers.ChoiceField(choices=Transaction.TRANSACTION_TYPES, required=False)
+    status = serializers.ChoiceField(choices=Transaction.STATUS_CHOICES, required=False)
+    # Serialize with TransactionValuesSerializer instead of TransactionSerializer
+    fast = serializers.BooleanField(required=False, default=False)
+
+
+class StatementSerializer(DateRangeSerializer):
+    OUTPUTS = (
+        ('csv', 'CSV'),
+        ('jsonl', 'JSON Lines'),
+    )
+
+    # Not "format", which DRF reserves for renderer selection
+    output = serializers.ChoiceField(choices=OUTPUTS, required=False, default='csv')
+
+
+class SendMoneySerializer(TimedSerializerMixin, serializers.Serializer):
+    receiver_phone = serializers.CharField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    description = serializers.CharField(required=False, allow_blank=True)
+
+    def validate_amount(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Amount must be greater than zero")
+        return value
+
+    def validate(self, data):
+        # Resolved once here and handed to the view as data['receiver']
+        receiver = receivers.resolve(data['receiver_phone'])
+        if receiver is None:
+            raise serializers.ValidationError({'receiver_phone': ["Receiver phone number not found"]})
+        data['receiver'] = receiver
+        return data
+
+
+class BulkSendItemSerializer(serializers.Serializer):
     receiver_phone = serializers.CharField()
     amount = serializers.DecimalField(max_digits=12, decimal_places=2)
     description = serializers.CharField(required=False, allow_blank=True)
@@ -70,15 +189,21 @@ class SendMoneySerializer(serializers.Serializer):
             raise serializers.ValidationError("Amount must be greater than zero")
         return value
 
-    def validate_receiver_phone(self, value):
-        try:
-            User.objects.get(phone_number=value)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("Receiver phone number not found")
+
+class BulkSendSerializer(TimedSerializerMixin, serializers.Serializer):
+    MAX_TRANSFERS = 50000
+
+    transfers = BulkSendItemSerializer(many=True, allow_empty=False)
+
+    def validate_transfers(self, value):
+        if len(value) > self.MAX_TRANSFERS:
+            raise serializers.ValidationError(
+                f"A maximum of {self.MAX_TRANSFERS:,} transfers is allowed per request"
+            )
         return value
 
 
-class DepositSerializer(serializers.Serializer):
+class DepositSerializer(TimedSerializerMixin, serializers.Serializer):
     amount = serializers.DecimalField(max_digits=12, decimal_places=2)
     description = serializers.CharField(required=False, allow_blank=True)
 
@@ -90,7 +215,7 @@ class DepositSerializer(serializers.Serializer):
         return value
 
 
-class WithdrawSerializer(serializers.Serializer):
+class WithdrawSerializer(TimedSerializerMixin, serializers.Serializer):
     amount = serializers.DecimalField(max_digits=12, decimal_places=2)
     description = serializers.CharField(required=False, allow_blank=True)
 
@@ -103,4 +228,26 @@ class WithdrawSerializer(serializers.Serializer):
 class BalanceSerializer(serializers.Serializer):
     phone_number = serializers.CharField(read_only=True)
     balance = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
-    full_name = serializers.CharField(read_only=True)
\ No newline at end of file
+    full_name = serializers.CharField(read_only=True)
+
+
+class CallbackEndpointSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CallbackEndpoint
+        fields = ['confirmation_url', 'result_url', 'secret', 'updated_at']
+        read_only_fields = ['secret', 'updated_at']
+
+    def validate_url(self, value):
+        if value:
+            try:
+                callbacks.check_url(value)
+            except (ValueError, callbacks.BlockedAddress) as exc:
+                raise serializers.ValidationError(str(exc))
+        return value
+
+    validate_confirmation_url = validate_result_url = validate_url
+
+    def validate(self, data):
+        if not (data.get('confirmation_url') or data.get('result_url')):
+            raise serializers.ValidationError("Set confirmation_url, result_url or both")
+        return data
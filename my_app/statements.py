@@ -0,0 +1,101 @@
+# my_app/statements.py
+"""
+Account statements streamed as CSV or JSON Lines.
+
+Rows come from the account's ledger entries, oldest first, through a
+server-side cursor (``iterator``), and are encoded in blocks as the
+response is sent, so memory use does not depend on the statement length.
+The running balance is the ``balance_after`` the ledger recorded with each
+entry; it is empty for transactions that are not COMPLETED, and for the
+latest payments into an account with balance buckets until the buckets
+are folded (at most a ``compact_balances`` interval later). Archived months
+(see partitions.py) are not included, so a statement starts at the oldest
+retained month with the balance carried over from before.
+"""
+import csv
+import io
+import json
+
+from django.db.models import Case, F, When
+from django.utils import timezone
+from .models import LedgerEntry
+
+CHUNK_SIZE = 2000
+# Rows encoded per block written to the response
+BLOCK_SIZE = 500
+
+COLUMNS = (
+    'date', 'transaction_code', 'transaction_type', 'description',
+    'counterparty', 'debit', 'credit', 'balance', 'status',
+)
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def statement_entries(user):
+    """The user's ledger entries in statement order, as tuples in COLUMNS order"""
+    return LedgerEntry.objects.filter(account=user).annotate(
+        counterparty=Case(
+            When(direction='DEBIT', then=F('transaction__receiver__phone_number')),
+            default=F('transaction__sender__phone_number'),
+        ),
+    ).order_by('created_at', 'transaction_id').values_list(
+        'created_at', 'transaction__transaction_code', 'transaction__transaction_type',
+        'transaction__description', 'counterparty', 'direction', 'amount',
+        'balance_after', 'transaction__status',
+    )
+
+
+def statement_rows(entries, chunk_size=CHUNK_SIZE):
+    for created_at, code, txn_type, description, counterparty, direction, amount, balance, status in (
+            entries.iterator(chunk_size=chunk_size)):
+        yield (
+            timezone.localtime(created_at).isoformat(),
+            code,
+            txn_type,
+            description,
+            counterparty or '',
+            str(amount) if direction == 'DEBIT' else '',
+            str(amount) if direction == 'CREDIT' else '',
+            '' if balance is None else str(balance),
+            status,
+        )
+
+
+def blocks(rows, size=BLOCK_SIZE):
+    block = []
+    for row in rows:
+        block.append(row)
+        if len(block) == size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for block in blocks(rows):
+        writer.writerows(block)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty statement
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_jsonl(rows):
+    for block in blocks(rows):
+        yield ''.join(json.dumps(dict(zip(COLUMNS, row))) + '\n' for row in block)
+
+
+STREAMERS = {
+    'csv': stream_csv,
+    'jsonl': stream_jsonl,
+}
@@ -1,3 +1,1756 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import hmac
+import json
+import os
+import socket
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction as db_transaction
+from django.db.models import NOT_PROVIDED, Sum
+from django.db.models.fields import AutoFieldMixin
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+
+from . import (
+    callbacks, datagen, ledger, metrics, partitions, push, receivers, routers, statements, throttling, transfer_queue
+)
+from .authentication import forget_user_tokens
+from .codes import NodeLease, TransactionCodeGenerator, check_node_ids, decode
+from .models import (
+    User, Transaction, LedgerEntry, UserStats, DailyUserStats, BalanceSnapshot, PendingTransfer, BalanceBucket,
+    CallbackEndpoint, TransactionEvent
+)
+
+
+class RecordingCursor:
+    """
+    Stands in for a PostgreSQL cursor: records statements and answers each
+    one from the next result listed for its first words
+    """
+
+    def __init__(self, results):
+        self.results = results
+        self.statements = []
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+        for prefix, answers in self.results.items():
+            if sql.startswith(prefix):
+                self.rows = list(answers.pop(0))
+                return
+        self.rows = []
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+    def fetchall(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234',
+            balance=Decimal('100.00')
+        )
+        self.bob = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mary Wanjiku', pin='2345',
+            balance=Decimal('50.00')
+        )
+
+    def test_transfer_moves_balance(self):
+        txn = ledger.transfer(self.alice, self.bob, Decimal('30.00'), 'Lunch')
+
+        self.assertEqual(txn.transaction_type, 'SEND')
+        self.assertEqual(self.alice.balance, Decimal('70.00'))
+        self.assertEqual(self.bob.balance, Decimal('80.00'))
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual(self.alice.balance, Decimal('70.00'))
+        self.assertEqual(self.bob.balance, Decimal('80.00'))
+
+        entries = {entry.account_id: entry for entry in txn.ledger_entries.all()}
+        self.assertEqual(entries[self.alice.pk].direction, 'DEBIT')
+        self.assertEqual(entries[self.alice.pk].balance_after, Decimal('70.00'))
+        self.assertEqual(entries[self.bob.pk].direction, 'CREDIT')
+        self.assertEqual(entries[self.bob.pk].balance_after, Decimal('80.00'))
+
+    def test_stats_follow_ledger_writes(self):
+        ledger.transfer(self.alice, self.bob, Decimal('30.00'))
+        ledger.deposit(self.alice, Decimal('20.00'))
+        ledger.withdraw(self.bob, Decimal('5.00'))
+        ledger.bulk_transfer(self.alice, [
+            {'receiver_phone': self.bob.phone_number, 'amount': Decimal('1.00')},
+            {'receiver_phone': self.bob.phone_number, 'amount': Decimal('2.00')},
+        ])
+
+        alice = UserStats.objects.get(user=self.alice)
+        self.assertEqual((alice.total_sent, alice.sent_count), (Decimal('33.00'), 3))
+        self.assertEqual((alice.total_received, alice.received_count), (Decimal('20.00'), 1))
+        bob = DailyUserStats.objects.get(user=self.bob)
+        self.assertEqual((bob.total_sent, bob.sent_count), (Decimal('5.00'), 1))
+        self.assertEqual((bob.total_received, bob.received_count), (Decimal('33.00'), 3))
+
+    def test_withdraw_rejects_overdraft(self):
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.withdraw(self.bob, Decimal('50.01'))
+
+        self.bob.refresh_from_db()
+        self.assertEqual(self.bob.balance, Decimal('50.00'))
+        self.assertFalse(Transaction.objects.exists())
+
+
+class LedgerConcurrencyTests(TransactionTestCase):
+    workers = 8
+    transfers = 200
+
+    def test_parallel_transfers_conserve_money(self):
+        alice = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234',
+            balance=Decimal('500.00')
+        )
+        bob = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mary Wanjiku', pin='2345',
+            balance=Decimal('500.00')
+        )
+        total = alice.balance + bob.balance
+
+        def send(i):
+            # Alternate direction so both lock orders are exercised
+            sender, receiver = (alice, bob) if i % 2 else (bob, alice)
+            sender = User(pk=sender.pk, phone_number=sender.phone_number)
+            receiver = User(pk=receiver.pk, phone_number=receiver.phone_number)
+            try:
+                ledger.transfer(sender, receiver, Decimal('7.00'))
+                return True
+            except ledger.InsufficientFunds:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(send, range(self.transfers)))
+
+        alice.refresh_from_db()
+        bob.refresh_from_db()
+        self.assertEqual(alice.balance + bob.balance, total)
+        self.assertGreaterEqual(alice.balance, 0)
+        self.assertGreaterEqual(bob.balance, 0)
+        self.assertEqual(Transaction.objects.count(), sum(results))
+
+        sent_by_alice = Transaction.objects.filter(sender=alice).count()
+        sent_by_bob = Transaction.objects.filter(sender=bob).count()
+        expected = Decimal('500.00') + Decimal('7.00') * (sent_by_bob - sent_by_alice)
+        self.assertEqual(alice.balance, expected)
+
+    def test_concurrent_requests_with_same_idempotency_key_apply_once(self):
+        user = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+
+        def deposit(i):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                return client.post(
+                    '/api/transactions/deposit/', {'amount': '100.00'}, format='json',
+                    HTTP_IDEMPOTENCY_KEY='same-key'
+                )
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            responses = list(pool.map(deposit, range(self.workers)))
+
+        self.assertEqual({response.status_code for response in responses}, {201})
+        self.assertEqual(len({response.data['transaction']['id'] for response in responses}), 1)
+        self.assertEqual(Transaction.objects.count(), 1)
+        user.refresh_from_db()
+        self.assertEqual(user.balance, Decimal('100.00'))
+
+
+    def test_concurrent_queue_workers_apply_each_transfer_once(self):
+        alice = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234',
+            balance=Decimal('500.00')
+        )
+        bob = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mary Wanjiku', pin='2345',
+            balance=Decimal('500.00')
+        )
+        for i in range(self.transfers):
+            sender, receiver = (alice, bob) if i % 2 else (bob, alice)
+            ledger.enqueue_transfer(sender, receiver, Decimal('7.00'))
+
+        def drain(i):
+            applied = 0
+            try:
+                while True:
+                    done = sum(ledger.apply_pending_transfers(batch_size=10))
+                    if not done:
+                        return applied
+                    applied += done
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            applied = sum(pool.map(drain, range(self.workers)))
+
+        self.assertEqual(applied, self.transfers)
+        self.assertFalse(PendingTransfer.objects.exists())
+        self.assertFalse(Transaction.objects.filter(status='PENDING').exists())
+        alice.refresh_from_db()
+        bob.refresh_from_db()
+        self.assertEqual(alice.balance + bob.balance, Decimal('1000.00'))
+        for account in (alice, bob):
+            credits = LedgerEntry.objects.filter(account=account, direction='CREDIT', balance_after__isnull=False)
+            debits = LedgerEntry.objects.filter(account=account, direction='DEBIT', balance_after__isnull=False)
+            total = lambda entries: entries.aggregate(total=Sum('amount'))['total'] or 0
+            self.assertEqual(account.balance, Decimal('500.00') + total(credits) - total(debits))
+
+    def test_process_transfers_command(self):
+        alice = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234',
+            balance=Decimal('15.00')
+        )
+        bob = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mary Wanjiku', pin='2345'
+        )
+        for i in range(3):
+            ledger.enqueue_transfer(alice, bob, Decimal('7.00'))
+
+        out = StringIO()
+        call_command('process_transfers', workers=1, batch_size=2, until_empty=True, poll_interval=0, stdout=out)
+
+        self.assertIn('Applied 3 transfer(s)', out.getvalue())
+        self.assertIn('2 completed, 1 failed', out.getvalue())
+        bob.refresh_from_db()
+        self.assertEqual(bob.balance, Decimal('14.00'))
+
+
+@override_settings(QUEUED_TRANSFERS=True)
+class QueuedTransferTests(APITestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234',
+            balance=Decimal('100.00')
+        )
+        self.receiver = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mary Wanjiku', pin='2345'
+        )
+        self.client.force_authenticate(self.sender)
+
+    def send(self, amount, **headers):
+        return self.client.post('/api/transactions/send_money/', {
+            'receiver_phone': self.receiver.phone_number, 'amount': amount
+        }, format='json', **headers)
+
+    def test_send_money_queues_a_pending_transaction(self):
+        response = self.send('30.00')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['transaction']['status'], 'PENDING')
+        self.assertNotIn('new_balance', response.data)
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('100.00'))
+        self.assertEqual(PendingTransfer.objects.get().transaction_id, uuid.UUID(response.data['transaction']['id']))
+
+        history = self.client.get('/api/transactions/history/')
+        self.assertEqual([txn['status'] for txn in history.data], ['PENDING'])
+
+    def test_apply_in_queue_order_and_fail_what_cannot_be_covered(self):
+        ids = [self.send(amount).data['transaction']['id'] for amount in ('60.00', '60.00', '40.00')]
+
+        self.assertEqual(ledger.apply_pending_transfers(), (2, 1))
+
+        statuses = dict(Transaction.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[uuid.UUID(txn_id)] for txn_id in ids], ['COMPLETED', 'FAILED', 'COMPLETED'])
+        self.sender.refresh_from_db()
+        self.receiver.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('0.00'))
+        self.assertEqual(self.receiver.balance, Decimal('100.00'))
+        self.assertEqual(
+            list(LedgerEntry.objects.filter(account=self.receiver, balance_after__isnull=False)
+                 .order_by('balance_after').values_list('balance_after', flat=True)),
+            [Decimal('60.00'), Decimal('100.00')]
+        )
+        stats = UserStats.objects.get(user=self.sender)
+        self.assertEqual((stats.total_sent, stats.sent_count), (Decimal('100.00'), 2))
+        self.assertFalse(PendingTransfer.objects.exists())
+        self.assertEqual(ledger.apply_pending_transfers(), (0, 0))
+
+    def test_batch_size_limits_a_claim(self):
+        for _ in range(3):
+            self.send('10.00')
+
+        self.assertEqual(ledger.apply_pending_transfers(batch_size=2), (2, 0))
+        self.assertEqual(PendingTransfer.objects.count(), 1)
+
+    def test_transfer_to_account_deactivated_while_queued_fails(self):
+        self.send('10.00')
+        self.receiver.is_active = False
+        self.receiver.save()
+
+        self.assertEqual(ledger.apply_pending_transfers(), (0, 1))
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('100.00'))
+
+    def test_account_deactivated_while_queued_as_sender_and_receiver(self):
+        third = User.objects.create_user(
+            phone_number='+254734567890', full_name='Peter Otieno', pin='3456'
+        )
+        to_receiver = ledger.enqueue_transfer(self.sender, self.receiver, Decimal('10.00'))
+        ledger.deposit(self.receiver, Decimal('50.00'))
+        from_receiver = ledger.enqueue_transfer(self.receiver, self.sender, Decimal('20.00'))
+        unrelated = ledger.enqueue_transfer(self.sender, third, Decimal('5.00'))
+        self.receiver.is_active = False
+        self.receiver.save()
+
+        self.assertEqual(ledger.apply_pending_transfers(), (1, 2))
+        statuses = dict(Transaction.objects.values_list('id', 'status'))
+        self.assertEqual(
+            [statuses[txn.pk] for txn in (to_receiver, from_receiver, unrelated)],
+            ['FAILED', 'FAILED', 'COMPLETED']
+        )
+        self.assertEqual(
+            {user.phone_number: user.balance for user in User.objects.all()},
+            {'+254712345678': Decimal('95.00'), '+254723456789': Decimal('50.00'), '+254734567890': Decimal('5.00')}
+        )
+        self.assertFalse(PendingTransfer.objects.exists())
+
+    def test_worker_survives_a_failing_batch(self):
+        results = [RuntimeError('boom'), (2, 1), (0, 0)]
+        with mock.patch.object(ledger, 'apply_pending_transfers', side_effect=results), \
+                mock.patch.object(transfer_queue, 'close_old_connections'), \
+                mock.patch.object(transfer_queue.connections, 'close_all'), \
+                self.assertLogs('my_app.transfer_queue', 'ERROR'):
+            self.assertEqual(transfer_queue.work(poll_interval=0, until_empty=True), (2, 1))
+
+    def test_retry_with_idempotency_key_queues_once(self):
+        first = self.send('10.00', HTTP_IDEMPOTENCY_KEY='queued-key')
+        second = self.send('10.00', HTTP_IDEMPOTENCY_KEY='queued-key')
+
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(first.data['transaction']['id'], second.data['transaction']['id'])
+        self.assertEqual(PendingTransfer.objects.count(), 1)
+
+    def test_is_enabled_follows_setting(self):
+        self.assertTrue(transfer_queue.is_enabled())
+        with self.settings(QUEUED_TRANSFERS=False):
+            self.assertFalse(transfer_queue.is_enabled())
+
+
+class BalanceBucketTests(APITestCase):
+    def setUp(self):
+        receivers.cache.clear()
+        self.sender = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        # Through the ledger, so reconciliation finds no drift
+        ledger.deposit(self.sender, Decimal('1000.00'))
+        self.merchant = User.objects.create_user(
+            phone_number='+254723456789', full_name='KPLC Prepaid', pin='0000',
+            balance_buckets=4
+        )
+        ledger.compact_buckets()
+        self.client.force_authenticate(self.sender)
+
+    def pay(self, amount='10.00'):
+        return self.client.post('/api/transactions/send_money/', {
+            'receiver_phone': self.merchant.phone_number, 'amount': amount
+        }, format='json')
+
+    def test_payments_credit_buckets_not_the_account_row(self):
+        for _ in range(3):
+            self.assertEqual(self.pay().status_code, 201)
+
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, Decimal('0.00'))
+        self.assertEqual(BalanceBucket.objects.filter(user=self.merchant).count(), 4)
+        self.assertEqual(
+            BalanceBucket.objects.filter(user=self.merchant).aggregate(total=Sum('balance'))['total'],
+            Decimal('30.00')
+        )
+        self.assertEqual(ledger.current_balance(self.merchant.pk), Decimal('30.00'))
+        # Only known once folded
+        self.assertEqual(
+            list(LedgerEntry.objects.filter(account=self.merchant).values_list('balance_after', flat=True)),
+            [None, None, None]
+        )
+        self.assertEqual(UserStats.objects.get(user=self.sender).sent_count, 3)
+
+        self.client.force_authenticate(self.merchant)
+        self.assertEqual(self.client.get('/api/transactions/balance/').data['balance'], '30.00')
+
+    def test_compaction_folds_buckets_and_stats(self):
+        ledger.deposit(self.merchant, Decimal('5.00'))
+        self.pay('10.00')
+        self.pay('15.00')
+        # Made yesterday, but folded today
+        yesterday = timezone.now() - timedelta(days=1)
+        first = LedgerEntry.objects.filter(account=self.merchant, amount=Decimal('10.00'))
+        first.update(created_at=yesterday)
+        Transaction.objects.filter(pk=first.get().transaction_id).update(created_at=yesterday)
+
+        self.assertEqual(ledger.compact_buckets(), (1, Decimal('25.00')))
+
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, Decimal('30.00'))
+        self.assertEqual(ledger.current_balance(self.merchant.pk), Decimal('30.00'))
+        self.assertEqual(
+            list(LedgerEntry.objects.filter(account=self.merchant).order_by('created_at')
+                 .values_list('amount', 'balance_after')),
+            [(Decimal('10.00'), Decimal('15.00')), (Decimal('5.00'), Decimal('5.00')),
+             (Decimal('15.00'), Decimal('30.00'))]
+        )
+        stats = UserStats.objects.get(user=self.merchant)
+        self.assertEqual((stats.total_received, stats.received_count), (Decimal('30.00'), 3))
+        daily = DailyUserStats.objects.filter(user=self.merchant).order_by('day')
+        self.assertEqual(
+            [(day.day, day.total_received) for day in daily],
+            [(timezone.localdate(yesterday), Decimal('10.00')), (timezone.localdate(), Decimal('20.00'))]
+        )
+        self.assertEqual(ledger.compact_buckets(), (1, 0))
+
+        out = StringIO()
+        call_command('reconcile_balances', date=timezone.localdate(), workers=1, ranges=1, stdout=out)
+        self.assertIn('All balances match the ledger', out.getvalue())
+
+    def test_debits_fold_buckets_first(self):
+        self.pay('30.00')
+
+        ledger.withdraw(self.merchant, Decimal('25.00'))
+
+        self.assertEqual(self.merchant.balance, Decimal('5.00'))
+        self.assertEqual(ledger.current_balance(self.merchant.pk), Decimal('5.00'))
+        self.assertFalse(BalanceBucket.objects.filter(user=self.merchant, received_count__gt=0).exists())
+
+    def test_debits_fold_buckets_that_were_turned_off(self):
+        self.pay('30.00')
+        User.objects.filter(pk=self.merchant.pk).update(balance_buckets=0)
+        self.merchant.balance_buckets = 0
+
+        ledger.withdraw(self.merchant, Decimal('25.00'))
+
+        self.assertEqual(ledger.current_balance(self.merchant.pk), Decimal('5.00'))
+        self.assertEqual(
+            LedgerEntry.objects.get(account=self.merchant, direction='CREDIT').balance_after, Decimal('30.00')
+        )
+
+    def test_turning_buckets_off_folds_and_removes_them(self):
+        self.pay()
+        User.objects.filter(pk=self.merchant.pk).update(balance_buckets=0)
+
+        ledger.compact_buckets()
+
+        self.assertFalse(BalanceBucket.objects.filter(user=self.merchant).exists())
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, Decimal('10.00'))
+
+    def test_payment_without_bucket_rows_locks_the_account(self):
+        BalanceBucket.objects.filter(user=self.merchant).delete()
+
+        self.assertEqual(self.pay().status_code, 201)
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, Decimal('10.00'))
+
+    def test_deactivated_receiver_is_not_paid(self):
+        receiver = receivers.resolve(self.merchant.phone_number)
+        User.objects.filter(pk=self.merchant.pk).update(is_active=False)
+
+        with self.assertRaises(ledger.AccountNotFound):
+            ledger.transfer(self.sender, receiver, Decimal('10.00'))
+        self.assertEqual(ledger.current_balance(self.merchant.pk), Decimal('0.00'))
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('1000.00'))
+
+
+class BalanceBucketFoldTests(TransactionTestCase):
+    def test_payment_during_a_fold_waits_for_it(self):
+        receivers.cache.clear()
+        sender = User.objects.create_user(phone_number='+254712345678', full_name='James Kamau', pin='1234')
+        ledger.deposit(sender, Decimal('100.00'))
+        merchant = User.objects.create_user(
+            phone_number='+254723456789', full_name='KPLC Prepaid', pin='0000', balance_buckets=4
+        )
+        ledger.compact_buckets()
+
+        def pay(amount):
+            try:
+                ledger.transfer(User(pk=sender.pk), receivers.resolve(merchant.phone_number), amount)
+            finally:
+                connection.close()
+
+        credit_many = ledger._credit_many
+        during = threading.Thread(target=pay, args=(Decimal('20.00'),))
+
+        def fold_and_pay(credits):
+            # Folding bucket 0 while a payment goes to bucket 3, until then empty
+            credit_many(credits)
+            during.start()
+            during.join(0.5)
+
+        with mock.patch.object(ledger.random, 'randrange', side_effect=[0, 3]):
+            pay(Decimal('10.00'))
+            with mock.patch.object(ledger, '_credit_many', fold_and_pay):
+                ledger.compact_buckets()
+            during.join()
+        ledger.compact_buckets()
+
+        self.assertEqual(
+            list(LedgerEntry.objects.filter(account=merchant).order_by('created_at')
+                 .values_list('amount', 'balance_after')),
+            [(Decimal('10.00'), Decimal('10.00')), (Decimal('20.00'), Decimal('30.00'))]
+        )
+        stats = UserStats.objects.get(user=merchant)
+        self.assertEqual((stats.total_received, stats.received_count), (Decimal('30.00'), 2))
+
+
+class BulkSendTests(APITestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234',
+            balance=Decimal('100.00')
+        )
+        self.receivers = [
+            User.objects.create_user(
+                phone_number=phone, full_name='Receiver', pin='0000'
+            )
+            for phone in ('+254723456789', '+254734567890')
+        ]
+        self.client.force_authenticate(self.sender)
+
+    def test_bulk_send_reports_per_item_results(self):
+        response = self.client.post('/api/transactions/bulk_send/', {'transfers': [
+            {'receiver_phone': '+254723456789', 'amount': '40.00'},
+            {'receiver_phone': '+254700000000', 'amount': '10.00'},
+            {'receiver_phone': '0734 567 890', 'amount': '50.00', 'description': 'Salary'},
+            {'receiver_phone': '+254723456789', 'amount': '20.00'},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['completed'], 2)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['COMPLETED', 'FAILED', 'COMPLETED', 'FAILED']
+        )
+        self.assertEqual(response.data['results'][1]['error'], 'Receiver not found')
+        self.assertEqual(response.data['results'][2]['receiver_phone'], '0734 567 890')
+        self.assertEqual(response.data['results'][3]['error'], 'Insufficient balance')
+        self.assertEqual(response.data['new_balance'], Decimal('10.00'))
+
+        balances = dict(User.objects.values_list('phone_number', 'balance'))
+        self.assertEqual(balances['+254712345678'], Decimal('10.00'))
+        self.assertEqual(balances['+254723456789'], Decimal('40.00'))
+        self.assertEqual(balances['+254734567890'], Decimal('50.00'))
+        self.assertEqual(Transaction.objects.filter(sender=self.sender).count(), 2)
+
+
+class ReceiverResolutionTests(APITestCase):
+    def setUp(self):
+        receivers.cache.clear()
+        self.sender = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234',
+            balance=Decimal('100.00')
+        )
+        self.merchant = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mama Mboga', pin='0000'
+        )
+        self.client.force_authenticate(self.sender)
+
+    def send(self, phone, amount='10.00'):
+        return self.client.post('/api/transactions/send_money/', {
+            'receiver_phone': phone, 'amount': amount
+        }, format='json')
+
+    def test_normalize_phone(self):
+        for value in ('0723 456 789', '0723-456-789', '254723456789', '+254723456789', '723456789'):
+            self.assertEqual(receivers.normalize_phone(value), '+254723456789', value)
+        self.assertEqual(receivers.normalize_phone('0110000000'), '+254110000000')
+        self.assertEqual(receivers.normalize_phone('+14155550100'), '+14155550100')
+        self.assertIsNone(receivers.normalize_phone('not a phone'))
+
+    def test_receiver_resolved_once_then_from_cache(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.send('0723456789').status_code, 201)
+        with CaptureQueriesContext(connection) as second:
+            response = self.send('254723456789')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['transaction']['receiver_phone'], '+254723456789')
+        lookups = lambda queries: [query for query in queries.captured_queries if '"phone_number" IN' in query['sql']]
+        self.assertEqual(len(lookups(first)), 1)
+        self.assertEqual(lookups(second), [])
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, Decimal('20.00'))
+
+    def test_numbers_stored_in_other_spellings_resolve(self):
+        legacy = User.objects.create_user(phone_number='0734567890', full_name='Old Account', pin='0000')
+        self.assertEqual(self.send('+254734567890').status_code, 201)
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.balance, Decimal('10.00'))
+
+    def test_sending_to_yourself_in_another_spelling(self):
+        response = self.send('0712345678')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Cannot send money to yourself')
+
+    def test_deactivated_receiver_is_not_found(self):
+        self.assertEqual(self.send('+254723456789').status_code, 201)
+        self.merchant.is_active = False
+        self.merchant.save()
+
+        response = self.send('+254723456789')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['receiver_phone'], ['Receiver phone number not found'])
+
+    def test_stale_cache_entry_never_pays_deactivated_account(self):
+        self.assertEqual(self.send('+254723456789').status_code, 201)
+        # As if deactivated by another process: no signal reaches this cache
+        User.objects.filter(pk=self.merchant.pk).update(is_active=False)
+
+        response = self.send('+254723456789')
+        self.assertEqual(response.status_code, 404)
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, Decimal('10.00'))
+
+    @override_settings(RECEIVER_CACHE_SIZE=2)
+    def test_cache_is_bounded(self):
+        for index, phone in enumerate(('+254700000001', '+254700000002', '+254700000003')):
+            receivers.cache.set(phone, (index, phone))
+        self.assertIsNone(receivers.cache.get('+254700000001'))
+        self.assertEqual(receivers.cache.get('+254700000003'), (2, '+254700000003'))
+
+
+class HistoryPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        for i in range(45):
+            ledger.deposit(self.user, Decimal('10.00'), f'Deposit {i}')
+        # Force timestamp ties so the id tie-breaker is exercised
+        tied_at = LedgerEntry.objects.order_by('created_at').first().created_at
+        LedgerEntry.objects.filter(transaction__description__endswith='5').update(created_at=tied_at)
+        self.client.force_authenticate(self.user)
+
+    def test_list_walks_every_transaction_once(self):
+        seen = []
+        url = '/api/transactions/?page_size=10'
+        while url:
+            # One query per page: no COUNT and no per-row sender/receiver lookups
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(len(seen), 45)
+        self.assertEqual(len(set(seen)), 45)
+
+    def test_history_keeps_list_body_and_links_next_page(self):
+        response = self.client.get('/api/transactions/history/')
+
+        self.assertEqual(len(response.data), 20)
+        self.assertIn('rel="next"', response['Link'])
+
+    def test_history_filters(self):
+        response = self.client.get('/api/transactions/history/?transaction_type=SEND')
+        self.assertEqual(response.data, [])
+
+        response = self.client.get('/api/transactions/history/?status=BOGUS')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/transactions/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_fast_serializer_matches_default(self):
+        other = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mary Wanjiku', pin='2345'
+        )
+        ledger.transfer(self.user, other, Decimal('25.50'), 'Lunch')
+
+        default = self.client.get('/api/transactions/?page_size=30')
+        with self.assertNumQueries(1):
+            fast = self.client.get('/api/transactions/?page_size=30&fast=true')
+
+        self.assertEqual(fast.json()['results'], default.json()['results'])
+
+
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        self.client.force_authenticate(self.user)
+
+    def deposit(self, key, amount='100.00'):
+        return self.client.post(
+            '/api/transactions/deposit/', {'amount': amount}, format='json',
+            HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_original_response(self):
+        first = self.deposit('retry-1')
+        cache.clear()  # force the second lookup to fall back to the table
+        second = self.deposit('retry-1')
+        third = self.deposit('retry-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(third.json(), first.json())
+        self.assertEqual(third['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('100.00'))
+
+    def test_key_reuse_with_different_body_is_rejected(self):
+        self.deposit('retry-2')
+        response = self.deposit('retry-2', amount='5.00')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+
+class TransactionCodeTests(SimpleTestCase):
+    def test_codes_stay_unique_and_ordered_when_clock_stalls_or_rewinds(self):
+        now = [1767225600000 * 1_000_000]  # 2026-01-01 in ns
+        generator = TransactionCodeGenerator(node_id=7, clock=lambda: now[0])
+
+        codes = [generator.next_code() for _ in range(5000)]  # > one ms of sequence
+        now[0] -= 10_000 * 1_000_000  # clock jumps 10s back
+        codes += [generator.next_code() for _ in range(10)]
+
+        self.assertEqual(len(set(codes)), len(codes))
+        self.assertEqual(codes, sorted(codes))
+        self.assertTrue(all(len(code) == 12 and code.isalnum() and code.isupper() for code in codes))
+        timestamp, node_id, sequence = decode(codes[0])
+        self.assertEqual((timestamp, node_id, sequence), (1767225600000, 7, 0))
+
+    def test_nodes_never_collide(self):
+        clock = lambda: 1767225600000 * 1_000_000
+        first = TransactionCodeGenerator(node_id=1, clock=clock)
+        second = TransactionCodeGenerator(node_id=2, clock=clock)
+
+        codes = {first.next_code() for _ in range(3000)} | {second.next_code() for _ in range(3000)}
+        self.assertEqual(len(codes), 6000)
+
+    def test_leased_node_ids_are_exclusive_and_renewed(self):
+        shared = LocMemCache(self.id(), {})
+        now = [1767225600000 * 1_000_000]
+        first = TransactionCodeGenerator(clock=lambda: now[0], lease=NodeLease(shared, 60))
+        second = TransactionCodeGenerator(clock=lambda: now[0], lease=NodeLease(shared, 60))
+        first.next_code()
+        second.next_code()
+        self.assertNotEqual(first.node_id, second.node_id)
+
+        # Past half the lease it is renewed; once lost, another node id is taken
+        now[0] += 40 * 1_000_000_000
+        first.next_code()
+        self.assertEqual(shared.get('transaction-code-node:%d' % first.node_id), first.lease.token)
+        shared.delete('transaction-code-node:%d' % second.node_id)
+        shared.add('transaction-code-node:%d' % second.node_id, 'someone else')
+        lost = second.node_id
+        now[0] += 40 * 1_000_000_000
+        second.next_code()
+        self.assertNotIn(second.node_id, (lost, first.node_id))
+
+    def test_restart_does_not_reissue_borrowed_milliseconds(self):
+        shared = LocMemCache(self.id(), {})
+        now = [1767225600000 * 1_000_000]
+        before = TransactionCodeGenerator(clock=lambda: now[0], lease=NodeLease(shared, 60, node_id=7))
+        codes = [before.next_code() for _ in range(5000)]  # borrows two milliseconds
+        now[0] -= 10_000 * 1_000_000  # then the clock jumps 10s back and the process restarts
+
+        after = TransactionCodeGenerator(clock=lambda: now[0], lease=NodeLease(shared, 60, node_id=7))
+        restarted = [after.next_code() for _ in range(10)]
+        self.assertGreater(restarted[0], codes[-1])
+        self.assertEqual(len(set(codes + restarted)), 5010)
+
+    def test_deploy_check_wants_a_shared_cache_or_configured_node_ids(self):
+        self.assertEqual([error.id for error in check_node_ids(None)], ['my_app.W001'])
+        with override_settings(TRANSACTION_CODE_NODE_ID=3):
+            self.assertEqual(check_node_ids(None), [])
+
+
+class CachingTokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cached_identity_still_reads_fresh_balance(self):
+        self.client.get('/api/transactions/balance/')
+        User.objects.filter(pk=self.user.pk).update(balance=Decimal('42.00'))
+
+        # Only the balance itself is read once the token is cached
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/transactions/balance/')
+        self.assertEqual(response.data['balance'], '42.00')
+
+    def test_logout_invalidates_cached_token(self):
+        self.client.get('/api/transactions/balance/')
+        self.client.post('/api/auth/logout/')
+
+        response = self.client.get('/api/transactions/balance/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_deactivation_invalidates_cached_token(self):
+        self.client.get('/api/transactions/balance/')
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get('/api/transactions/balance/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_bulk_deactivation_needs_forget_user_tokens(self):
+        self.client.get('/api/transactions/balance/')
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        # update() sends no post_save, so the cached user is still active
+        response = self.client.get('/api/transactions/balance/')
+        self.assertEqual(response.status_code, 200)
+
+        forget_user_tokens([self.user.pk])
+        response = self.client.get('/api/transactions/balance/')
+        self.assertEqual(response.status_code, 401)
+
+
+class LoginTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+
+    def login(self, pin):
+        return self.client.post('/api/auth/login/', {
+            'phone_number': '+254712345678', 'pin': pin
+        }, format='json')
+
+    def test_legacy_pin_hash_is_upgraded_on_login(self):
+        self.user.password = make_password('1234', hasher='pbkdf2_sha256')
+        self.user.save()
+
+        self.assertEqual(self.login('1234').status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pin_scrypt$'))
+        self.assertEqual(self.login('1234').status_code, 200)
+
+    @override_settings(LOGIN_MAX_FAILED_ATTEMPTS=3)
+    def test_account_locked_after_failed_attempts(self):
+        for _ in range(3):
+            self.assertEqual(self.login('0000').status_code, 400)
+
+        # Even the right PIN is refused (without hashing) while locked
+        response = self.login('1234')
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(LOGIN_MAX_FAILED_ATTEMPTS=3)
+    def test_successful_login_resets_failed_attempts(self):
+        self.login('0000')
+        self.login('0000')
+        self.assertEqual(self.login('1234').status_code, 200)
+
+        self.login('0000')
+        self.assertEqual(self.login('1234').status_code, 200)
+
+
+class CallbackStub:
+    """Local HTTP/1.1 server recording the callbacks posted to it"""
+
+    def __init__(self):
+        self.status = {}
+        self.requests = []
+        self.connections = set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stub.requests.append((self.path, self.headers, body))
+                stub.connections.add(self.client_address)
+                self.send_response(stub.status.get(self.path, 200))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def events(self, path):
+        return [event for request_path, _, body in self.requests if request_path == path
+                for event in json.loads(body)['events']]
+
+
+def resolving(addresses):
+    """Patch name resolution: hosts in ``addresses`` resolve to the given address, others as usual"""
+    resolve = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host in addresses:
+            return resolve(addresses[host], port, *args, **kwargs)
+        return resolve(host, port, *args, **kwargs)
+    return mock.patch('socket.getaddrinfo', getaddrinfo)
+
+
+# dispatch() recycles connections like a request does, so no wrapping transaction
+@override_settings(CALLBACK_ALLOW_PRIVATE_NETWORKS=True)
+class CallbackTests(TransactionTestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        ledger.deposit(self.sender, Decimal('1000.00'))
+        self.receiver = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mary Wanjiku', pin='2345'
+        )
+        TransactionEvent.objects.all().delete()
+        self.stub = CallbackStub().__enter__()
+        self.addCleanup(self.stub.__exit__)
+        for user, field, path in ((self.sender, 'result_url', '/result'), (self.receiver, 'confirmation_url', '/confirm')):
+            CallbackEndpoint.objects.create(user=user, secret=callbacks.generate_secret(), **{field: self.stub.url + path})
+
+    def send(self, amount='10.00'):
+        return ledger.transfer(self.sender, self.receiver, Decimal(amount))
+
+    def dispatch(self):
+        return async_to_sync(callbacks.dispatch)(until_empty=True)
+
+    def test_events_are_written_with_their_transactions(self):
+        txn = self.send()
+        self.assertEqual(list(TransactionEvent.objects.values_list('transaction_id', 'status')), [(txn.pk, 'COMPLETED')])
+
+        TransactionEvent.objects.all().delete()
+        queued = ledger.enqueue_transfer(self.sender, self.receiver, Decimal('5000.00'))
+        self.assertFalse(TransactionEvent.objects.exists())
+        ledger.apply_pending_transfers()
+        self.assertEqual(list(TransactionEvent.objects.values_list('transaction_id', 'status')), [(queued.pk, 'FAILED')])
+
+        with self.settings(CALLBACKS_ENABLED=False):
+            self.send()
+        self.assertEqual(TransactionEvent.objects.count(), 1)
+
+    def test_events_are_batched_per_endpoint_and_signed(self):
+        txns = [self.send() for _ in range(3)]
+
+        self.assertEqual(self.dispatch(), (3, 0))
+
+        self.assertEqual(len(self.stub.requests), 2)
+        for path, kind in (('/result', 'result'), ('/confirm', 'confirmation')):
+            events = self.stub.events(path)
+            self.assertEqual([event['transaction']['id'] for event in events], [str(txn.pk) for txn in txns])
+            self.assertEqual({event['type'] for event in events}, {kind})
+        event = self.stub.events('/confirm')[0]
+        self.assertEqual(event['id'], f'{txns[0].pk}:COMPLETED:confirmation')
+        self.assertEqual(event['transaction']['sender_phone'], '+254712345678')
+        self.assertEqual(event['transaction']['amount'], '10.00')
+
+        for path, headers, body in self.stub.requests:
+            user = self.sender if path == '/result' else self.receiver
+            fields = dict(part.split('=') for part in headers[callbacks.SIGNATURE_HEADER].split(','))
+            expected = callbacks.sign(user.callback_endpoint.secret, fields['t'], body)
+            self.assertTrue(hmac.compare_digest(fields['v1'], expected))
+        self.assertFalse(TransactionEvent.objects.exists())
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        txn = self.send()
+        self.stub.status['/confirm'] = 503
+
+        with self.assertLogs('my_app.callbacks', 'WARNING'):
+            self.assertEqual(self.dispatch(), (1, 1))
+
+        retry = TransactionEvent.objects.get()
+        self.assertEqual((retry.account_id, retry.attempts), (self.receiver.pk, 1))
+        self.assertGreater(retry.next_attempt_at, timezone.now())
+        self.assertEqual(len(self.stub.events('/result')), 1)
+
+        self.stub.status['/confirm'] = 200
+        TransactionEvent.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(self.dispatch(), (1, 0))
+
+        self.assertEqual([event['id'] for event in self.stub.events('/confirm')],
+                         [f'{txn.pk}:COMPLETED:confirmation'] * 2)
+        self.assertEqual(len(self.stub.events('/result')), 1)
+        self.assertFalse(TransactionEvent.objects.exists())
+
+    @override_settings(CALLBACK_MAX_ATTEMPTS=1)
+    def test_delivery_is_dropped_after_max_attempts(self):
+        self.send()
+        self.stub.status['/confirm'] = 500
+
+        with self.assertLogs('my_app.callbacks', 'ERROR'):
+            self.assertEqual(self.dispatch(), (1, 1))
+        self.assertFalse(TransactionEvent.objects.exists())
+
+    def test_connections_are_kept_alive(self):
+        async def post_twice():
+            pool = callbacks.HTTPPool(per_host=1)
+            try:
+                return [await pool.post(self.stub.url + '/result', b'{}', {}) for _ in range(2)]
+            finally:
+                await pool.close()
+
+        self.assertEqual(async_to_sync(post_twice)(), [200, 200])
+        self.assertEqual(len(self.stub.connections), 1)
+
+    def test_one_bad_endpoint_does_not_stop_the_others(self):
+        # A port out of range fails before any connection is made
+        CallbackEndpoint.objects.filter(user=self.sender).update(result_url='http://127.0.0.1:99999/result')
+        self.send()
+
+        with self.assertLogs('my_app.callbacks', 'WARNING'):
+            self.assertEqual(self.dispatch(), (1, 1))
+        self.assertEqual(len(self.stub.events('/confirm')), 1)
+        retry = TransactionEvent.objects.get()
+        self.assertEqual((retry.account_id, retry.attempts), (self.sender.pk, 1))
+
+    def test_international_domain_names(self):
+        port = self.stub.server.server_port
+        CallbackEndpoint.objects.filter(user=self.receiver).update(confirmation_url=f'http://例え.jp:{port}/確認')
+        self.send()
+
+        with resolving({'xn--r8jz45g.jp': '127.0.0.1'}):
+            self.assertEqual(self.dispatch(), (1, 0))
+        headers, = [headers for path, headers, body in self.stub.requests if path == '/%E7%A2%BA%E8%AA%8D']
+        self.assertEqual(headers['Host'], f'xn--r8jz45g.jp:{port}')
+
+    @override_settings(CALLBACK_ALLOW_PRIVATE_NETWORKS=False)
+    def test_private_addresses_are_refused_when_connecting(self):
+        self.send()
+
+        with self.assertLogs('my_app.callbacks', 'WARNING') as logs:
+            self.assertEqual(self.dispatch(), (1, 2))
+        self.assertIn('BlockedAddress', logs.output[0])
+        self.assertEqual(self.stub.requests, [])
+
+    def test_interim_responses_and_trailers_are_skipped(self):
+        async def read():
+            reader = asyncio.StreamReader()
+            reader.feed_data(
+                b'HTTP/1.1 100 Continue\r\n\r\n'
+                b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                b'2\r\nok\r\n0\r\nX-Checksum: abc\r\n\r\n'
+                b'HTTP/1.1 204 No Content\r\n\r\n'
+            )
+            reader.feed_eof()
+            return [await callbacks.read_response(reader) for _ in range(2)]
+
+        self.assertEqual(async_to_sync(read)(), [(200, True), (204, True)])
+
+        async def read_bad_chunk():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n')
+            reader.feed_eof()
+            return await callbacks.read_response(reader)
+
+        with self.assertRaises(callbacks.HTTPError):
+            async_to_sync(read_bad_chunk)()
+
+
+class CallbackEndpointTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        self.client.force_authenticate(self.user)
+        self.url = '/api/callbacks/endpoint/'
+
+    def test_register_update_and_remove(self):
+        self.enterContext(resolving({'shop.example': '93.184.215.14'}))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        response = self.client.put(self.url, {'confirmation_url': 'https://shop.example/confirm'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        secret = response.data['secret']
+        self.assertEqual(len(secret), 64)
+
+        response = self.client.put(self.url, {
+            'confirmation_url': 'https://shop.example/confirm', 'result_url': 'https://shop.example/result'
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['secret'], secret)
+        self.assertEqual(self.client.get(self.url).data['result_url'], 'https://shop.example/result')
+
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertFalse(CallbackEndpoint.objects.exists())
+
+    def test_needs_a_url(self):
+        response = self.client.put(self.url, {'confirmation_url': 'not a url'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.put(self.url, {}, format='json').status_code, 400)
+
+    def test_private_addresses_are_refused(self):
+        for url in ('http://127.0.0.1/cb', 'http://10.0.0.5/cb', 'http://169.254.169.254/latest',
+                    'http://[::1]/cb', 'http://[::ffff:192.168.1.1]/cb', 'http://internal.example/cb'):
+            with resolving({'internal.example': '192.168.1.10'}):
+                response = self.client.put(self.url, {'confirmation_url': url}, format='json')
+            self.assertEqual(response.status_code, 400, url)
+            self.assertIn('confirmation_url', response.data)
+
+        with self.settings(CALLBACK_ALLOW_PRIVATE_NETWORKS=True):
+            response = self.client.put(self.url, {'confirmation_url': 'http://127.0.0.1/cb'}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        other = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mary Wanjiku', pin='2345'
+        )
+        for i in range(25):
+            ledger.deposit(self.user, Decimal('10.00'), f'Deposit {i}')
+        self.txn = ledger.transfer(self.user, other, Decimal('25.50'), 'Lunch')
+        token = Token.objects.create(user=self.user)
+        self.headers = {'Authorization': f'Token {token.key}'}
+
+    def get_both(self, url):
+        sync = self.client.get(url, headers=self.headers)
+        with self.settings(ROOT_URLCONF='mpesa_system.asgi_urls'):
+            response = async_to_sync(self.async_client.get)(url, headers=self.headers)
+        return sync, response
+
+    def test_async_views_match_sync_views(self):
+        for url in ('/api/transactions/balance/',
+                    '/api/transactions/history/',
+                    '/api/transactions/history/?fast=true&page_size=5',
+                    f'/api/transactions/{self.txn.pk}/'):
+            sync, response = self.get_both(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(response.json(), sync.json(), url)
+            self.assertEqual(response.get('Link'), sync.get('Link'), url)
+
+    def test_async_errors_match_sync_errors(self):
+        for url in ('/api/transactions/history/?status=BOGUS',
+                    '/api/transactions/history/?cursor=not-a-cursor',
+                    f'/api/transactions/{uuid.uuid4()}/'):
+            sync, response = self.get_both(url)
+            self.assertEqual(response.status_code, sync.status_code, url)
+            self.assertEqual(response.json(), sync.json(), url)
+
+    def test_unauthenticated(self):
+        self.headers = {}
+        sync, response = self.get_both('/api/transactions/balance/')
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), sync.json())
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+    @override_settings(ROOT_URLCONF='mpesa_system.asgi_urls')
+    def test_other_methods_fall_back_to_sync_views(self):
+        response = self.client.post('/api/transactions/balance/', headers=self.headers)
+        self.assertEqual(response.status_code, 405)
+
+class RecordingBroker:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, user_id, message):
+        self.published.append((user_id, message['data']))
+
+
+@override_settings(PUSH_BROKER='my_app.tests.RecordingBroker')
+class PushTests(TransactionTestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        ledger.deposit(self.sender, Decimal('100.00'))
+        self.receiver = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mary Wanjiku', pin='2345'
+        )
+        self.broker = push.get_broker()
+        self.broker.published.clear()
+
+    def test_ledger_publishes_entries_once_committed(self):
+        with db_transaction.atomic():
+            txn = ledger.transfer(self.sender, self.receiver, Decimal('30.00'))
+            self.assertEqual(self.broker.published, [])
+
+        self.assertEqual(sorted(self.broker.published, key=lambda item: item[1]['direction']), [
+            (self.receiver.pk, {'transaction_id': str(txn.pk), 'status': 'COMPLETED', 'direction': 'CREDIT',
+                                'amount': '30.00', 'balance': '30.00'}),
+            (self.sender.pk, {'transaction_id': str(txn.pk), 'status': 'COMPLETED', 'direction': 'DEBIT',
+                              'amount': '30.00', 'balance': '70.00'}),
+        ])
+
+        self.broker.published.clear()
+        with self.assertRaises(ledger.InsufficientFunds), db_transaction.atomic():
+            ledger.withdraw(self.sender, Decimal('500.00'))
+        self.assertEqual(self.broker.published, [])
+
+    def test_failed_queued_transfers_reach_both_parties(self):
+        txn = ledger.enqueue_transfer(self.sender, self.receiver, Decimal('500.00'))
+        self.assertEqual(self.broker.published, [])
+
+        ledger.apply_pending_transfers()
+        self.assertEqual(
+            {(user_id, data['status'], data['balance']) for user_id, data in self.broker.published},
+            {(self.sender.pk, 'FAILED', None), (self.receiver.pk, 'FAILED', None)}
+        )
+        self.assertEqual({data['transaction_id'] for _, data in self.broker.published}, {str(txn.pk)})
+
+    def test_local_broker_drops_the_oldest_messages_of_slow_subscribers(self):
+        broker = push.LocalBroker()
+
+        async def run():
+            async with broker.subscribe('a') as subscription:
+                await asyncio.to_thread(broker.publish, 'b', 'not for a')
+                for i in range(push.QUEUE_SIZE + 5):
+                    broker.publish('a', i)
+                await asyncio.sleep(0)
+                self.assertEqual(subscription.qsize(), push.QUEUE_SIZE)
+                self.assertEqual(await subscription.get(), 5)
+            self.assertEqual(broker.subscribers, {})
+        async_to_sync(run)()
+
+    @override_settings(ROOT_URLCONF='mpesa_system.asgi_urls', PUSH_BROKER='my_app.push.LocalBroker')
+    def test_stream(self):
+        headers = {'Authorization': f'Token {Token.objects.create(user=self.sender).key}'}
+        broker = push.get_broker()
+
+        async def run():
+            response = await self.async_client.get('/api/transactions/stream/', headers=headers)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            events = aiter(response.streaming_content)
+            self.assertEqual(await anext(events), b'event: balance\ndata: {"balance": "100.00"}\n\n')
+
+            txn = await sync_to_async(ledger.withdraw)(self.sender, Decimal('40.00'))
+            event = await anext(events)
+            self.assertTrue(event.startswith(b'event: transaction\ndata: '))
+            self.assertEqual(json.loads(event.split(b'data: ')[1]), {
+                'transaction_id': str(txn.pk), 'status': 'COMPLETED', 'direction': 'DEBIT',
+                'amount': '40.00', 'balance': '60.00'
+            })
+            # A client disconnecting cancels the stream
+            waiting = asyncio.ensure_future(anext(events))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            self.assertEqual(broker.subscribers, {})
+        async_to_sync(run)()
+
+        with self.settings(PUSH_BROKER=None):
+            response = async_to_sync(self.async_client.get)('/api/transactions/stream/', headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+
+def throttle_rates(**rates):
+    return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates})
+
+
+class ThrottleTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        ledger.deposit(self.user, Decimal('100.00'))
+        self.other = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mary Wanjiku', pin='2345'
+        )
+        token = Token.objects.create(user=self.user)
+        self.headers = {'Authorization': f'Token {token.key}'}
+
+    @throttle_rates(reads='3/min')
+    def test_window_slides(self):
+        for now in (0, 10, 20):
+            self.assertIsNone(throttling.hit('reads', 'a', now=now))
+        # Until the window ends and a third of it has slid out again
+        self.assertEqual(throttling.hit('reads', 'a', now=30), 50)
+        # Callers have budgets of their own
+        self.assertIsNone(throttling.hit('reads', 'b', now=30))
+
+        # Halfway through the next window half of the previous one still counts
+        self.assertIsNone(throttling.hit('reads', 'a', now=90))
+        self.assertAlmostEqual(throttling.hit('reads', 'a', now=90), 10)
+        self.assertIsNone(throttling.hit('reads', 'a', now=100))
+        # Two windows on, nothing counts any more
+        self.assertIsNone(throttling.hit('reads', 'a', now=200))
+
+    @throttle_rates(money='2/min')
+    def test_money_movement_has_its_own_budget(self):
+        def send():
+            return self.client.post('/api/transactions/send_money/', {
+                'receiver_phone': self.other.phone_number, 'amount': '1.00'
+            }, format='json', headers=self.headers)
+
+        self.assertEqual([send().status_code for _ in range(2)], [201, 201])
+        response = send()
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(0 < int(response['Retry-After']) <= 120)
+        self.assertEqual(Transaction.objects.filter(transaction_type='SEND').count(), 2)
+
+        # Reads are not limited here, and other accounts have their own budget
+        self.assertEqual(self.client.get('/api/transactions/balance/', headers=self.headers).status_code, 200)
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.post('/api/transactions/deposit/', {'amount': '5.00'}, format='json').status_code, 201)
+
+    @throttle_rates(login='2/min')
+    def test_login_is_limited_per_address(self):
+        statuses = [
+            self.client.post('/api/auth/login/', {'phone_number': phone, 'pin': '0000'}, format='json').status_code
+            for phone in ('+254700000001', '+254700000002', '+254700000003')
+        ]
+        self.assertEqual(statuses, [400, 400, 429])
+        response = self.client.post(
+            '/api/auth/login/', {'phone_number': '+254712345678', 'pin': '1234'}, format='json',
+            REMOTE_ADDR='10.0.0.2'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @throttle_rates(reads='1/min')
+    def test_async_views_share_the_reads_budget(self):
+        with self.settings(ROOT_URLCONF='mpesa_system.asgi_urls'):
+            first = async_to_sync(self.async_client.get)('/api/transactions/balance/', headers=self.headers)
+            response = async_to_sync(self.async_client.get)('/api/transactions/history/', headers=self.headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.client.get('/api/transactions/balance/', headers=self.headers).status_code, 429)
+
+
+class UserAdminTests(TestCase):
+    def setUp(self):
+        admin = User.objects.create_superuser(
+            phone_number='+254700000000', full_name='Admin', pin='0000'
+        )
+        self.client.force_login(admin)
+
+    def add_users(self, count, start):
+        for i in range(start, start + count):
+            user = User.objects.create_user(
+                phone_number=f'+2547110000{i:02d}', full_name=f'User {i}', pin='1234'
+            )
+            ledger.deposit(user, Decimal('100.00'))
+            ledger.withdraw(user, Decimal('10.00'))
+
+    def changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/my_app/user/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_users(2, 0)
+        few = self.changelist_queries()
+        self.add_users(10, 2)
+        self.assertEqual(self.changelist_queries(), few)
+
+    def test_user_stats_read_from_stats_table(self):
+        self.add_users(1, 0)
+        user = User.objects.get(phone_number='+254711000000')
+
+        response = self.client.get(f'/admin/my_app/user/{user.pk}/change/')
+        self.assertContains(response, '100.00')
+        self.assertContains(response, '10.00')
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_only_opted_in_reads_go_to_replicas(self):
+        router = routers.ReplicaRouter()
+        self.assertEqual(router.db_for_read(User), 'default')
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(User), 'replica')
+            self.assertEqual(router.db_for_write(User), 'default')
+
+    def test_primary_only_without_replicas(self):
+        with routers.replica_reads():
+            self.assertEqual(routers.ReplicaRouter().db_for_read(User), 'default')
+
+
+# The primary stands in for the replica, so reads work inside test
+# transactions; queries record whether they were routed to a replica
+@override_settings(DATABASE_REPLICAS=['default'])
+class ReplicaRoutingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        ledger.deposit(self.user, Decimal('100.00'))
+        token = Token.objects.create(user=self.user)
+        self.headers = {'Authorization': f'Token {token.key}'}
+        # Cache the token lookup, which authentication makes on the primary
+        self.client.get('/api/transactions/balance/', headers=self.headers)
+
+    def routed(self, send):
+        replica_reads = []
+
+        def record(execute, sql, params, many, context):
+            replica_reads.append(routers.use_replica.get())
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = send()
+        self.assertLess(response.status_code, 400)
+        self.assertTrue(replica_reads)
+        return set(replica_reads)
+
+    def test_reads_use_replica_until_the_user_writes(self):
+        for url in ('/api/transactions/history/', '/api/transactions/balance/'):
+            self.assertEqual(self.routed(lambda: self.client.get(url, headers=self.headers)), {True}, url)
+
+        self.assertEqual(self.routed(lambda: self.client.post(
+            '/api/transactions/withdraw/', {'amount': '10.00'}, format='json', headers=self.headers
+        )), {False})
+        self.assertTrue(routers.is_pinned(self.user.pk))
+
+        response = self.client.get('/api/transactions/balance/', headers=self.headers)
+        self.assertEqual(response.json()['balance'], '90.00')
+        self.assertEqual(self.routed(
+            lambda: self.client.get('/api/transactions/history/', headers=self.headers)
+        ), {False})
+
+    def test_async_views_use_replica(self):
+        with self.settings(ROOT_URLCONF='mpesa_system.asgi_urls'):
+            self.assertEqual(self.routed(lambda: async_to_sync(self.async_client.get)(
+                '/api/transactions/history/', headers=self.headers
+            )), {True})
+
+    def test_admin_changelist_uses_replica(self):
+        self.client.force_login(User.objects.create_superuser(
+            phone_number='+254700000000', full_name='Admin', pin='0000'
+        ))
+        # Session and permission lookups stay on the primary
+        self.assertIn(True, self.routed(lambda: self.client.get('/admin/my_app/transaction/')))
+
+
+class ReconcileBalancesTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        self.bob = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mary Wanjiku', pin='2345'
+        )
+        ledger.deposit(self.alice, Decimal('100.00'))
+        ledger.transfer(self.alice, self.bob, Decimal('30.00'))
+        self.today = timezone.localdate()
+        LedgerEntry.objects.update(created_at=timezone.now() - timedelta(days=2))
+
+    def reconcile(self, day):
+        out = StringIO()
+        call_command('reconcile_balances', date=day, workers=1, ranges=3, stdout=out)
+        return out.getvalue()
+
+    def snapshots(self, day):
+        return dict(BalanceSnapshot.objects.filter(day=day).values_list('account_id', 'closing_balance'))
+
+    def test_incremental_snapshots(self):
+        two_days_ago = self.today - timedelta(days=2)
+        self.reconcile(two_days_ago)
+        self.assertEqual(self.snapshots(two_days_ago), {
+            self.alice.pk: Decimal('70.00'), self.bob.pk: Decimal('30.00'),
+        })
+
+        # Written today, so after yesterday's close but still explains the balance
+        ledger.deposit(self.bob, Decimal('5.00'))
+        output = self.reconcile(self.today - timedelta(days=1))
+
+        self.assertIn(f'from snapshot of {two_days_ago}', output)
+        self.assertIn('All balances match the ledger', output)
+        self.assertEqual(self.snapshots(self.today - timedelta(days=1)), {
+            self.alice.pk: Decimal('70.00'), self.bob.pk: Decimal('30.00'),
+        })
+
+    def test_transfers_queued_before_the_close_are_applied_first(self):
+        yesterday = self.today - timedelta(days=1)
+        self.reconcile(self.today - timedelta(days=2))
+        txn = ledger.enqueue_transfer(self.bob, self.alice, Decimal('10.00'))
+        before_close = timezone.now() - timedelta(days=1)
+        Transaction.objects.filter(pk=txn.pk).update(created_at=before_close)
+        LedgerEntry.objects.filter(transaction=txn).update(created_at=before_close)
+
+        output = self.reconcile(yesterday)
+
+        self.assertIn('All balances match the ledger', output)
+        self.assertFalse(PendingTransfer.objects.exists())
+        self.assertEqual(self.snapshots(yesterday), {
+            self.alice.pk: Decimal('80.00'), self.bob.pk: Decimal('20.00'),
+        })
+        self.assertIn('All balances match the ledger', self.reconcile(self.today))
+
+    def test_reports_drift(self):
+        User.objects.filter(pk=self.bob.pk).update(balance=Decimal('31.00'))
+
+        with self.assertRaisesMessage(CommandError, '1 account(s) drifted'):
+            self.reconcile(self.today - timedelta(days=1))
+
+
+class StatementTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        self.other = User.objects.create_user(
+            phone_number='+254723456789', full_name='Mary Wanjiku', pin='2345'
+        )
+        ledger.deposit(self.user, Decimal('100.00'))
+        ledger.transfer(self.user, self.other, Decimal('30.00'), 'Rent, March')
+        ledger.transfer(self.other, self.user, Decimal('5.00'))
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_statement_with_running_balance(self):
+        response, body = self.get('/api/transactions/statement/')
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="statement-254712345678.csv"', response['Content-Disposition'])
+        rows = list(csv.DictReader(body.splitlines()))
+        self.assertEqual(
+            [(row['transaction_type'], row['debit'], row['credit'], row['balance']) for row in rows],
+            [('DEPOSIT', '', '100.00', '100.00'), ('SEND', '30.00', '', '70.00'), ('SEND', '', '5.00', '75.00')]
+        )
+        self.assertEqual(rows[1]['description'], 'Rent, March')
+        self.assertEqual(rows[1]['counterparty'], '+254723456789')
+
+    def test_jsonl_statement_and_date_range(self):
+        today = timezone.localdate()
+        _, body = self.get(f'/api/transactions/statement/?output=jsonl&start_date={today}')
+        self.assertEqual([json.loads(line)['balance'] for line in body.splitlines()], ['100.00', '70.00', '75.00'])
+
+        _, body = self.get(f'/api/transactions/statement/?end_date={today - timedelta(days=1)}')
+        self.assertEqual(body.splitlines(), [','.join(statements.COLUMNS)])
+
+    def test_invalid_parameters(self):
+        response = self.client.get('/api/transactions/statement/?output=pdf')
+        self.assertEqual(response.status_code, 400)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.user = User.objects.create_user(
+            phone_number='+254712345678', full_name='James Kamau', pin='1234'
+        )
+        ledger.deposit(self.user, Decimal('100.00'))
+        self.client.force_authenticate(self.user)
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode()
+
+    def test_records_timings_per_view(self):
+        self.client.post('/api/transactions/withdraw/', {'amount': '10.00'}, format='json')
+        self.client.get('/api/transactions/balance/')
+        self.client.get('/no-such-page/')
+        body = self.scrape()
+
+        self.assertIn('mpesa_http_requests_total{view="transactions-withdraw",method="POST",status="201"} 1', body)
+        self.assertIn('mpesa_http_requests_total{view="<unmatched>",method="GET",status="404"} 1', body)
+        self.assertIn('mpesa_http_request_duration_seconds_count{view="transactions-balance",method="GET"} 1', body)
+        # Withdraw locks the account and serializes; the balance read does neither
+        self.assertIn('mpesa_http_request_lock_wait_seconds_count{view="transactions-withdraw"} 1', body)
+        self.assertIn('mpesa_http_request_serializer_seconds_count{view="transactions-withdraw"} 1', body)
+        self.assertNotIn('mpesa_http_request_lock_wait_seconds_count{view="transactions-balance"}', body)
+
+        queries = [line for line in body.splitlines()
+                   if line.startswith('mpesa_http_request_db_queries_sum{view="transactions-withdraw"}')]
+        self.assertGreater(float(queries[0].split()[-1]), 0)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_scrape_can_be_restricted(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    def test_scrape_is_loopback_only_by_default(self):
+        with self.settings():
+            del settings.METRICS_ALLOWED_IPS
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='::1').status_code, 200)
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 403)
+
+
+class PartitionTests(TestCase):
+    def test_month_helpers(self):
+        self.assertEqual(partitions.add_months(date(2026, 11, 1), 3), date(2027, 2, 1))
+        self.assertEqual(partitions.add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+        self.assertEqual(partitions.partition_name(date(2026, 3, 1)), 'transactions_y2026m03')
+        self.assertEqual(partitions.partition_month('transactions_y2026m03'), date(2026, 3, 1))
+        self.assertIsNone(partitions.partition_month(partitions.DEFAULT_PARTITION))
+
+        start, end = partitions.month_bounds(date(2026, 12, 1))
+        self.assertEqual((start.isoformat(), end.isoformat()),
+                         ('2026-12-01T00:00:00+03:00', '2027-01-01T00:00:00+03:00'))
+
+    def archive(self, directory, counts):
+        updated = timezone.now()
+        cursor = RecordingCursor({'SELECT count(*)': [[(count, updated)] for count in counts]})
+
+        def copy(cursor, sql, path):
+            cursor.statements.append(sql)
+            with open(path, 'w') as file:
+                file.write('id\n')
+        with mock.patch.object(partitions, 'copy_to_file', copy), \
+                mock.patch.object(partitions, 'connection', mock.Mock(in_atomic_block=False)):
+            return cursor, partitions.archive_partition(cursor, date(2024, 3, 1), directory)
+
+    def test_archive_copies_before_detaching(self):
+        with tempfile.TemporaryDirectory() as archive_dir:
+            cursor, (path, rows) = self.archive(archive_dir, [3, 3])
+            self.assertEqual((path, rows), (f'{archive_dir}/transactions_y2024m03.csv.gz', 3))
+            self.assertEqual(sorted(os.listdir(archive_dir)), [
+                'ledger_entries_y2024m03.csv.gz', 'pending_transfers_y2024m03.csv.gz',
+                'transaction_events_y2024m03.csv.gz', 'transactions_y2024m03.csv.gz',
+            ])
+
+        statements = [' '.join(sql.split()[:4]) for sql in cursor.statements]
+        self.assertEqual(statements, [
+            'SET TRANSACTION ISOLATION LEVEL',
+            'SELECT count(*), max(updated_at) FROM',
+            'COPY transactions_y2024m03 TO STDOUT',
+            'COPY (SELECT * FROM',
+            'COPY (SELECT * FROM',
+            'COPY (SELECT * FROM',
+            # The copy has committed; only now is transactions locked, briefly
+            'SET LOCAL lock_timeout =',
+            'ALTER TABLE transactions DETACH',
+            'SELECT count(*), max(updated_at) FROM',
+            'DELETE FROM ledger_entries WHERE',
+            'DELETE FROM pending_transfers WHERE',
+            'DELETE FROM transaction_events WHERE',
+            'DROP TABLE transactions_y2024m03',
+        ])
+
+    def test_archive_keeps_a_partition_that_changed(self):
+        with tempfile.TemporaryDirectory() as archive_dir:
+            with self.assertRaises(partitions.ArchiveError):
+                self.archive(archive_dir, [3, 4])
+            self.assertEqual(os.listdir(archive_dir), [])
+
+    def test_maintain_archives_reconciled_months_and_finishes_detached_ones(self):
+        user = User.objects.create_user(phone_number='+254712345678', full_name='James Kamau', pin='1234')
+        BalanceSnapshot.objects.create(account=user, day=date(2024, 9, 30), closing_balance=0)
+        attached = [('transactions_y2024m09',), ('transactions_y2024m10',), ('transactions_y2026m10',)]
+        cursor = RecordingCursor({
+            'SELECT c.relname FROM pg_inherits': [attached, attached],
+            'SELECT DISTINCT': [[]],
+            'SELECT relname FROM pg_class': [[('transactions_y2024m08',)]],
+        })
+
+        with mock.patch.object(partitions, 'connection', mock.Mock(cursor=lambda: cursor)), \
+                mock.patch.object(partitions, 'archive_partition', return_value=('path', 5)) as archive:
+            done = partitions.maintain(ahead=0, retain_months=24, archive_dir='/archive', today=date(2026, 10, 17))
+
+        self.assertEqual(done, [('archived', date(2024, 9, 1), 'path', 5), ('unreconciled', date(2024, 10, 1))])
+        archive.assert_called_once_with(cursor, date(2024, 9, 1), '/archive')
+        self.assertIn('DROP TABLE transactions_y2024m08', cursor.statements)
+
+    @skipIf(connection.vendor == 'postgresql', 'Partitioning is supported')
+    def test_requires_postgresql(self):
+        with self.assertRaisesMessage(CommandError, 'requires PostgreSQL'):
+            call_command('partition_transactions', stdout=StringIO())
+
+    @skipUnless(connection.vendor == 'postgresql', 'Partitioning requires PostgreSQL')
+    def test_creates_and_archives_partitions(self):
+        user = User.objects.create_user(phone_number='+254712345678', full_name='James Kamau', pin='1234')
+        old = ledger.deposit(user, Decimal('100.00'))
+        recent = ledger.deposit(user, Decimal('50.00'))
+        # Lands in the default partition: no month that old was created
+        old_month = partitions.add_months(timezone.localdate().replace(day=1), -36)
+        Transaction.objects.filter(pk=old.pk).update(created_at=partitions.month_bounds(old_month)[0])
+        BalanceSnapshot.objects.create(
+            account=user, day=partitions.add_months(old_month, 1) - timedelta(days=1), closing_balance=100
+        )
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            out = StringIO()
+            call_command('partition_transactions', ahead=4, retain_months=24, archive_dir=archive_dir, stdout=out)
+            name = partitions.partition_name(old_month)
+            self.assertIn(f'Created {name} (moved 1 row(s)', out.getvalue())
+            self.assertIn(f'Archived {name} (1 row(s))', out.getvalue())
+            with gzip.open(f'{archive_dir}/{name}.csv.gz', 'rt') as file:
+                self.assertIn(old.transaction_code, file.read())
+            with gzip.open(f'{archive_dir}/ledger_entries{name[len(partitions.TABLE):]}.csv.gz', 'rt') as file:
+                self.assertIn(str(old.pk), file.read())
+
+        self.assertEqual(list(Transaction.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertEqual(list(LedgerEntry.objects.values_list('transaction_id', flat=True)), [recent.pk])
+        with connection.cursor() as cursor:
+            months = partitions.list_partitions(cursor)
+        self.assertEqual(months[-1], partitions.add_months(timezone.localdate().replace(day=1), 4))
+        self.assertNotIn(old_month, months)
+
+
+class GenerateDataTests(TestCase):
+    def test_rows_cover_every_column_without_a_database_default(self):
+        # COPY leaves out columns that are not listed, and Django only sets
+        # model defaults in Python, so those columns would be NULL
+        for model, fields in ((User, datagen.USER_FIELDS), (Transaction, datagen.TRANSACTION_FIELDS),
+                              (LedgerEntry, datagen.ENTRY_FIELDS)):
+            required = {
+                field.attname for field in model._meta.concrete_fields
+                if not field.null and field.db_default is NOT_PROVIDED and not isinstance(field, AutoFieldMixin)
+            }
+            self.assertEqual(required - set(fields), set(), model.__name__)
+
+    def test_generated_ledger_is_consistent(self):
+        call_command('generate_data', users=40, transactions=600, days=5, workers=1, stdout=StringIO())
+
+        self.assertEqual(User.objects.count(), 40)
+        self.assertEqual(Transaction.objects.values('transaction_code').distinct().count(), 600)
+        self.assertFalse(User.objects.filter(balance__lt=0).exists())
+        self.assertEqual(
+            UserStats.objects.aggregate(total=Sum('sent_count') + Sum('received_count'))['total'],
+            LedgerEntry.objects.count()
+        )
+        out = StringIO()
+        call_command('reconcile_balances', date=timezone.localdate(), workers=1, stdout=out)
+        self.assertIn('All balances match the ledger', out.getvalue())
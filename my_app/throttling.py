@@ -0,0 +1,112 @@
+# my_app/throttling.py
+"""
+Rate limiting with sliding-window counters.
+
+Each view names a budget with ``throttle_scope`` (``login``, ``register``,
+``money``, ``reads``); the rates are DRF's ``DEFAULT_THROTTLE_RATES``, e.g.
+``'60/min'``. Authenticated requests count against their user, so every
+token of an account shares one budget; anonymous ones against the client
+address. PIN guessing against one account is stopped separately, by the
+failed login lockout in authentication.py.
+
+DRF's own throttles keep a list of request timestamps per key and rewrite
+it on every request, which grows with the rate. Here a key holds two
+integers: the counts of the current and the previous fixed window. The
+request rate is estimated as if the previous window's requests were spread
+evenly, so the budget slides instead of resetting at window boundaries::
+
+    estimate = previous * (1 - elapsed / period) + current
+
+Counters live in the ``THROTTLE_CACHE_ALIAS`` cache and are bumped with its
+atomic ``incr``, so concurrent requests cannot both take the last slot.
+Budgets are only shared between processes if that cache is (Redis or
+Memcached rather than the local-memory default). Rejected requests do not
+count, as with DRF's throttles.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+def get_cache():
+    return caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+
+
+def parse_rate(rate):
+    """'60/min' -> (60, 60)"""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+def get_rate(scope):
+    """(requests, period in seconds) allowed in ``scope``, or None if it is not limited"""
+    rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+    return parse_rate(rate) if rate else None
+
+
+def window_keys(scope, ident, period, now):
+    """(previous key, current key, fraction of the current window elapsed)"""
+    window, elapsed = divmod(now, period)
+    prefix = f'throttle:{scope}:{ident}:'
+    return f'{prefix}{int(window) - 1}', f'{prefix}{int(window)}', elapsed / period
+
+
+def retry_after(limit, period, elapsed, previous, current):
+    """
+    Seconds until one more request fits, given the accepted counts; None if
+    it fits now
+    """
+    if previous * (1 - elapsed) + current + 1 <= limit:
+        return None
+    if current + 1 <= limit:
+        # Wait for enough of the previous window to slide out
+        return period * (1 - (limit - current - 1) / previous - elapsed)
+    # Wait for this window to end, then for enough of it to slide out
+    return period * (1 - elapsed) + period * (1 - (limit - 1) / max(current, 1))
+
+
+def hit(scope, ident, now=None):
+    """
+    Count a request against ``ident``'s budget in ``scope``. Returns None if
+    it is allowed, else the seconds to wait before retrying.
+    """
+    rate = get_rate(scope)
+    if rate is None:
+        return None
+    limit, period = rate
+    previous_key, current_key, elapsed = window_keys(scope, ident, period, time.time() if now is None else now)
+    cache = get_cache()
+    try:
+        current = cache.incr(current_key)
+    except ValueError:
+        # Kept through the next window, where it is the previous one
+        current = 1 if cache.add(current_key, 1, 2 * period) else cache.incr(current_key)
+    previous = cache.get(previous_key, 0)
+    wait = retry_after(limit, period, elapsed, previous, current - 1)
+    if wait is not None:
+        cache.decr(current_key)
+    return wait
+
+
+def client_ident(request, user):
+    if user is not None and user.is_authenticated:
+        return user.pk
+    return f'address:{BaseThrottle().get_ident(request)}'
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """Throttles each view by its ``throttle_scope``; views without one are not limited"""
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        self.wait_seconds = hit(scope, client_ident(request, request.user)) if scope else None
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
+
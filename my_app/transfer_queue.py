@@ -0,0 +1,89 @@
+# my_app/transfer_queue.py
+"""
+Queued transfers.
+
+With ``QUEUED_TRANSFERS`` enabled, ``send_money`` only records a PENDING
+transaction and an outbox row (``ledger.enqueue_transfer``) and answers 202
+Accepted; clients follow the transaction's status through the transaction
+endpoints. The ``process_transfers`` command runs a pool of worker
+processes that apply the queue in batches (``ledger.apply_pending_transfers``)
+and mark each transfer COMPLETED or FAILED.
+
+Workers poll: a worker that finds the queue empty sleeps for
+``poll_interval`` seconds before looking again. A full batch is followed
+immediately by the next one, so a backlog drains at full speed.
+"""
+import logging
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from . import ledger
+
+logger = logging.getLogger(__name__)
+
+
+def is_enabled():
+    return getattr(settings, 'QUEUED_TRANSFERS', False)
+
+
+class Stop(Exception):
+    pass
+
+
+def _stop(signum, frame):
+    raise Stop()
+
+
+def work(batch_size=100, poll_interval=1.0, until_empty=False):
+    """
+    Apply queued transfers until stopped (SIGTERM or Ctrl-C) or, with
+    ``until_empty``, until the queue is empty. A batch interrupted by a stop
+    is rolled back and left for the next worker. Returns (completed, failed).
+    """
+    previous_handler = signal.signal(signal.SIGTERM, _stop)
+    completed = failed = 0
+    try:
+        while True:
+            # As at the end of a request: drop connections that are broken or
+            # past CONN_MAX_AGE, or hand them back to the pool
+            close_old_connections()
+            try:
+                done = ledger.apply_pending_transfers(batch_size)
+            except Stop:
+                raise
+            except Exception:
+                # Rolled back; keep the worker alive and try again
+                logger.exception('Applying queued transfers failed; retrying')
+                time.sleep(poll_interval)
+                continue
+            completed += done[0]
+            failed += done[1]
+            if until_empty:
+                if done == (0, 0):
+                    break
+            elif sum(done) < batch_size:
+                time.sleep(poll_interval)
+    except (Stop, KeyboardInterrupt):
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        connections.close_all()
+    return completed, failed
+
+
+def run_workers(workers=1, **options):
+    """Run ``work`` in ``workers`` processes; returns their summed (completed, failed)"""
+    if workers == 1:
+        return work(**options)
+    # Forked workers must open their own connections, not share ours
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_work, [options] * workers))
+    return tuple(map(sum, zip(*results)))
+
+
+def _work(options):
+    return work(**options)
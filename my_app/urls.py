@@ -1,11 +1,12 @@
 # my_app/urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AuthViewSet, TransactionViewSet
+from .views import AuthViewSet, TransactionViewSet, CallbackViewSet
 
 router = DefaultRouter()
 router.register(r'auth', AuthViewSet, basename='auth')
 router.register(r'transactions', TransactionViewSet, basename='transactions')
+router.register(r'callbacks', CallbackViewSet, basename='callbacks')
 
 urlpatterns = [
     path('', include(router.urls)),
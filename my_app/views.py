@@ -2,21 +2,29 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, SAFE_METHODS
 from rest_framework.authtoken.models import Token
-from django.db import transaction as db_transaction
-from .models import User, Transaction
+from django.db.models import F
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+from .models import Transaction, CallbackEndpoint
+from .pagination import KeysetPagination
+from .idempotency import idempotent
+from . import callbacks, ledger, routers, statements, transfer_queue
 from .serializers import (
     UserSerializer, RegisterSerializer, LoginSerializer,
-    TransactionSerializer, SendMoneySerializer,
-    DepositSerializer, WithdrawSerializer, BalanceSerializer
+    TransactionSerializer, TransactionValuesSerializer, TransactionFilterSerializer, StatementSerializer,
+    SendMoneySerializer, BulkSendSerializer,
+    DepositSerializer, WithdrawSerializer, BalanceSerializer, CallbackEndpointSerializer
 )
 
 
 class AuthViewSet(viewsets.GenericViewSet):
     permission_classes = [AllowAny]
+    throttle_scope = None
 
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], throttle_scope='register')
     def register(self, request):
         serializer = RegisterSerializer(data=request.data)
         if serializer.is_valid():
@@ -29,12 +37,14 @@ class AuthViewSet(viewsets.GenericViewSet):
             }, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], throttle_scope='login')
     def login(self, request):
         serializer = LoginSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.validated_data['user']
             token, created = Token.objects.get_or_create(user=user)
+            if user.balance_buckets:
+                user.balance = ledger.current_balance(user.pk)
             return Response({
                 'message': 'Login successful',
                 'token': token.key,
@@ -48,73 +58,160 @@ class AuthViewSet(viewsets.GenericViewSet):
         return Response({'message': 'Logout successful'})
 
 
-class TransactionViewSet(viewsets.ModelViewSet):
+def user_transactions(user):
+    """Transactions the user is a party to, annotated with their ledger position"""
+    # Go through the user's ledger entries so history is one range scan
+    # on (account, created_at); the annotations reuse that single join
+    return Transaction.objects.filter(
+        ledger_entries__account=user
+    ).annotate(
+        ledger_created_at=F('ledger_entries__created_at'),
+        ledger_transaction_id=F('ledger_entries__transaction_id'),
+    ).select_related('sender', 'receiver')
+
+
+def filter_dates(queryset, field, data):
+    """Limit ``field`` to the whole local days in validated DateRangeSerializer data"""
+    if 'start_date' in data:
+        start = timezone.make_aware(datetime.combine(data['start_date'], time.min))
+        queryset = queryset.filter(**{f'{field}__gte': start})
+    if 'end_date' in data:
+        end = timezone.make_aware(datetime.combine(data['end_date'] + timedelta(days=1), time.min))
+        queryset = queryset.filter(**{f'{field}__lt': end})
+    return queryset
+
+
+def filter_transactions(queryset, data):
+    """Apply validated TransactionFilterSerializer data to user_transactions()"""
+    if 'transaction_type' in data:
+        queryset = queryset.filter(transaction_type=data['transaction_type'])
+    if 'status' in data:
+        queryset = queryset.filter(status=data['status'])
+    # Compare on the ledger timestamp so the range stays on the
+    # (account, created_at) index
+    return filter_dates(queryset, 'ledger_created_at', data)
+
+
+class ReplicaReadsMixin:
+    """
+    Read ``replica_actions`` from a replica (see my_app/routers.py) unless
+    the user is pinned to the primary; successful writes pin the user.
+    """
+    replica_actions = ()
+    replica_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (self.action in self.replica_actions and routers.get_replicas()
+                and not routers.is_pinned(request.user.pk)):
+            self.replica_token = routers.use_replica.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self.replica_token is not None:
+            routers.use_replica.reset(self.replica_token)
+            self.replica_token = None
+        elif (response.status_code < 400 and request.method not in SAFE_METHODS
+                and routers.get_replicas() and request.user.is_authenticated):
+            routers.pin_to_primary(request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class TransactionViewSet(ReplicaReadsMixin, viewsets.ModelViewSet):
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_fields = ('ledger_created_at', 'ledger_transaction_id')
+    # Not statement: it streams after the view returns
+    replica_actions = ('list', 'retrieve', 'history', 'balance')
+    throttle_scope = 'reads'
 
     def get_queryset(self):
-        user = self.request.user
-        return Transaction.objects.filter(
-            sender=user
-        ) | Transaction.objects.filter(receiver=user)
+        return user_transactions(self.request.user)
+
+    def filter_queryset(self, queryset):
+        filters = TransactionFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        self.filters = filters.validated_data
+        return filter_transactions(queryset, self.filters)
+
+    def get_page_data(self):
+        """Filter, paginate and serialize one page of the user's transactions"""
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.filters['fast']:
+            rows = TransactionValuesSerializer.values(queryset, *self.keyset_fields)
+            return TransactionValuesSerializer(self.paginate_queryset(rows)).data
+        return self.get_serializer(self.paginate_queryset(queryset), many=True).data
 
-    @action(detail=False, methods=['post'])
+    def list(self, request, *args, **kwargs):
+        return self.paginator.get_paginated_response(self.get_page_data())
+
+    @action(detail=False, methods=['post'], throttle_scope='money')
+    @idempotent
     def send_money(self, request):
         serializer = SendMoneySerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         sender = request.user
-        receiver_phone = serializer.validated_data['receiver_phone']
+        receiver = serializer.validated_data['receiver']
         amount = serializer.validated_data['amount']
         description = serializer.validated_data.get('description', '')
 
-        # Check if sending to self
-        if sender.phone_number == receiver_phone:
+        # Check if sending to self (under any spelling of the number)
+        if receiver.pk == sender.pk:
             return Response({
                 'error': 'Cannot send money to yourself'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check sufficient balance
-        if sender.balance < amount:
+        if transfer_queue.is_enabled():
+            # Applied by the process_transfers workers; the transaction's
+            # status tells the client how it went
+            txn = ledger.enqueue_transfer(sender, receiver, amount, description)
             return Response({
-                'error': 'Insufficient balance'
-            }, status=status.HTTP_400_BAD_REQUEST)
+                'message': 'Transfer queued',
+                'transaction': TransactionSerializer(txn).data
+            }, status=status.HTTP_202_ACCEPTED)
 
+        # Perform transaction
         try:
-            receiver = User.objects.get(phone_number=receiver_phone)
-        except User.DoesNotExist:
+            txn = ledger.transfer(sender, receiver, amount, description)
+        except ledger.InsufficientFunds:
+            return Response({
+                'error': 'Insufficient balance'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except ledger.AccountNotFound:
+            # Deactivated or deleted since it was resolved
             return Response({
                 'error': 'Receiver not found'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        # Perform transaction
-        with db_transaction.atomic():
-            # Deduct from sender
-            sender.balance -= amount
-            sender.save()
-
-            # Add to receiver
-            receiver.balance += amount
-            receiver.save()
-
-            # Create transaction record
-            txn = Transaction.objects.create(
-                sender=sender,
-                receiver=receiver,
-                amount=amount,
-                transaction_type='SEND',
-                status='COMPLETED',
-                description=description
-            )
-
         return Response({
             'message': 'Money sent successfully',
             'transaction': TransactionSerializer(txn).data,
             'new_balance': sender.balance
         }, status=status.HTTP_201_CREATED)
 
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], throttle_scope='money')
+    @idempotent
+    def bulk_send(self, request):
+        serializer = BulkSendSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        sender = request.user
+        results = ledger.bulk_transfer(sender, serializer.validated_data['transfers'])
+        completed = sum(1 for result in results if result['status'] == 'COMPLETED')
+
+        return Response({
+            'message': 'Bulk transfer processed',
+            'completed': completed,
+            'failed': len(results) - completed,
+            'results': results,
+            'new_balance': sender.balance
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], throttle_scope='money')
+    @idempotent
     def deposit(self, request):
         serializer = DepositSerializer(data=request.data)
         if not serializer.is_valid():
@@ -124,17 +221,7 @@ class TransactionViewSet(viewsets.ModelViewSet):
         amount = serializer.validated_data['amount']
         description = serializer.validated_data.get('description', 'Deposit')
 
-        with db_transaction.atomic():
-            user.balance += amount
-            user.save()
-
-            txn = Transaction.objects.create(
-                receiver=user,
-                amount=amount,
-                transaction_type='DEPOSIT',
-                status='COMPLETED',
-                description=description
-            )
+        txn = ledger.deposit(user, amount, description)
 
         return Response({
             'message': 'Deposit successful',
@@ -142,7 +229,8 @@ class TransactionViewSet(viewsets.ModelViewSet):
             'new_balance': user.balance
         }, status=status.HTTP_201_CREATED)
 
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], throttle_scope='money')
+    @idempotent
     def withdraw(self, request):
         serializer = WithdrawSerializer(data=request.data)
         if not serializer.is_valid():
@@ -152,23 +240,13 @@ class TransactionViewSet(viewsets.ModelViewSet):
         amount = serializer.validated_data['amount']
         description = serializer.validated_data.get('description', 'Withdrawal')
 
-        if user.balance < amount:
+        try:
+            txn = ledger.withdraw(user, amount, description)
+        except ledger.InsufficientFunds:
             return Response({
                 'error': 'Insufficient balance'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        with db_transaction.atomic():
-            user.balance -= amount
-            user.save()
-
-            txn = Transaction.objects.create(
-                sender=user,
-                amount=amount,
-                transaction_type='WITHDRAW',
-                status='COMPLETED',
-                description=description
-            )
-
         return Response({
             'message': 'Withdrawal successful',
             'transaction': TransactionSerializer(txn).data,
@@ -180,13 +258,58 @@ class TransactionViewSet(viewsets.ModelViewSet):
         user = request.user
         serializer = BalanceSerializer({
             'phone_number': user.phone_number,
-            'balance': user.balance,
+            'balance': ledger.current_balance(user.pk),
             'full_name': user.full_name
         })
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def statement(self, request):
+        """Stream the user's full statement (optionally date-ranged) as CSV or JSON Lines"""
+        serializer = StatementSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        params = serializer.validated_data
+        entries = filter_dates(statements.statement_entries(request.user), 'created_at', params)
+        output = params['output']
+        response = StreamingHttpResponse(
+            statements.STREAMERS[output](statements.statement_rows(entries)),
+            content_type=statements.CONTENT_TYPES[output]
+        )
+        period = '-'.join(str(params[key]) for key in ('start_date', 'end_date') if key in params)
+        filename = f"statement-{request.user.phone_number.lstrip('+')}{'-' + period if period else ''}.{output}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
     @action(detail=False, methods=['get'])
     def history(self, request):
-        transactions = self.get_queryset()[:20]  # Last 20 transactions
-        serializer = TransactionSerializer(transactions, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        # Keep the plain list body existing clients expect; further pages
+        # are linked from the Link header
+        return self.paginator.get_list_response(self.get_page_data())
+
+
+class CallbackViewSet(viewsets.GenericViewSet):
+    """The authenticated account's callback endpoint (see my_app/callbacks.py)"""
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'reads'
+
+    @action(detail=False, methods=['get', 'put', 'delete'])
+    def endpoint(self, request):
+        endpoint = CallbackEndpoint.objects.filter(user=request.user).first()
+        if request.method == 'DELETE':
+            if endpoint:
+                endpoint.delete()
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        if request.method == 'GET':
+            if endpoint is None:
+                return Response({'error': 'No callback endpoint registered'}, status=status.HTTP_404_NOT_FOUND)
+            return Response(CallbackEndpointSerializer(endpoint).data)
+
+        serializer = CallbackEndpointSerializer(endpoint, data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if endpoint is None:
+            endpoint = serializer.save(user=request.user, secret=callbacks.generate_secret())
+            return Response(CallbackEndpointSerializer(endpoint).data, status=status.HTTP_201_CREATED)
+        return Response(CallbackEndpointSerializer(serializer.save()).data)